@@ -1,6 +1,7 @@
 from flask import Flask, jsonify, redirect, request
 from flask_jwt_extended import JWTManager
 from config import Config
+from utils.helpers import bump_scopes_after_write
 from supabase import create_client, Client
 from routes.auth_routes import auth_bp
 from routes.dean_routes import dean_bp
@@ -11,6 +12,10 @@ from routes.admin_routes import admin_bp
 from routes.student_routes import student_bp
 from routes.doctor_routes import doctor_bp # New import
 from routes.owner_routes import owner_bp
+from routes.job_routes import job_bp
+from utils.jobs import init_jobs
+from utils.usage_logger import init_usage_logger
+from utils.scheduler import init_scheduler
 import os
 from flask_cors import CORS
 
@@ -22,8 +27,12 @@ def create_required_folders():
         os.makedirs(qr_folder)
         print(f"Created QR codes folder: {qr_folder}")
 
-def create_app():
-    """إنشاء التطبيق وإعداده"""
+def create_app(background_services: bool = True):
+    """إنشاء التطبيق وإعداده
+
+    background_services=False للسكربتات اليدوية: لا تُستأنف مهام الخادم الخلفية المنقطعة،
+    ولا يعمل مسجل الاستخدامات ولا حلقة المجدول (تبقى المهام مسجلة لتشغيلها بـ run_job_once).
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
 
@@ -114,6 +123,20 @@ def create_app():
     app.register_blueprint(student_bp, url_prefix='/api/students')
     app.register_blueprint(doctor_bp, url_prefix='/api/doctors') # New blueprint registration
     app.register_blueprint(owner_bp, url_prefix='/api/owner')
+    app.register_blueprint(job_bp, url_prefix='/api/jobs')
+
+    # Background jobs (uploads, PDF exports, QR regeneration) with ?async=true
+    init_jobs(app, recover=background_services)
+
+    # Buffered General-page usage logging (batched inserts, flushed on shutdown)
+    if background_services:
+        init_usage_logger(app)
+
+    # Maintenance scheduler (announcement sweep, postponement reverts, instructor name sync, ...)
+    init_scheduler(app, start=background_services)
+
+    # Invalidate public ETags (conditional GET) after successful writes
+    app.after_request(bump_scopes_after_write)
     
     # NOTE: early preflight handler was registered before blueprint registration to avoid
     # running any blueprint-level before_request handlers that might raise during preflight.
@@ -9,6 +9,11 @@ class Config:
     # JWT Configuration
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'your-secret-key-here-change-in-production'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
+    # Opt-in: embed role/department_id/permissions version as JWT claims so the
+    # auth decorators can authorize without reading the users table.
+    # Requires an integer `permissions_version` column (default 0) on users.
+    JWT_ROLE_CLAIMS = os.environ.get('JWT_ROLE_CLAIMS', 'false').lower() == 'true'
+    JWT_PERM_VERSION_TTL_SECONDS = int(os.environ.get('JWT_PERM_VERSION_TTL_SECONDS', 60))
     
     # Application Configuration
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
@@ -21,5 +26,60 @@ class Config:
     # Example: 'http://localhost:3033,https://hsabadi.pythonanywhere.com,https://hsabadj.pythonanywhere.com'
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://localhost:3033,https://www.it-college.zone.id')
     
+    # Public room timetable cache (invalidated on schedule writes; TTL bounds
+    # staleness from writes made outside this process, e.g. maintenance scripts)
+    ROOM_TIMETABLE_TTL_SECONDS = int(os.environ.get('ROOM_TIMETABLE_TTL_SECONDS', 300))
+    ROOM_TIMETABLE_CACHE_MAXSIZE = int(os.environ.get('ROOM_TIMETABLE_CACHE_MAXSIZE', 512))
+
+    # Conditional GET (ETag) index for the public endpoints
+    ETAG_INDEX_MAXSIZE = int(os.environ.get('ETAG_INDEX_MAXSIZE', 2048))
+    # Scope versions behind the ETags, shared by all server workers on this host (SQLite).
+    # Workers on other hosts do not see each other's writes: run a single host, or keep the
+    # ETag index TTL short there.
+    SCOPE_VERSIONS_DB_PATH = os.environ.get('SCOPE_VERSIONS_DB_PATH', os.path.join('instance', 'scope_versions.sqlite3'))
+
     # File Upload Configuration
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
\ No newline at end of file
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+
+    # Authenticated user cache (per process): short TTL, size-bounded LRU
+    USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', 30))
+    USER_CACHE_MAXSIZE = int(os.environ.get('USER_CACHE_MAXSIZE', 1024))
+
+    # Excel schedule uploads: rows per bulk insert request
+    SCHEDULE_INSERT_CHUNK_SIZE = int(os.environ.get('SCHEDULE_INSERT_CHUNK_SIZE', 500))
+    # General (multi-room) schedule upload: rooms processed concurrently
+    SCHEDULE_UPLOAD_MAX_WORKERS = int(os.environ.get('SCHEDULE_UPLOAD_MAX_WORKERS', 4))
+    # Excel uploads are streamed (openpyxl read-only) and processed in chunks of this many rows
+    EXCEL_INGEST_CHUNK_SIZE = int(os.environ.get('EXCEL_INGEST_CHUNK_SIZE', 500))
+
+    # 4-digit student ID / doctor code allocator (in-memory bitmap, reloaded after the TTL)
+    ID_ALLOCATOR_TTL_SECONDS = int(os.environ.get('ID_ALLOCATOR_TTL_SECONDS', 300))
+    ID_ALLOCATOR_WARN_OCCUPANCY = float(os.environ.get('ID_ALLOCATOR_WARN_OCCUPANCY', 0.8))
+    # In-memory set of doctor codes used by the student/doctor code conflict check
+    DOCTOR_CODES_TTL_SECONDS = int(os.environ.get('DOCTOR_CODES_TTL_SECONDS', 600))
+
+    # Background jobs (?async=true on uploads/exports): SQLite status table + in-process worker pool
+    JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', os.path.join('instance', 'jobs.sqlite3'))
+    JOBS_MAX_WORKERS = int(os.environ.get('JOBS_MAX_WORKERS', 2))
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 2))
+    JOBS_RETENTION_HOURS = int(os.environ.get('JOBS_RETENTION_HOURS', 24))
+    JOBS_TOKEN_TTL_SECONDS = int(os.environ.get('JOBS_TOKEN_TTL_SECONDS', 300))
+
+    # General-page usage logging: buffered in memory and written in batches
+    USAGE_LOG_BATCH_SIZE = int(os.environ.get('USAGE_LOG_BATCH_SIZE', 100))
+    USAGE_LOG_FLUSH_INTERVAL_MS = int(os.environ.get('USAGE_LOG_FLUSH_INTERVAL_MS', 1000))
+    USAGE_LOG_MAX_QUEUE = int(os.environ.get('USAGE_LOG_MAX_QUEUE', 10000))
+
+    # Shared statistics snapshot (owner/dean/department dashboards); also rebuilt after local writes
+    STATS_SNAPSHOT_TTL_SECONDS = int(os.environ.get('STATS_SNAPSHOT_TTL_SECONDS', 120))
+
+    # In-process scheduler for periodic maintenance jobs
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+    SCHEDULER_MAX_WORKERS = int(os.environ.get('SCHEDULER_MAX_WORKERS', 2))
+    # Each interval is stretched by a random 0..ratio share so server workers do not fire together
+    SCHEDULER_JITTER_RATIO = float(os.environ.get('SCHEDULER_JITTER_RATIO', 0.1))
+    SCHEDULER_HISTORY_SIZE = int(os.environ.get('SCHEDULER_HISTORY_SIZE', 20))
+    SCHEDULER_LOCK_DIR = os.environ.get('SCHEDULER_LOCK_DIR', os.path.join('instance', 'scheduler'))
+    ANNOUNCEMENT_SWEEP_INTERVAL_SECONDS = int(os.environ.get('ANNOUNCEMENT_SWEEP_INTERVAL_SECONDS', 300))
+    POSTPONEMENT_REVERT_INTERVAL_SECONDS = int(os.environ.get('POSTPONEMENT_REVERT_INTERVAL_SECONDS', 900))
+    INSTRUCTOR_SYNC_INTERVAL_SECONDS = int(os.environ.get('INSTRUCTOR_SYNC_INTERVAL_SECONDS', 86400))
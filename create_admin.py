@@ -11,7 +11,7 @@ from backend.models import db, User
 
 def add_admin_user():
     """إنشاء مستخدم عميد أول في قاعدة البيانات"""
-    app = create_app()
+    app = create_app(background_services=False)
     with app.app_context():
         print("Creating database tables if they don't exist...")
         db.create_all()
@@ -18,7 +18,7 @@ def generate_password(length: int = 14) -> str:
 
 
 def main(username=None, email=None, full_name=None, password=None):
-    app = create_app()
+    app = create_app(background_services=False)
     with app.app_context():
         # توليد بيانات افتراضية إذا لم تُقدّم
         suffix = datetime.utcnow().strftime('%Y%m%d%H%M%S')[-8:]
@@ -1,9 +1,13 @@
 from supabase import Client
-from flask import current_app
+from flask import current_app, g, has_request_context
+import base64
 import bcrypt
 import hashlib
-import random
-from datetime import datetime
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from utils.cache import get_app_cache
 
 
 def get_supabase() -> Client:
@@ -15,6 +19,97 @@ def get_user_by_username(username: str):
     response = supabase.table('users').select('*').eq('username', username).execute()
     return response.data[0] if response.data else None
 
+def _get_user_cache():
+    return get_app_cache(
+        current_app,
+        'users',
+        maxsize=current_app.config.get('USER_CACHE_MAXSIZE', 1024),
+        ttl=current_app.config.get('USER_CACHE_TTL_SECONDS', 30),
+    )
+
+def get_cached_user_by_username(username: str):
+    """Get a user by username through a request-scoped memo and a short-TTL LRU.
+
+    Used by the auth decorators so an authenticated request costs at most one
+    `users` lookup. Returns a copy, so callers may mutate the result freely.
+    """
+    if not username:
+        return None
+    memo = g.setdefault('_user_memo', {}) if has_request_context() else {}
+    if username in memo:
+        user = memo[username]
+    else:
+        cache = _get_user_cache()
+        user = cache.get(username)
+        if user is None:
+            user = get_user_by_username(username)
+            if user:
+                cache.set(username, user)
+        memo[username] = user
+    return dict(user) if user else None
+
+def invalidate_user_cache(user_id=None, username: str = None):
+    """Drop a user from the cache (by id and/or username) after it was updated or deleted."""
+    cache = _get_user_cache()
+    if username:
+        cache.pop(username)
+    if user_id is not None:
+        cache.pop_where(lambda _, u: str(u.get('id')) == str(user_id))
+        _get_permissions_version_cache().pop(str(user_id))
+    if has_request_context():
+        g.pop('_user_memo', None)
+
+# Changes to these columns invalidate role/department claims already issued in JWTs
+PERMISSION_FIELDS = ('role', 'department_id', 'is_active', 'username')
+
+def build_user_claims(user: dict) -> dict:
+    """Additional JWT claims for the opt-in role-claims token format (JWT_ROLE_CLAIMS)."""
+    return {
+        'uid': user.get('id'),
+        'role': user.get('role'),
+        'department_id': user.get('department_id'),
+        'perm_ver': user.get('permissions_version') or 0,
+    }
+
+def _get_permissions_version_cache():
+    return get_app_cache(
+        current_app,
+        'permissions_versions',
+        maxsize=current_app.config.get('USER_CACHE_MAXSIZE', 1024),
+        ttl=current_app.config.get('JWT_PERM_VERSION_TTL_SECONDS', 60),
+    )
+
+def get_permissions_version(user_id):
+    """Current permissions_version of a user (cached briefly), or None if the user no longer exists."""
+    cache = _get_permissions_version_cache()
+    version = cache.get(str(user_id))
+    if version is None:
+        supabase = get_supabase()
+        response = supabase.table('users').select('permissions_version').eq('id', user_id).execute()
+        if not response.data:
+            return None
+        version = response.data[0].get('permissions_version') or 0
+        cache.set(str(user_id), version)
+    return version
+
+def apply_permissions_bump(user_id, update_data: dict, current_user: dict = None) -> dict:
+    """Increment `permissions_version` in `update_data` when a permission field changes.
+
+    Only active with JWT_ROLE_CLAIMS; tokens carrying the old version are then no
+    longer trusted by the auth decorators and fall back to a database lookup.
+    """
+    if not current_app.config.get('JWT_ROLE_CLAIMS'):
+        return update_data
+    if not any(field in update_data for field in PERMISSION_FIELDS):
+        return update_data
+    if current_user is None:
+        supabase = get_supabase()
+        response = supabase.table('users').select('*').eq('id', user_id).execute()
+        current_user = response.data[0] if response.data else {}
+    if any(field in update_data and update_data[field] != current_user.get(field) for field in PERMISSION_FIELDS):
+        update_data['permissions_version'] = (current_user.get('permissions_version') or 0) + 1
+    return update_data
+
 def get_user_by_email(email: str):
     supabase = get_supabase()
     response = supabase.table('users').select('*').eq('email', email).execute()
@@ -35,12 +130,15 @@ def get_all_users():
 
 def update_user(user_id: int, data: dict):
     supabase = get_supabase()
+    apply_permissions_bump(user_id, data)
     response = supabase.table('users').update(data).eq('id', user_id).execute()
+    invalidate_user_cache(user_id=user_id)
     return response.data[0] if response.data else None
 
 def delete_user(user_id: int):
     supabase = get_supabase()
     response = supabase.table('users').delete().eq('id', user_id).execute()
+    invalidate_user_cache(user_id=user_id)
     return response.data
 
 def check_password(password_hash: str, password: str) -> bool:
@@ -67,6 +165,28 @@ def get_room_by_code(code: str):
     response = supabase.table('rooms').select('*').eq('code', code).execute()
     return response.data[0] if response.data else None
 
+def get_room_timetable_cache():
+    """Cache of built public room timetables keyed by (room_code, study_type).
+
+    Entries hold `room_id`, `versions` (shared scope versions when built), `payload`,
+    `etag` and `last_modified`; an entry whose versions differ from the current ones is a miss.
+    """
+    return get_app_cache(
+        current_app,
+        'room_timetables',
+        maxsize=current_app.config.get('ROOM_TIMETABLE_CACHE_MAXSIZE', 512),
+        ttl=current_app.config.get('ROOM_TIMETABLE_TTL_SECONDS', 300),
+    )
+
+def invalidate_room_timetables(*room_ids):
+    """Drop cached timetables of the given rooms; with no ids, drop all of them."""
+    cache = get_room_timetable_cache()
+    ids = {str(room_id) for room_id in room_ids if room_id is not None}
+    if not room_ids:
+        cache.clear()
+    elif ids:
+        cache.pop_where(lambda _, entry: str(entry.get('room_id')) in ids)
+
 # --- Schedule Model Functions ---
 def get_schedules_by_room_id(room_id: int):
     supabase = get_supabase()
@@ -125,30 +245,73 @@ def get_schedules_by_section_and_stage(section: str, stage: str, group: str, stu
         and matches_group(s.get('group'), s.get('group_letter'), group)
     ]
 
-    # Enrich each schedule with schedule_doctors (primary + assistants) and
-    # ensure instructor_name is filled from primary doctor when missing.
-    for s in filtered:
+    # Enrich all schedules with schedule_doctors (primary + assistants) and
+    # display fields using one bulk junction fetch.
+    enrich_schedules(filtered)
+
+    return filtered
+
+@lru_cache(maxsize=1024)
+def _format_time_12(time_str: str) -> str:
+    """Convert 'HH:MM:SS' or 'HH:MM' to 12-hour format with Arabic AM/PM markers."""
+    if not time_str:
+        return ''
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            t = datetime.strptime(time_str, fmt)
+            out = t.strftime('%I:%M %p').lstrip('0')
+            # Replace AM/PM with Arabic equivalents
+            out = out.replace('AM', 'ص').replace('PM', 'م')
+            return out
+        except Exception:
+            continue
+    # If parsing fails, return original string
+    return time_str
+
+def _schedule_doctor_name(entry):
+    """Doctor name of a schedule_doctors entry (nested `doctors` or a flat name)."""
+    if not isinstance(entry, dict):
+        return None
+    if entry.get('doctors') and isinstance(entry.get('doctors'), dict):
+        return entry['doctors'].get('name')
+    # Some responses may include a flat doctor_name
+    return entry.get('doctor_name') or entry.get('name')
+
+def enrich_schedules(schedules: list, doctor_id: int = None):
+    """Add schedule_doctors and all display fields to a list of schedules in one pass.
+
+    Uses a single bulk junction fetch (`attach_schedule_doctors`) and a table of
+    12-hour times parsed once per distinct time string. When `doctor_id` is given,
+    `this_doctor_role` / `this_doctor_role_display` are set for that doctor.
+    Enrichment is best-effort: a failing row is logged and left as-is.
+    """
+    schedules = schedules or []
+    attach_schedule_doctors(schedules)
+
+    def start_key(s):
+        return s.get('postponed_start_time') or s.get('start_time') or ''
+
+    def end_key(s):
+        return s.get('postponed_end_time') or s.get('end_time') or ''
+
+    time_table = {t: _format_time_12(t) for s in schedules for t in (start_key(s), end_key(s))}
+
+    for s in schedules:
         try:
-            sd = get_schedule_doctors(s.get('id')) or []
-            # attach raw schedule_doctors to the schedule object
-            s['schedule_doctors'] = sd
+            sd = s.get('schedule_doctors') or []
 
             primary = None
             assistants = []
             for entry in sd:
-                # Each entry may contain nested doctors info under 'doctors'
-                doc = None
-                if isinstance(entry, dict):
-                    if entry.get('doctors') and isinstance(entry.get('doctors'), dict):
-                        doc = entry['doctors'].get('name')
-                    else:
-                        # Some responses may include a flat doctor_name
-                        doc = entry.get('doctor_name') or entry.get('name')
+                doc = _schedule_doctor_name(entry)
                 if entry.get('is_primary'):
                     primary = doc or primary
-                else:
-                    if doc:
-                        assistants.append(doc)
+                elif doc:
+                    assistants.append(doc)
+
+                # Role labels (primary/assistant) for each schedule_doctors entry
+                entry['role'] = 'primary' if entry.get('is_primary') else 'assistant'
+                entry['role_display'] = 'أساسي' if entry.get('is_primary') else 'مساعد'
 
             s['primary_doctor_name'] = primary
             s['assistants'] = assistants
@@ -159,8 +322,8 @@ def get_schedules_by_section_and_stage(section: str, stage: str, group: str, stu
 
             # Canonical display fields for frontend convenience
             # Prefer postponed times/room when present
-            s['start_display'] = s.get('postponed_start_time') or s.get('start_time') or ''
-            s['end_display'] = s.get('postponed_end_time') or s.get('end_time') or ''
+            s['start_display'] = start_key(s)
+            s['end_display'] = end_key(s)
             s['display_room_name'] = (
                 s.get('postponed_room_name')
                 or s.get('postponed_to_room_id') and None
@@ -169,31 +332,47 @@ def get_schedules_by_section_and_stage(section: str, stage: str, group: str, stu
                 or s.get('room')
                 or ''
             )
+            s['start_display_12'] = time_table.get(s['start_display'], '')
+            s['end_display_12'] = time_table.get(s['end_display'], '')
+
+            # Structured room info (name and code)
+            s['display_room'] = {
+                'name': s.get('display_room_name') or '',
+                'code': (s.get('rooms') and s.get('rooms').get('code')) or s.get('room_code') or ''
+            }
+
+            # Lecture type display and appropriate group/section field
+            lt = (s.get('lecture_type') or '').lower()
+            if 'practic' in lt or 'عملي' in lt:
+                s['lecture_type_display'] = 'عملي'
+                s['group_display'] = s.get('group') or s.get('group_letter') or ''
+                s['section_display'] = None
+            else:
+                s['lecture_type_display'] = 'نظري'
+                s['section_display'] = s.get('section') or s.get('section_number') or ''
+                s['group_display'] = None
+
+            # Role of the requested doctor for this schedule (if present)
+            if doctor_id is not None:
+                found_role = None
+                if s.get('doctor_id') == doctor_id:
+                    found_role = 'primary'
+                else:
+                    for entry in sd:
+                        entry_doc_id = entry.get('doctor_id') or (entry.get('doctors') and entry.get('doctors').get('id'))
+                        if entry_doc_id == doctor_id:
+                            found_role = 'primary' if entry.get('is_primary') else 'assistant'
+                            break
+                s['this_doctor_role'] = found_role
+                s['this_doctor_role_display'] = {'primary': 'أساسي', 'assistant': 'مساعد'}.get(found_role)
         except Exception as e:
             # Best-effort enrichment; do not fail the whole request because of enrichment issues
             try:
-                current_app.logger.warning(f'get_schedules_by_section_and_stage: failed enriching schedule {s.get("id")}: {e}')
+                current_app.logger.warning(f'enrich_schedules: failed enriching schedule {s.get("id")}: {e}')
             except Exception:
                 # ignore logging failures
                 pass
-
-    return filtered
-
-def _format_time_12(time_str: str) -> str:
-    """Convert 'HH:MM:SS' or 'HH:MM' to 12-hour format with Arabic AM/PM markers."""
-    if not time_str:
-        return ''
-    for fmt in ('%H:%M:%S', '%H:%M'):
-        try:
-            t = datetime.strptime(time_str, fmt)
-            out = t.strftime('%I:%M %p').lstrip('0')
-            # Replace AM/PM with Arabic equivalents
-            out = out.replace('AM', 'ص').replace('PM', 'م')
-            return out
-        except Exception:
-            continue
-    # If parsing fails, return original string
-    return time_str
+    return schedules
 
 def get_schedules_by_doctor_id(doctor_id: int):
     """Return schedules associated with a doctor.
@@ -229,111 +408,7 @@ def get_schedules_by_doctor_id(doctor_id: int):
                     results.append(s)
 
         # Enrich results with helpful display fields and doctor-role information
-        for s in results:
-            try:
-                sd = get_schedule_doctors(s.get('id')) or []
-                # attach raw schedule_doctors to the schedule object
-                s['schedule_doctors'] = sd
-
-                primary = None
-                assistants = []
-                for entry in sd:
-                    # Each entry may contain nested doctors info under 'doctors'
-                    doc = None
-                    if isinstance(entry, dict):
-                        if entry.get('doctors') and isinstance(entry.get('doctors'), dict):
-                            doc = entry['doctors'].get('name')
-                        else:
-                            # Some responses may include a flat doctor_name
-                            doc = entry.get('doctor_name') or entry.get('name')
-                    if entry.get('is_primary'):
-                        primary = doc or primary
-                    else:
-                        if doc:
-                            assistants.append(doc)
-
-                s['primary_doctor_name'] = primary
-                s['assistants'] = assistants
-
-                # Fallback: if legacy instructor_name is empty, use primary doctor's name
-                if not s.get('instructor_name') and primary:
-                    s['instructor_name'] = primary
-
-                # Canonical display fields for frontend convenience
-                # Prefer postponed times/room when present
-                s['start_display'] = s.get('postponed_start_time') or s.get('start_time') or ''
-                s['end_display'] = s.get('postponed_end_time') or s.get('end_time') or ''
-                s['display_room_name'] = (
-                    s.get('postponed_room_name')
-                    or s.get('postponed_to_room_id') and None
-                    or s.get('room_name')
-                    or (s.get('rooms') and s.get('rooms').get('name'))
-                    or s.get('room')
-                    or ''
-                )
-
-                # --- New enrichments requested by UI ---
-                # 1) Add 12-hour formatted time strings
-                s['start_display_12'] = _format_time_12(s.get('start_display'))
-                s['end_display_12'] = _format_time_12(s.get('end_display'))
-
-                # 2) Add structured room info (name and code)
-                s['display_room'] = {
-                    'name': s.get('display_room_name') or '',
-                    'code': (s.get('rooms') and s.get('rooms').get('code')) or s.get('room_code') or ''
-                }
-
-                # 3) Lecture type display and appropriate group/section field
-                lt = (s.get('lecture_type') or '').lower()
-                if 'practic' in lt or 'عملي' in lt:
-                    s['lecture_type_display'] = 'عملي'
-                    s['group_display'] = s.get('group') or s.get('group_letter') or ''
-                    s['section_display'] = None
-                else:
-                    s['lecture_type_display'] = 'نظري'
-                    s['section_display'] = s.get('section') or s.get('section_number') or ''
-                    s['group_display'] = None
-
-                # 4) Enrich schedule_doctors entries with role labels (primary/assistant)
-                for entry in sd:
-                    try:
-                        entry['role'] = 'primary' if entry.get('is_primary') else 'assistant'
-                        entry['role_display'] = 'أساسي' if entry.get('is_primary') else 'مساعد'
-                    except Exception:
-                        # best-effort, do not fail
-                        pass
-
-                # 5) Mark the role of the requested doctor for this schedule (if present)
-                try:
-                    if s.get('doctor_id') == doctor_id:
-                        s['this_doctor_role'] = 'primary'
-                        s['this_doctor_role_display'] = 'أساسي'
-                    else:
-                        found_role = None
-                        for entry in sd:
-                            entry_doc_id = entry.get('doctor_id') or (entry.get('doctors') and entry.get('doctors').get('id'))
-                            if entry_doc_id == doctor_id:
-                                found_role = 'primary' if entry.get('is_primary') else 'assistant'
-                                break
-                        if found_role == 'primary':
-                            s['this_doctor_role'] = 'primary'
-                            s['this_doctor_role_display'] = 'أساسي'
-                        elif found_role == 'assistant':
-                            s['this_doctor_role'] = 'assistant'
-                            s['this_doctor_role_display'] = 'مساعد'
-                        else:
-                            s['this_doctor_role'] = None
-                            s['this_doctor_role_display'] = None
-                except Exception:
-                    pass
-
-            except Exception as e:
-                # Best-effort enrichment; do not fail the whole request because of enrichment issues
-                try:
-                    current_app.logger.warning(f'get_schedules_by_doctor_id: failed enriching schedule {s.get("id")}: {e}')
-                except Exception:
-                    # ignore logging failures
-                    pass
+        enrich_schedules(results, doctor_id=doctor_id)
 
         return results
     except Exception:
@@ -349,6 +424,28 @@ def get_all_announcements():
     response = supabase.table('announcements').select('*').execute()
     return response.data
 
+def announcement_not_expired_filter(now: datetime = None) -> str:
+    """PostgREST or_() filter for announcements that have not expired yet."""
+    now = now or datetime.now(timezone.utc)
+    return f'expires_at.is.null,expires_at.gt."{now.isoformat()}"'
+
+def delete_expired_announcements(now: datetime = None):
+    """Delete every announcement whose expires_at has passed in one range-filtered request.
+
+    Returns the deleted rows (id, title, expires_at).
+    """
+    now = now or datetime.now(timezone.utc)
+    response = (
+        get_supabase().table('announcements')
+        .delete()
+        .lt('expires_at', now.isoformat())
+        .execute()
+    )
+    return [
+        {'id': row.get('id'), 'title': row.get('title'), 'expires_at': row.get('expires_at')}
+        for row in (response.data or [])
+    ]
+
 # --- Doctor Model Functions ---
 def get_all_doctors():
     supabase = get_supabase()
@@ -400,29 +497,48 @@ def get_doctor_by_code(code_value):
             pass
         return None
 
+# --- Doctor code set (in-memory, maintained by create/update/delete_doctor) ---
+_doctor_codes_lock = threading.Lock()
+
+def _get_doctor_codes_cache():
+    return get_app_cache(
+        current_app,
+        'doctor_codes',
+        maxsize=1,
+        ttl=current_app.config.get('DOCTOR_CODES_TTL_SECONDS', 600),
+    )
+
+def get_doctor_codes() -> set:
+    """Set of every doctors.doctor_code, loaded once (paged) and kept up to date incrementally."""
+    cache = _get_doctor_codes_cache()
+    codes = cache.get('codes')
+    if codes is None:
+        rows = select_all_pages(get_supabase().table('doctors').select('doctor_code').order('id'))
+        codes = {int(d['doctor_code']) for d in rows if str(d.get('doctor_code') or '').isdigit()}
+        cache.set('codes', codes)
+    return codes
+
+def _update_doctor_codes(add=None, remove=None):
+    codes = _get_doctor_codes_cache().get('codes')
+    if codes is None:
+        return  # Not loaded yet; the next read loads a fresh set
+    with _doctor_codes_lock:
+        if remove is not None and str(remove).isdigit():
+            codes.discard(int(remove))
+        if add is not None and str(add).isdigit():
+            codes.add(int(add))
+
+def student_id_conflicts_with_doctor(student_id) -> bool:
+    """True when a numeric student_id equals an existing doctor_code (checked in memory)."""
+    return student_id is not None and str(student_id).isdigit() and int(student_id) in get_doctor_codes()
+
 # Helper: generate unique 4-digit doctor_code
-def _generate_unique_doctor_code(supabase: Client, max_attempts: int = 20000) -> int:
-    """Generate a unique 4-digit integer (1000-9999) that does not exist in doctors.doctor_code
-    or in students.student_id (as text).
+def _generate_unique_doctor_code(supabase: Client = None) -> int:
+    """Reserve a unique 4-digit integer (1000-9999) that is neither a doctors.doctor_code
+    nor a students.student_id, from the in-memory ID allocator (no probe queries).
     """
-    attempts = 0
-    while attempts < max_attempts:
-        attempts += 1
-        code = random.randint(1000, 9999)
-        try:
-            # Check doctors table
-            resp = supabase.table('doctors').select('id').eq('doctor_code', code).limit(1).execute()
-            if resp.data:
-                continue
-            # Also ensure no student uses this code (student_id stored as text/string)
-            resp2 = supabase.table('students').select('student_id').eq('student_id', str(code)).limit(1).execute()
-            if resp2.data:
-                continue
-            return code
-        except Exception:
-            # If DB check fails for some reason, allow a few more attempts before propagating
-            continue
-    raise Exception('Unable to generate unique 4-digit doctor_code after %d attempts' % max_attempts)
+    from utils.id_allocator import reserve_doctor_code
+    return reserve_doctor_code()
 
 def create_doctor(data: dict):
     supabase = get_supabase()
@@ -439,17 +555,43 @@ def create_doctor(data: dict):
             # Re-raise to prevent inserting invalid nulls for a not-null column
             raise
 
+    else:
+        from utils.id_allocator import mark_ids_used
+        mark_ids_used(data['doctor_code'])
+
     response = supabase.table('doctors').insert(data).execute()
+    if response.data:
+        _update_doctor_codes(add=response.data[0].get('doctor_code'))
     return response.data[0] if response.data else None
 
 def update_doctor(doctor_id: int, data: dict):
     supabase = get_supabase()
+    previous_code = None
+    if 'doctor_code' in data:
+        previous = supabase.table('doctors').select('doctor_code').eq('id', doctor_id).execute()
+        previous_code = previous.data[0].get('doctor_code') if previous.data else None
     response = supabase.table('doctors').update(data).eq('id', doctor_id).execute()
+    if 'doctor_code' in data and response.data:
+        _update_doctor_codes(add=response.data[0].get('doctor_code'), remove=previous_code)
+    if 'name' in data and response.data:
+        # Keep schedules.instructor_name in step with a renamed doctor (only this doctor's schedules)
+        from utils.maintenance import sync_instructor_names
+        try:
+            sync_instructor_names(doctor_id=doctor_id)
+        except Exception:
+            current_app.logger.exception('Failed to sync instructor names for doctor %s', doctor_id)
+    # Doctor names are rendered in every room timetable they teach in
+    invalidate_room_timetables()
     return response.data[0] if response.data else None
 
 def delete_doctor(doctor_id: int):
     supabase = get_supabase()
     response = supabase.table('doctors').delete().eq('id', doctor_id).execute()
+    invalidate_room_timetables()
+    if response.data:
+        _update_doctor_codes(remove=response.data[0].get('doctor_code'))
+        from utils.id_allocator import release_ids
+        release_ids(response.data[0].get('doctor_code'))
     return response.data[0] if response.data else None
 
 # --- Schedule-Doctor Junction Functions ---
@@ -486,6 +628,144 @@ def get_schedule_doctors(schedule_id: int):
     )
     return response.data
 
+# Upper bound for ids sent in one PostgREST `in.(...)` filter; longer lists are
+# split so the request URL stays well below proxy limits.
+IN_FILTER_CHUNK_SIZE = 150
+
+def _chunked(items, size: int = IN_FILTER_CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# PostgREST caps every response at 1000 rows
+SELECT_PAGE_SIZE = 1000
+
+def select_all_pages(query, page_size: int = SELECT_PAGE_SIZE) -> list:
+    """Run a select query page by page with .range() and return every row.
+
+    The query should be ordered (e.g. .order('id')) so pages do not overlap or skip rows.
+    """
+    rows = []
+    offset = 0
+    while True:
+        page = query.range(offset, offset + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        offset += page_size
+
+# Room deletion runs as one transaction when this function is installed in Supabase:
+#
+#   create or replace function delete_room_cascade(p_room_id bigint) returns integer
+#   language plpgsql as $$
+#   declare v_ids bigint[]; v_count integer;
+#   begin
+#       select coalesce(array_agg(distinct x), '{}') into v_ids from (
+#           select id as x from schedules
+#           where p_room_id in (room_id, original_room_id, postponed_to_room_id)
+#           union
+#           select moved_to_schedule_id from schedules
+#           where p_room_id in (room_id, original_room_id, postponed_to_room_id)
+#             and moved_to_schedule_id is not null
+#       ) s;
+#       delete from schedule_doctors where schedule_id = any(v_ids);
+#       update schedules set moved_to_schedule_id = null where moved_to_schedule_id = any(v_ids);
+#       update schedules set original_schedule_id = null where original_schedule_id = any(v_ids);
+#       delete from announcements where room_id = p_room_id;
+#       delete from schedules where id = any(v_ids);
+#       get diagnostics v_count = row_count;
+#       delete from rooms where id = p_room_id;
+#       return v_count;
+#   end $$;
+
+def _room_schedule_ids(room_id: int) -> list:
+    """Schedules that live in, were moved from, or were postponed to the room, plus their move targets."""
+    rows = select_all_pages(
+        get_supabase().table('schedules')
+        .select('id, moved_to_schedule_id')
+        .or_(f'room_id.eq.{room_id},original_room_id.eq.{room_id},postponed_to_room_id.eq.{room_id}')
+        .order('id')
+    )
+    ids = {row['id'] for row in rows}
+    ids.update(row['moved_to_schedule_id'] for row in rows if row.get('moved_to_schedule_id'))
+    return sorted(ids)
+
+def delete_room_cascade(room_id: int) -> dict:
+    """Delete a room with its schedules, schedule_doctors rows and announcements.
+
+    Uses the delete_room_cascade RPC (a single all-or-nothing transaction) when available.
+    Otherwise it falls back to a handful of `in_`-batched statements per IN_FILTER_CHUNK_SIZE
+    ids. They run in dependency order and the room row goes last, so a failed run leaves the
+    room in place and can simply be retried.
+    """
+    supabase = get_supabase()
+    try:
+        response = supabase.rpc('delete_room_cascade', {'p_room_id': room_id}).execute()
+        invalidate_room_timetables()
+        return {'mode': 'rpc', 'schedules_deleted': response.data or 0}
+    except Exception as e:
+        if 'PGRST202' not in str(e) and 'Could not find the function' not in str(e):
+            raise
+
+    schedule_ids = _room_schedule_ids(room_id)
+    for chunk in _chunked(schedule_ids):
+        supabase.table('schedule_doctors').delete().in_('schedule_id', chunk).execute()
+        supabase.table('schedules').update({'moved_to_schedule_id': None}).in_('moved_to_schedule_id', chunk).execute()
+        supabase.table('schedules').update({'original_schedule_id': None}).in_('original_schedule_id', chunk).execute()
+    supabase.table('announcements').delete().eq('room_id', room_id).execute()
+    for chunk in _chunked(schedule_ids):
+        supabase.table('schedules').delete().in_('id', chunk).execute()
+    supabase.table('rooms').delete().eq('id', room_id).execute()
+    invalidate_room_timetables()
+    return {'mode': 'batched', 'schedules_deleted': len(schedule_ids)}
+
+def get_schedule_doctors_bulk(schedule_ids):
+    """Get doctors for many schedules at once, grouped by schedule_id.
+
+    Issues one `in_` query per chunk of ids instead of one query per schedule.
+    Every requested id is present in the result (empty list when it has no doctors),
+    and entries keep the primary-first ordering of `get_schedule_doctors`.
+    """
+    supabase = get_supabase()
+    ids = list(dict.fromkeys(sid for sid in schedule_ids if sid is not None))
+    grouped = {sid: [] for sid in ids}
+    for chunk in _chunked(ids):
+        response = (
+            supabase.table('schedule_doctors')
+            .select('*, doctors!schedule_doctors_doctor_id_fkey(id, name)')
+            .in_('schedule_id', chunk)
+            .order('is_primary', desc=True)
+            .execute()
+        )
+        for entry in response.data or []:
+            grouped.setdefault(entry.get('schedule_id'), []).append(entry)
+    return grouped
+
+def attach_schedule_doctors(schedules: list):
+    """Attach `schedule_doctors` and the multiple-doctor display fields
+    (`multiple_doctors_names`, `primary_doctor_name`, `has_multiple_doctors`)
+    to every schedule using a single bulk junction fetch.
+    """
+    schedules = schedules or []
+    doctors_by_schedule = get_schedule_doctors_bulk(s.get('id') for s in schedules)
+    for s in schedules:
+        entries = doctors_by_schedule.get(s.get('id'), [])
+        s['schedule_doctors'] = entries
+
+        doctor_names = []
+        primary_doctor = None
+        for sd in entries:
+            doctor_name = (sd.get('doctors') or {}).get('name', '')
+            if doctor_name:  # Only add non-empty names
+                if sd.get('is_primary'):
+                    primary_doctor = doctor_name
+                doctor_names.append(doctor_name)
+
+        s['multiple_doctors_names'] = doctor_names
+        s['primary_doctor_name'] = primary_doctor
+        s['has_multiple_doctors'] = len(doctor_names) > 1
+    return schedules
+
 def get_doctor_schedules_with_colleagues(doctor_id: int):
     """Get all schedules for a doctor including colleague information"""
     supabase = get_supabase()
@@ -527,33 +807,23 @@ def create_student(data: dict):
     supabase = get_supabase()
     # Check for conflict: student_id must not equal any doctor's doctor_code
     student_id = data.get('student_id')
-    if student_id is not None:
-        try:
-            # Compare as text: if student_id is numeric string, compare to doctor_code as text
-            resp = supabase.table('doctors').select('id').eq('doctor_code', int(student_id) if str(student_id).isdigit() else None).execute()
-            if resp.data:
-                raise ValueError('student_id conflicts with an existing doctor code')
-            # Additional safe check by string compare in case student_id is string of digits
-            resp2 = supabase.table('doctors').select('id').eq('doctor_code', int(student_id) if str(student_id).isdigit() else None).execute()
-            if resp2.data:
-                raise ValueError('student_id conflicts with an existing doctor code')
-        except ValueError:
-            # re-raise known conflict
-            raise
-        except Exception:
-            # If DB check failed (e.g., student_id non-numeric), do a string check
-            try:
-                resp3 = supabase.table('doctors').select('id').execute()
-                if resp3.data:
-                    for d in resp3.data:
-                        # defensive: compare string forms
-                        if str(d.get('doctor_code', '')) == str(student_id):
-                            raise ValueError('student_id conflicts with an existing doctor code')
-            except Exception:
-                # If all checks fail due to DB issues, allow insert to proceed and let DB triggers handle conflicts
-                pass
+    try:
+        conflict = student_id_conflicts_with_doctor(student_id)
+    except Exception:
+        # The code set could not be loaded: check this one code directly (errors propagate)
+        conflict = (
+            student_id is not None and str(student_id).isdigit()
+            and bool(
+                supabase.table('doctors').select('id').eq('doctor_code', int(student_id)).limit(1).execute().data
+            )
+        )
+    if conflict:
+        raise ValueError('student_id conflicts with an existing doctor code')
 
     response = supabase.table('students').insert(data).execute()
+    if student_id is not None:
+        from utils.id_allocator import mark_ids_used
+        mark_ids_used(student_id)
     return response.data[0] if response.data else None
 
 def update_student(student_id: str, data: dict):
@@ -574,6 +844,9 @@ def get_all_student_ids():
 def delete_student(student_id: str):
     supabase = get_supabase()
     response = supabase.table('students').delete().eq('student_id', student_id).execute()
+    if response.data:
+        from utils.id_allocator import release_ids
+        release_ids(student_id)
     return response.data[0] if response.data else None
 
 def search_students(query: str, department_id: int = None):
@@ -637,18 +910,31 @@ def get_student_full_schedule(student_id: str):
     schedule_data = get_schedules_by_section_and_stage(student_section, normalized_stage, student_group, normalized_study_type)
     return schedule_data
 
+def build_general_page_usage(student_id: str, student_name: str = None, page: str = 'general', meta: dict = None) -> dict:
+    """Build a general_student_usage row (used_at is stamped by the caller when batching)."""
+    return {
+        'student_id': str(student_id) if student_id is not None else None,
+        'student_name': student_name,
+        'page': page,
+        'meta': meta or {}
+    }
+
+
+def insert_general_page_usages(rows: list) -> int:
+    """Bulk insert usage rows in one request. Raises on failure so the caller can count it."""
+    if not rows:
+        return 0
+    get_supabase().table('general_student_usage').insert(rows).execute()
+    return len(rows)
+
+
 def log_general_page_usage(student_id: str, student_name: str = None, page: str = 'general', meta: dict = None):
     """Insert a usage record for the General page (or other pages).
 
     Returns the inserted row dict or None.
     """
     supabase = get_supabase()
-    payload = {
-        'student_id': str(student_id) if student_id is not None else None,
-        'student_name': student_name,
-        'page': page,
-        'meta': meta or {}
-    }
+    payload = build_general_page_usage(student_id, student_name, page, meta)
     try:
         res = supabase.table('general_student_usage').insert(payload).execute()
         return res.data[0] if res.data else None
@@ -661,18 +947,91 @@ def log_general_page_usage(student_id: str, student_name: str = None, page: str
         return None
 
 
+USAGE_PAGE_SIZE_DEFAULT = 100
+USAGE_PAGE_SIZE_MAX = 500
+_USAGE_COLUMNS = 'id, student_id, student_name, page, meta, used_at'
+# Days counted one by one when the aggregate RPC below is not installed
+USAGE_COUNTS_MAX_DAYS = 92
+
+# Keyset pagination and the counts RPC rely on this index/function in Supabase:
+#
+#   create index if not exists general_student_usage_used_at_id_idx
+#       on general_student_usage (used_at desc, id desc);
+#   create index if not exists general_student_usage_student_used_at_idx
+#       on general_student_usage (student_id, used_at desc);
+#
+#   create or replace function general_student_usage_counts(
+#       p_from timestamptz, p_to timestamptz, p_student_id text default null, p_page text default null)
+#   returns table (day date, page text, count bigint) language sql stable as $$
+#       select used_at::date, page, count(*) from general_student_usage
+#       where used_at >= p_from and used_at < p_to
+#         and (p_student_id is null or student_id = p_student_id)
+#         and (p_page is null or page = p_page)
+#       group by 1, 2 order by 1, 2
+#   $$;
+
+
+def encode_usage_cursor(row: dict) -> str:
+    """Opaque cursor for the row after which the next page starts."""
+    raw = json.dumps({'t': row.get('used_at'), 'i': row.get('id')}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_usage_cursor(cursor: str):
+    """Returns (used_at, id); raises ValueError for malformed cursors.
+
+    Both fields end up in an or_() filter string, so `i` must be an int and `t` must parse as
+    an ISO timestamp (re-serialised), which keeps crafted cursors from adding filter syntax.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        used_at, row_id = data['t'], data['i']
+        if not isinstance(used_at, str) or not isinstance(row_id, int) or isinstance(row_id, bool):
+            raise ValueError
+        return datetime.fromisoformat(used_at).isoformat(), row_id
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def _apply_usage_filters(query, student_id=None, page=None, date_from=None, date_to=None):
+    if student_id:
+        query = query.eq('student_id', str(student_id))
+    if page:
+        query = query.eq('page', page)
+    if date_from:
+        query = query.gte('used_at', date_from)
+    if date_to:
+        query = query.lt('used_at', date_to)
+    return query
+
+
+def get_general_student_usages_page(limit: int = USAGE_PAGE_SIZE_DEFAULT, cursor: str = None, student_id=None,
+                                    page=None, date_from=None, date_to=None):
+    """Keyset-paginated usage records, newest first (ordered by used_at desc, id desc).
+
+    Returns (rows, next_cursor); next_cursor is None on the last page. The page size is
+    capped at USAGE_PAGE_SIZE_MAX, so a large limit never pulls the whole table.
+    """
+    limit = max(1, min(int(limit or USAGE_PAGE_SIZE_DEFAULT), USAGE_PAGE_SIZE_MAX))
+    query = _apply_usage_filters(
+        get_supabase().table('general_student_usage').select(_USAGE_COLUMNS),
+        student_id, page, date_from, date_to,
+    )
+    if cursor:
+        used_at, row_id = decode_usage_cursor(cursor)
+        query = query.or_(f'used_at.lt."{used_at}",and(used_at.eq."{used_at}",id.lt.{row_id})')
+    res = query.order('used_at', desc=True).order('id', desc=True).limit(limit + 1).execute()
+    rows = res.data or []
+    next_cursor = encode_usage_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
 def get_recent_general_student_usages(limit: int = 200):
-    """Fetch recent usage records ordered by used_at desc."""
-    supabase = get_supabase()
+    """Fetch recent usage records ordered by used_at desc (first page only, size capped)."""
     try:
-        res = (
-            supabase.table('general_student_usage')
-            .select('*')
-            .order('used_at', desc=True)
-            .limit(limit)
-            .execute()
-        )
-        return res.data if res.data else []
+        rows, _ = get_general_student_usages_page(limit=limit)
+        return rows
     except Exception:
         try:
             current_app.logger.exception('Failed to fetch general_student_usage records')
@@ -680,6 +1039,67 @@ def get_recent_general_student_usages(limit: int = 200):
             pass
         return []
 
+
+def count_general_student_usages(date_from: str = None, date_to: str = None, student_id=None, page=None):
+    """Usage counts per day and per page between date_from (inclusive) and date_to (exclusive),
+    defaulting to the last 30 days.
+
+    Uses the general_student_usage_counts RPC (one grouped query). Without it, falls back to one
+    count="exact" request per day, so only per-day totals are available and the range is capped
+    at USAGE_COUNTS_MAX_DAYS. Rows are never downloaded to be counted.
+    """
+    if not date_to:
+        date_to = (datetime.now(timezone.utc).date() + timedelta(days=1)).isoformat()
+    if not date_from:
+        date_from = (datetime.fromisoformat(date_to[:10]) - timedelta(days=30)).date().isoformat()
+    supabase = get_supabase()
+    try:
+        res = supabase.rpc('general_student_usage_counts', {
+            'p_from': date_from,
+            'p_to': date_to,
+            'p_student_id': str(student_id) if student_id else None,
+            'p_page': page,
+        }).execute()
+        by_day, by_page = {}, {}
+        for row in res.data or []:
+            day = str(row['day'])
+            by_day[day] = by_day.get(day, 0) + row['count']
+            by_page[row['page']] = by_page.get(row['page'], 0) + row['count']
+        return {
+            'by_day': [{'day': d, 'count': c} for d, c in sorted(by_day.items())],
+            'by_page': [{'page': p, 'count': c} for p, c in sorted(by_page.items(), key=lambda item: str(item[0]))],
+            'total': sum(by_day.values()),
+            'source': 'rpc',
+        }
+    except Exception:
+        try:
+            current_app.logger.info('general_student_usage_counts RPC unavailable; counting per day')
+        except Exception:
+            pass
+
+    start = datetime.fromisoformat(date_from[:10])
+    end = datetime.fromisoformat(date_to[:10])
+    if (end - start).days > USAGE_COUNTS_MAX_DAYS:
+        raise ValueError(f'Date range is limited to {USAGE_COUNTS_MAX_DAYS} days')
+    by_day = []
+    day = start
+    while day < end:
+        next_day = day + timedelta(days=1)
+        query = _apply_usage_filters(
+            supabase.table('general_student_usage').select('id', count='exact'),
+            student_id, page, day.date().isoformat(), next_day.date().isoformat(),
+        )
+        by_day.append({'day': day.date().isoformat(), 'count': query.limit(1).execute().count or 0})
+        day = next_day
+    total = sum(item['count'] for item in by_day)
+    return {
+        'by_day': by_day,
+        'by_page': [{'page': page, 'count': total}] if page else None,
+        'total': total,
+        'source': 'count',
+    }
+
+
 def get_student_ids_by_department_stage_study(department_id: int, academic_stage: str, study_type: str):
     """Return list of student_id strings that belong to a specific department,
     academic stage and study_type. Used to determine which students should be
@@ -735,3 +1155,83 @@ def find_student_by_unique_fields(department_id: int, name: str, section: str, g
         except Exception:
             pass
         return None
+
+
+# --- Bulk student roster helpers (used by the Excel roster sync) ---
+def get_students_by_department_stage(department_id: int, academic_stage: str):
+    """Return every student of a department and academic stage (all study types), paged past the row cap."""
+    return select_all_pages(
+        get_supabase().table('students')
+        .select('*')
+        .eq('department_id', department_id)
+        .eq('academic_stage', academic_stage)
+        .order('id')
+    )
+
+def get_students_by_ids(student_ids):
+    """Fetch many students by student_id using chunked in_ filters; returns {student_id: student}."""
+    supabase = get_supabase()
+    students = {}
+    for chunk in _chunked({str(s) for s in student_ids if s is not None}):
+        response = supabase.table('students').select('*').in_('student_id', chunk).execute()
+        for student in response.data or []:
+            students[str(student['student_id'])] = student
+    return students
+
+def get_conflicting_doctor_codes(codes):
+    """Bulk variant of student_id_conflicts_with_doctor: the subset of the given
+    numeric codes already used as doctors.doctor_code (one in-memory set lookup)."""
+    doctor_codes = get_doctor_codes()
+    return {int(c) for c in codes if c is not None and str(c).isdigit() and int(c) in doctor_codes}
+
+def upsert_students(students: list, chunk_size: int = 500):
+    """Update full rows of students already matched by student_id, in chunks.
+
+    Only for rows read from the database first; new students go through insert_students().
+    """
+    supabase = get_supabase()
+    saved = []
+    for start in range(0, len(students), chunk_size):
+        response = supabase.table('students').upsert(students[start:start + chunk_size], on_conflict='student_id').execute()
+        saved.extend(response.data or [])
+    return saved
+
+def _is_unique_violation(error) -> bool:
+    message = str(error)
+    return '23505' in message or 'duplicate key' in message
+
+def insert_students(students: list, chunk_size: int = 500, retries: int = 3):
+    """Insert brand-new student rows in chunks (plain insert: a duplicate student_id fails loudly).
+
+    Reserved IDs come from a per-process allocator, so another worker may take the same ID
+    between reservation and insert. On a unique violation the chunk gets freshly reserved
+    IDs (the dicts are updated in place) and is retried up to `retries` times.
+    """
+    from utils.id_allocator import reserve_student_ids, mark_ids_used
+    supabase = get_supabase()
+    saved = []
+    for start in range(0, len(students), chunk_size):
+        chunk = students[start:start + chunk_size]
+        for attempt in range(retries + 1):
+            try:
+                response = supabase.table('students').insert(chunk).execute()
+                break
+            except Exception as e:
+                if attempt == retries or not _is_unique_violation(e):
+                    raise
+                for student, new_id in zip(chunk, reserve_student_ids(len(chunk))):
+                    student['student_id'] = new_id
+        saved.extend(response.data or [])
+        mark_ids_used(*(s['student_id'] for s in chunk))
+    return saved
+
+def delete_students_bulk(student_ids, chunk_size: int = IN_FILTER_CHUNK_SIZE):
+    """Delete many students with one in_ filter per chunk."""
+    supabase = get_supabase()
+    deleted = 0
+    for chunk in _chunked({str(s) for s in student_ids}, chunk_size):
+        response = supabase.table('students').delete().in_('student_id', chunk).execute()
+        deleted += len(response.data or [])
+        from utils.id_allocator import release_ids
+        release_ids(*(s['student_id'] for s in response.data or []))
+    return deleted
@@ -1,13 +1,16 @@
-from app import create_app
-from utils.qr_generator import generate_room_qr
+import os
 
-app = create_app()
-with app.app_context():
-    supabase = app.supabase
-    rooms_res = supabase.table("rooms").select("*").eq("is_active", True).execute()
-    for room in rooms_res.data:
-        qr_path = generate_room_qr(room["code"], room["id"])
-        if qr_path:
-            supabase.table("rooms").update({"qr_code_path": qr_path}).eq("id", room["id"]).execute()
-            print(f"تم توليد باركود جديد للقاعة: {room['code']} -> {qr_path}")
-print("تمت إعادة توليد جميع الباركودات بنجاح.")
+os.environ.setdefault("SCHEDULER_ENABLED", "false")
+
+from utils.scheduler import run_job_once
+
+# نفس مهمة 'regenerate_qr_codes' في المجدول (يمكن تشغيلها أيضاً من لوحة المالك)
+result, entry = run_job_once("regenerate_qr_codes")
+if entry is None:
+    print("إعادة توليد الباركودات قيد التشغيل في عملية أخرى.")
+elif entry["status"] == "failed":
+    print(f"حدث خطأ: {entry['error']}")
+else:
+    for room in result["regenerated"]:
+        print(f"تم توليد باركود جديد للقاعة: {room['code']} -> {room['qr_code_path']}")
+    print("تمت إعادة توليد جميع الباركودات بنجاح.")
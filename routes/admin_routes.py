@@ -1,22 +1,22 @@
 from flask import Blueprint, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import get_user_by_username
+from models import get_cached_user_by_username
 from utils.helpers import format_response
-import os
-import tempfile
-import pandas as pd
+from utils.excel_ingest import ExcelReadError, excel_columns, iter_excel_chunks
+from utils.jobs import background_job
 import uuid
 
 admin_bp = Blueprint("admin", __name__)
 
 @admin_bp.route("/students/upload", methods=["POST"])
 @jwt_required()
+@background_job("admin_student_upload")
 def upload_students_excel():
     """Uploads an Excel file containing student data and populates the students table."""
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user or user["role"] not in ["dean", "owner"]:
             return format_response(
@@ -47,24 +47,17 @@ def upload_students_excel():
                 status_code=400,
             )
 
-        temp_dir = tempfile.mkdtemp()
-        temp_file_path = os.path.join(temp_dir, file.filename)
-        file.save(temp_file_path)
-
         try:
-            df = pd.read_excel(temp_file_path)
-        except Exception as e:
+            columns = excel_columns(file)
+        except ExcelReadError as e:
             return format_response(
                 message=f"خطأ في قراءة ملف Excel: {str(e)}",
                 success=False,
                 status_code=400,
             )
-        finally:
-            os.remove(temp_file_path)
-            os.rmdir(temp_dir)
 
         required_columns = ["name", "section", "academic_stage", "study_type"]
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        missing_columns = [col for col in required_columns if col not in columns]
         if missing_columns:
             return format_response(
                 message=f"الملف مفقود به الأعمدة التالية: {', '.join(missing_columns)}",
@@ -74,47 +67,57 @@ def upload_students_excel():
 
         created_students_count = 0
         errors = []
+        allowed_stages = ["first", "second", "third", "fourth"]
+        allowed_study_types = ["morning", "evening"]
 
-        for index, row in df.iterrows():
-            try:
-                student_name = str(row["name"]).strip()
-                student_section = str(row["section"]).strip()
-                academic_stage = str(row["academic_stage"]).strip()
-                study_type = str(row["study_type"]).strip()
-
-                if not student_name or not student_section or not academic_stage or not study_type:
-                    errors.append(f"الصف {index + 2}: بيانات الطالب غير مكتملة (الاسم، الشعبة، المرحلة، نوع الدراسة)")
-                    continue
-                
-                # Validate academic_stage against allowed values
-                allowed_stages = ["first", "second", "third", "fourth"]
-                if academic_stage.lower() not in allowed_stages:
-                    errors.append(f"الصف {index + 2}: المرحلة الأكاديمية غير صالحة '{academic_stage}'. يجب أن تكون إحدى: {', '.join(allowed_stages)}")
-                    continue
-
-                # Validate study_type against allowed values
-                allowed_study_types = ["morning", "evening"]
-                if study_type.lower() not in allowed_study_types:
-                    errors.append(f"الصف {index + 2}: نوع الدراسة غير صالح '{study_type}'. يجب أن يكون إحدى: {', '.join(allowed_study_types)}")
+        # Stream the sheet in fixed-size chunks; each chunk is validated and written in one insert
+        try:
+            for chunk in iter_excel_chunks(file):
+                students_to_insert = []
+                for index, row in chunk.iterrows():
+                    student_name = str(row["name"] if row["name"] is not None else "").strip()
+                    student_section = str(row["section"] if row["section"] is not None else "").strip()
+                    academic_stage = str(row["academic_stage"] if row["academic_stage"] is not None else "").strip()
+                    study_type = str(row["study_type"] if row["study_type"] is not None else "").strip()
+
+                    if not student_name or not student_section or not academic_stage or not study_type:
+                        errors.append(f"الصف {index + 2}: بيانات الطالب غير مكتملة (الاسم، الشعبة، المرحلة، نوع الدراسة)")
+                        continue
+
+                    # Validate academic_stage against allowed values
+                    if academic_stage.lower() not in allowed_stages:
+                        errors.append(f"الصف {index + 2}: المرحلة الأكاديمية غير صالحة '{academic_stage}'. يجب أن تكون إحدى: {', '.join(allowed_stages)}")
+                        continue
+
+                    # Validate study_type against allowed values
+                    if study_type.lower() not in allowed_study_types:
+                        errors.append(f"الصف {index + 2}: نوع الدراسة غير صالح '{study_type}'. يجب أن يكون إحدى: {', '.join(allowed_study_types)}")
+                        continue
+
+                    students_to_insert.append((index, {
+                        "student_id": str(uuid.uuid4()),  # Generate unique student_id
+                        "name": student_name,
+                        "section": student_section,
+                        "academic_stage": academic_stage.lower(),
+                        "study_type": study_type.lower(),
+                    }))
+
+                if not students_to_insert:
                     continue
-
-                # Generate unique student_id
-                unique_student_id = str(uuid.uuid4())
-
-                student_data = {
-                    "student_id": unique_student_id,
-                    "name": student_name,
-                    "section": student_section,
-                    "academic_stage": academic_stage.lower(),
-                    "study_type": study_type.lower(),
-                }
-
-                supabase.table("students").insert(student_data).execute()
-                created_students_count += 1
-
-            except Exception as e:
-                errors.append(f"الصف {index + 2}: خطأ في معالجة بيانات الطالب - {str(e)}")
-                continue
+                try:
+                    supabase.table("students").insert([data for _, data in students_to_insert]).execute()
+                    created_students_count += len(students_to_insert)
+                except Exception as e:
+                    errors.extend(
+                        f"الصف {index + 2}: خطأ في معالجة بيانات الطالب - {str(e)}"
+                        for index, _ in students_to_insert
+                    )
+        except ExcelReadError as e:
+            return format_response(
+                message=f"خطأ في قراءة ملف Excel: {str(e)}",
+                success=False,
+                status_code=400,
+            )
 
         return format_response(
             data={
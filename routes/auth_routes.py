@@ -1,6 +1,6 @@
 from flask import Blueprint, request, current_app
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from models import get_user_by_username, get_user_by_email, check_password, set_password
+from models import get_user_by_username, get_user_by_email, get_cached_user_by_username, invalidate_user_cache, build_user_claims, check_password, set_password
 from utils.helpers import validate_json_data, format_response
 from datetime import datetime, timezone
 
@@ -46,6 +46,7 @@ def login():
                     # Persist temp_password_used = True to prevent reuse
                     try:
                         current_app.supabase.table('users').update({'temp_password_used': True}).eq('id', user.get('id')).execute()
+                        invalidate_user_cache(user_id=user.get('id'), username=user.get('username'))
                     except Exception:
                         # Non-fatal: log and continue
                         current_app.logger.exception('Failed to mark temp_password_used')
@@ -57,7 +58,9 @@ def login():
                 return format_response(message='كلمة المرور غير صحيحة أو مستخدمة مسبقاً', success=False, status_code=401)
         
         # إنشاء JWT token باستخدام username كـ string بسيط
-        access_token = create_access_token(identity=user['username'])
+        # (مع صلاحيات المستخدم كـ claims إضافية عند تفعيل JWT_ROLE_CLAIMS)
+        additional_claims = build_user_claims(user) if current_app.config.get('JWT_ROLE_CLAIMS') else None
+        access_token = create_access_token(identity=user['username'], additional_claims=additional_claims)
         
         # Sanitize user object (do not return password hashes)
         safe_user = {k: v for k, v in user.items() if k not in ('password_hash', 'temp_password_hash', 'temp_password_expires_at')}
@@ -85,7 +88,7 @@ def get_profile():
     """الحصول على معلومات المستخدم الحالي"""
     try:
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
         
         if not user:
             return format_response(
@@ -154,6 +157,7 @@ def change_password(data):
             'temp_password_used': True
         }
         response = supabase.table('users').update(update_payload).eq('username', username).execute()
+        invalidate_user_cache(username=username)
 
         err = getattr(response, 'error', None)
         if err:
@@ -2,72 +2,28 @@ from flask import Blueprint, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import (
     get_all_departments,
-    get_user_by_username,
+    get_cached_user_by_username,
+    invalidate_user_cache,
+    apply_permissions_bump,
+    invalidate_room_timetables,
     create_user as create_user_model,
     get_room_by_code,
     get_schedules_by_room_id,
     get_all_announcements,
-    get_recent_general_student_usages,
+    announcement_not_expired_filter,
+    get_general_student_usages_page,
+    count_general_student_usages,
+    USAGE_PAGE_SIZE_DEFAULT,
     check_password,
 )
-from utils.helpers import validate_json_data, format_response, admin_required, user_management_required
+from utils.helpers import validate_json_data, format_response, admin_required, user_management_required, parse_usage_log_filters, paginated_response
+from utils.statistics import get_statistics_snapshot, department_breakdown
+from utils.scheduler import sweep_expired_announcements
 from datetime import datetime, timedelta, timezone
 
 dean_bp = Blueprint("dean", __name__)
 
 
-def cleanup_expired_announcements_logic(supabase):
-    """دالة مساعدة لتنظيف الإعلانات المنتهية الصلاحية"""
-    try:
-        from datetime import timezone as _tz
-        # Use timezone-aware current time for reliable comparisons
-        now_dt = datetime.now(_tz.utc)
-
-        now = datetime.now().isoformat()
-        
-        # البحث عن الإعلانات المنتهية الصلاحية
-        expired_anns_res = supabase.table("announcements").select("id, title, expires_at").execute()
-        
-        # تصفية الإعلانات المنتهية يدوياً
-        expired_ids = []
-        for ann in expired_anns_res.data:
-            ann_exp = ann.get('expires_at')
-            if not ann_exp:
-                continue
-            try:
-                # Accept datetime objects, numeric timestamps, or ISO strings
-                if isinstance(ann_exp, datetime):
-                    exp_dt = ann_exp
-                elif isinstance(ann_exp, (int, float)):
-                    exp_dt = datetime.fromtimestamp(float(ann_exp), tz=_tz.utc)
-                elif isinstance(ann_exp, str):
-                    s = ann_exp
-                    if s.endswith('Z'):
-                        s = s.replace('Z', '+00:00')
-                    exp_dt = datetime.fromisoformat(s)
-                else:
-                    exp_dt = None
-                if exp_dt is not None and exp_dt.tzinfo is None:
-                    exp_dt = exp_dt.replace(tzinfo=_tz.utc)
-            except Exception:
-                exp_dt = None
-
-            if exp_dt is not None and exp_dt < now_dt:
-                expired_ids.append(ann['id'])
-        
-        # حذف الإعلانات المنتهية إذا وجدت
-        if expired_ids:
-            for ann_id in expired_ids:
-                supabase.table("announcements").delete().eq("id", ann_id).execute()
-            print(f"تم حذف {len(expired_ids)} إعلان منتهي الصلاحية تلقائياً")
-            
-    except Exception as e:
-        print(f"خطأ في تنظيف الإعلانات المنتهية: {str(e)}")
-
-
-
-
-
 @dean_bp.route("/schedules/<int:schedule_id>", methods=["GET"])
 @admin_required
 def get_schedule(schedule_id):
@@ -188,6 +144,7 @@ def update_schedule(schedule_id, data):
         }
 
         supabase.table("schedules").update(update_data).eq("id", schedule_id).execute()
+        invalidate_room_timetables(original_schedule["room_id"], room_id)
 
         return format_response(
             message="تم نقل المحاضرة بنجاح إلى القاعة والوقت الجديدين.",
@@ -220,15 +177,14 @@ def dean_get_announcements():
     """جلب إعلانات عامة (العميد)"""
     try:
         supabase = current_app.supabase
-        
-        # تنظيف الإعلانات المنتهية الصلاحية أولاً
-        cleanup_expired_announcements_logic(supabase)
-        
+
+        # المنتهية تُحذف دورياً في الخلفية (utils/scheduler)، وهنا تُستبعد فقط
         anns_res = (
             supabase.table("announcements")
             .select("*")
             .eq("is_global", True)
             .eq("is_active", True)
+            .or_(announcement_not_expired_filter())
             .order("created_at", desc=True)
             .execute()
         )
@@ -430,7 +386,7 @@ def get_users():
         
         # الحصول على المستخدم الحالي لمعرفة رتبته
         username = get_jwt_identity()
-        current_user = get_user_by_username(username)
+        current_user = get_cached_user_by_username(username)
         
         # Fetch users - الـ owner يرى الجميع، الآخرون لا يرون الـ dean
         if current_user and current_user.get('role') == 'owner':
@@ -539,6 +495,7 @@ def delete_user(user_id):
             )
 
         supabase.table("users").delete().eq("id", user_id).execute()
+        invalidate_user_cache(user_id=user_id)
 
         return format_response(message="تم حذف المستخدم بنجاح")
 
@@ -553,20 +510,18 @@ def delete_user(user_id):
 def get_statistics():
     """إحصائيات عامة للعميد"""
     try:
-        supabase = current_app.supabase
-        
-        departments_count = supabase.table("departments").select("id", count="exact").execute().count
-        users_count = supabase.table("users").select("id", count="exact").neq("role", "dean").execute().count
-        rooms_count = supabase.table("rooms").select("id", count="exact").execute().count
-        department_heads_count = supabase.table("users").select("id", count="exact").eq("role", "department_head").execute().count
-        supervisors_count = supabase.table("users").select("id", count="exact").eq("role", "supervisor").execute().count
+        snapshot = get_statistics_snapshot(force=request.args.get("refresh") == "true")
+        totals = snapshot["totals"]
+        users_by_role = totals["users_by_role"]
 
         stats = {
-            "total_departments": departments_count,
-            "total_users": users_count,
-            "total_rooms": rooms_count,
-            "department_heads": department_heads_count,
-            "supervisors": supervisors_count,
+            "total_departments": totals["total_departments"],
+            "total_users": totals["total_users"] - users_by_role.get("dean", 0),
+            "total_rooms": totals["total_rooms"],
+            "department_heads": users_by_role.get("department_head", 0),
+            "supervisors": users_by_role.get("supervisor", 0),
+            "departments": department_breakdown(snapshot),
+            "generated_at": snapshot["generated_at"],
         }
 
         return format_response(data=stats, message="تم جلب الإحصائيات بنجاح")
@@ -582,30 +537,14 @@ def get_statistics():
 def cleanup_expired_announcements():
     """تنظيف الإعلانات المنتهية الصلاحية وحذفها من قاعدة البيانات"""
     try:
-        supabase = current_app.supabase
-        now = datetime.now().isoformat()
-        
-        # البحث عن الإعلانات المنتهية الصلاحية
-        expired_anns_res = supabase.table("announcements").select("id, title, expires_at").execute()
-        
-        # تصفية الإعلانات المنتهية يدوياً
-        expired_announcements = []
-        for ann in expired_anns_res.data:
-            if ann.get("expires_at") and ann["expires_at"] < now:
-                expired_announcements.append(ann)
-        
+        expired_announcements = sweep_expired_announcements()
+
         if not expired_announcements:
             return format_response(
                 data={"deleted_count": 0, "deleted_announcements": []},
                 message="لا توجد إعلانات منتهية الصلاحية"
             )
-        
-        expired_ids = [ann["id"] for ann in expired_announcements]
-        
-        # حذف الإعلانات المنتهية
-        for ann_id in expired_ids:
-            supabase.table("announcements").delete().eq("id", ann_id).execute()
-        
+
         return format_response(
             data={
                 "deleted_count": len(expired_announcements),
@@ -613,7 +552,7 @@ def cleanup_expired_announcements():
             },
             message=f"تم حذف {len(expired_announcements)} إعلان منتهي الصلاحية بنجاح"
         )
-        
+
     except Exception as e:
         return format_response(
             message=f"حدث خطأ أثناء تنظيف الإعلانات: {str(e)}", 
@@ -639,7 +578,7 @@ def update_user_partial(user_id):
         # Determine current user and permissions
         from flask_jwt_extended import get_jwt_identity
         username = get_jwt_identity()
-        current_user = get_user_by_username(username)
+        current_user = get_cached_user_by_username(username)
         if not current_user:
             return format_response(message="المستخدم الحالي غير موجود", success=False, status_code=401)
 
@@ -703,7 +642,9 @@ def update_user_partial(user_id):
         if not update_data:
             return format_response(data=target_user, message="لم يتم تحديث أي بيانات")
 
+        apply_permissions_bump(user_id, update_data, current_user=target_user)
         updated_res = supabase.table("users").update(update_data).eq("id", user_id).execute()
+        invalidate_user_cache(user_id=user_id)
 
         return format_response(data=updated_res.data[0] if updated_res.data else {}, message="تم تحديث المستخدم بنجاح")
 
@@ -716,15 +657,34 @@ def update_user_partial(user_id):
 @dean_bp.route('/student_usages', methods=['GET'])
 @admin_required
 def dean_get_student_usages():
-    """Return recent student usages of the General page. Query param 'limit' optional."""
+    """Return student usages of the General page, newest first.
+
+    Query params: limit (capped), cursor (from the X-Next-Cursor header of the previous page),
+    student_id, page, from, to.
+    """
     try:
-        limit = request.args.get('limit')
-        try:
-            limit = int(limit) if limit else 200
-        except Exception:
-            limit = 200
-        usages = get_recent_general_student_usages(limit=limit)
-        return format_response(data=usages, message='Recent student usages fetched')
+        filters = parse_usage_log_filters(request.args)
+        limit = request.args.get('limit', USAGE_PAGE_SIZE_DEFAULT, type=int)
+        usages, next_cursor = get_general_student_usages_page(
+            limit=limit, cursor=request.args.get('cursor') or None, **filters
+        )
+        return paginated_response(usages, next_cursor, message='Recent student usages fetched')
+    except ValueError as e:
+        return format_response(message=str(e), success=False, status_code=400)
+    except Exception as e:
+        return format_response(message=str(e), success=False, status_code=500)
+
+
+@dean_bp.route('/student_usages/counts', methods=['GET'])
+@admin_required
+def dean_get_student_usage_counts():
+    """Usage counts per day and per page (defaults to the last 30 days)."""
+    try:
+        filters = parse_usage_log_filters(request.args)
+        counts = count_general_student_usages(**filters)
+        return format_response(data=counts, message='Student usage counts fetched')
+    except ValueError as e:
+        return format_response(message=str(e), success=False, status_code=400)
     except Exception as e:
         return format_response(message=str(e), success=False, status_code=500)
 
@@ -759,6 +719,7 @@ def generate_temp_password(user_id):
             'temp_password_expires_at': None,
             'temp_password_used': False
         }).eq('id', user_id).execute()
+        invalidate_user_cache(user_id=user_id)
 
         # Return plaintext temp_password once
         return format_response(data={'temp_password': temp_password, 'email': user_res.data[0].get('email')}, message='تم توليد كلمة مؤقتة', status_code=200)
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, current_app
 from flask_jwt_extended import jwt_required
-from models import create_user as create_user_model
+from models import create_user as create_user_model, invalidate_user_cache, apply_permissions_bump, announcement_not_expired_filter, _chunked, select_all_pages
 from utils.helpers import (
     department_access_required,
     validate_json_data,
@@ -8,34 +8,12 @@ from utils.helpers import (
     get_user_department_filter,
 )
 from datetime import datetime
+from utils.intervals import IntervalIndex, to_minutes
+from utils.statistics import get_statistics_snapshot, department_breakdown
 
 dept_bp = Blueprint("department", __name__)
 
 
-def cleanup_expired_announcements_logic(supabase):
-    """دالة مساعدة لتنظيف الإعلانات المنتهية الصلاحية"""
-    try:
-        now = datetime.now().isoformat()
-        
-        # البحث عن الإعلانات المنتهية الصلاحية
-        expired_anns_res = supabase.table("announcements").select("id, title, expires_at").execute()
-        
-        # تصفية الإعلانات المنتهية يدوياً
-        expired_ids = []
-        for ann in expired_anns_res.data:
-            if ann.get("expires_at") and ann["expires_at"] < now:
-                expired_ids.append(ann["id"])
-        
-        # حذف الإعلانات المنتهية إذا وجدت
-        if expired_ids:
-            for ann_id in expired_ids:
-                supabase.table("announcements").delete().eq("id", ann_id).execute()
-            print(f"تم حذف {len(expired_ids)} إعلان منتهي الصلاحية تلقائياً")
-            
-    except Exception as e:
-        print(f"خطأ في تنظيف الإعلانات المنتهية: {str(e)}")
-
-
 @dept_bp.route("/supervisors", methods=["GET"])
 @department_access_required
 def get_supervisors(user):
@@ -146,6 +124,7 @@ def delete_supervisor(user, supervisor_id):
             )
 
         supabase.table("users").delete().eq("id", supervisor_id).execute()
+        invalidate_user_cache(user_id=supervisor_id)
 
         return format_response(message="تم حذف المشرف بنجاح")
 
@@ -171,7 +150,7 @@ def update_supervisor(data, user, supervisor_id):
         supabase = current_app.supabase
         supervisor_res = (
             supabase.table("users")
-            .select("id")
+            .select("*")
             .eq("id", supervisor_id)
             .eq("role", "supervisor")
             .eq("department_id", user["department_id"])
@@ -212,12 +191,14 @@ def update_supervisor(data, user, supervisor_id):
         if "is_active" in data:
             update_data["is_active"] = data["is_active"]
 
+        apply_permissions_bump(supervisor_id, update_data, current_user=supervisor_res.data[0])
         updated_supervisor_res = (
             supabase.table("users")
             .update(update_data)
             .eq("id", supervisor_id)
             .execute()
         )
+        invalidate_user_cache(user_id=supervisor_id)
 
         return format_response(
             data=updated_supervisor_res.data[0], message="تم تحديث المشرف بنجاح"
@@ -354,18 +335,13 @@ def dept_get_announcements(user):
     """جلب إعلانات القسم (للعاملين في القسم)"""
     try:
         supabase = current_app.supabase
-        
-        # تنظيف الإعلانات المنتهية الصلاحية أولاً
-        cleanup_expired_announcements_logic(supabase)
-        
-        now = datetime.now().isoformat()
 
-        # جلب الإعلانات غير المنتهية فقط
+        # جلب الإعلانات غير المنتهية فقط (المنتهية تُحذف دورياً في الخلفية)
         anns_res = (
             supabase.table("announcements")
             .select("*")
             .eq("department_id", user["department_id"])
-            .or_(f"expires_at.is.null,expires_at.gt.{now}")
+            .or_(announcement_not_expired_filter())
             .order("created_at", desc=True)
             .execute()
         )
@@ -501,132 +477,126 @@ def get_available_rooms_for_department(user, department_id):
                 message="لا توجد قاعات فعالة في هذا القسم"
             )
         
+        # بناء فهرس الفترات المشغولة لجميع القاعات: استعلام واحد للجداول واستعلام واحد للنقل المؤقت
+        room_ids = [room["id"] for room in rooms_res.data]
+        busy_index = IntervalIndex()
+        for chunk in _chunked(room_ids):
+            schedules = select_all_pages(
+                supabase.table("schedules")
+                .select("*")
+                .in_("room_id", chunk)
+                .eq("day_of_week", day_of_week)
+                .eq("study_type", study_type)
+                .order("id")
+            )
+            for schedule in schedules:
+                busy_index.add(("regular", schedule["room_id"]), schedule["start_time"], schedule["end_time"], schedule)
+
+            if date:
+                postponed_rows = select_all_pages(
+                    supabase.table("schedules")
+                    .select("*")
+                    .in_("postponed_to_room_id", chunk)
+                    .eq("postponed_date", date)
+                    .order("id")
+                )
+                for postponed in postponed_rows:
+                    busy_index.add(
+                        ("temporary", postponed["postponed_to_room_id"]),
+                        postponed.get("postponed_start_time"),
+                        postponed.get("postponed_end_time"),
+                        postponed,
+                    )
+
+        required_start = to_minutes(start_time)
+        required_end = to_minutes(end_time)
         available_rooms = []
-        
+
         for room in rooms_res.data:
-            # جلب جميع الجداول للقاعة في نفس اليوم ونوع الدراسة
-            schedules_res = supabase.table("schedules").select("*").eq("room_id", room["id"]).eq("day_of_week", day_of_week).eq("study_type", study_type).execute()
-            
-            # ترتيب الجداول حسب الوقت
-            room_schedules = sorted(schedules_res.data, key=lambda x: x["start_time"])
-            
-            # التحقق من التداخل مع الجداول العادية
-            has_conflict = False
+            # التحقق من التداخل مع الجداول العادية ثم مع النقل المؤقت
             conflict_details = None
-            
-            for schedule in room_schedules:
-                schedule_start = schedule["start_time"]
-                schedule_end = schedule["end_time"]
-                
-                # فحص التداخل الزمني
-                if (start_time < schedule_end and end_time > schedule_start):
-                    has_conflict = True
+            regular_conflict = busy_index.first_overlap(("regular", room["id"]), required_start, required_end)
+            if regular_conflict:
+                schedule = regular_conflict[2]
+                conflict_details = {
+                    "type": "regular",
+                    "subject": schedule["subject_name"],
+                    "time": f"{schedule['start_time']} - {schedule['end_time']}",
+                    "stage": schedule["academic_stage"]
+                }
+            elif date:
+                temporary_conflict = busy_index.first_overlap(("temporary", room["id"]), required_start, required_end)
+                if temporary_conflict:
+                    postponed = temporary_conflict[2]
                     conflict_details = {
-                        "type": "regular",
-                        "subject": schedule["subject_name"],
-                        "time": f"{schedule_start} - {schedule_end}",
-                        "stage": schedule["academic_stage"]
-                    }
-                    break
-            
-            # إذا لم يكن هناك تداخل مع الجداول العادية، فحص النقل المؤقت
-            if not has_conflict and date:
-                postponed_res = supabase.table("schedules").select("*").eq("postponed_to_room_id", room["id"]).eq("postponed_date", date).execute()
-                
-                for postponed in postponed_res.data:
-                    postponed_start = postponed["postponed_start_time"]
-                    postponed_end = postponed["postponed_end_time"]
-                    
-                    if postponed_start and postponed_end and (start_time < postponed_end and end_time > postponed_start):
-                        has_conflict = True
-                        conflict_details = {
-                            "type": "temporary",
-                            "subject": postponed["subject_name"],
-                            "time": f"{postponed_start} - {postponed_end}",
-                            "stage": postponed["academic_stage"],
-                            "original_room": postponed["room_id"]
-                        }
-                        break
-            
-            # إذا كانت القاعة متاحة، احسب مدة التوفر
-            availability_info = None
-            duration_warning = None
-            
-            if not has_conflict:
-                # البحث عن المحاضرة التالية لحساب مدة التوفر
-                next_schedule = None
-                previous_schedule = None
-                
-                for schedule in room_schedules:
-                    if schedule["start_time"] > end_time:
-                        if next_schedule is None or schedule["start_time"] < next_schedule["start_time"]:
-                            next_schedule = schedule
-                    elif schedule["end_time"] <= start_time:
-                        if previous_schedule is None or schedule["end_time"] > previous_schedule["end_time"]:
-                            previous_schedule = schedule
-                
-                # حساب بداية ونهاية الفترة المتاحة
-                available_from = previous_schedule["end_time"] if previous_schedule else "06:00"
-                available_until = next_schedule["start_time"] if next_schedule else "23:59"
-                
-                # حساب المدة الكاملة المتاحة
-                try:
-                    available_start_dt = datetime.strptime(available_from, "%H:%M")
-                    available_end_dt = datetime.strptime(available_until, "%H:%M")
-                    total_available_minutes = int((available_end_dt - available_start_dt).total_seconds() / 60)
-                    
-                    # حساب المدة المتاحة بعد انتهاء المحاضرة المطلوبة
-                    required_end_dt = datetime.strptime(end_time, "%H:%M")
-                    remaining_minutes = int((available_end_dt - required_end_dt).total_seconds() / 60)
-                    
-                    availability_info = {
-                        "total_minutes": total_available_minutes,
-                        "remaining_minutes": remaining_minutes,
-                        "available_from": available_from,
-                        "available_until": available_until,
-                        "next_subject": next_schedule["subject_name"] if next_schedule else None,
-                        "previous_subject": previous_schedule["subject_name"] if previous_schedule else None
+                        "type": "temporary",
+                        "subject": postponed["subject_name"],
+                        "time": f"{postponed['postponed_start_time']} - {postponed['postponed_end_time']}",
+                        "stage": postponed["academic_stage"],
+                        "original_room": postponed["room_id"]
                     }
-                    
-                    # التحقق من كفاية المدة المتاحة للمحاضرة الأصلية
-                    required_start_dt = datetime.strptime(start_time, "%H:%M")
-                    available_duration_for_lecture = int((available_end_dt - required_start_dt).total_seconds() / 60)
-                    
-                    if available_duration_for_lecture < original_duration_minutes:
-                        duration_warning = {
-                            "type": "insufficient",
-                            "available_duration": available_duration_for_lecture,
-                            "required_duration": original_duration_minutes,
-                            "shortage": original_duration_minutes - available_duration_for_lecture
-                        }
-                    elif available_duration_for_lecture == original_duration_minutes:
-                        duration_warning = {
-                            "type": "exact",
-                            "message": "المدة متطابقة تماماً مع المحاضرة الأصلية"
-                        }
-                    elif available_duration_for_lecture > original_duration_minutes * 2:
-                        duration_warning = {
-                            "type": "excess",
-                            "message": "القاعة متاحة لمدة طويلة"
-                        }
-                        
-                except ValueError:
-                    availability_info = {"error": "خطأ في حساب الأوقات"}
-            
+
             # إضافة معلومات القاعة فقط إذا كانت متاحة
-            if not has_conflict:
-                room_info = {
-                    "id": room["id"],
-                    "name": room["name"],
-                    "code": room["code"],
-                    "capacity": room.get("capacity"),
-                    "location": room.get("location"),
-                    "is_available": True,
-                    "availability_info": availability_info,
-                    "duration_warning": duration_warning,
-                    "original_duration_minutes": original_duration_minutes
+            if conflict_details:
+                continue
+
+            # المحاضرة السابقة والتالية لحساب مدة التوفر
+            previous_interval = busy_index.previous(("regular", room["id"]), required_start)
+            next_interval = busy_index.next(("regular", room["id"]), required_end)
+            previous_schedule = previous_interval[2] if previous_interval else None
+            next_schedule = next_interval[2] if next_interval else None
+
+            # حساب بداية ونهاية الفترة المتاحة
+            available_from = previous_schedule["end_time"] if previous_schedule else "06:00"
+            available_until = next_schedule["start_time"] if next_schedule else "23:59"
+            available_start_minutes = previous_interval[1] if previous_interval else to_minutes("06:00")
+            available_end_minutes = next_interval[0] if next_interval else to_minutes("23:59")
+
+            # المدة الكاملة المتاحة والمدة المتبقية بعد انتهاء المحاضرة المطلوبة
+            total_available_minutes = available_end_minutes - available_start_minutes
+            remaining_minutes = available_end_minutes - required_end
+
+            availability_info = {
+                "total_minutes": total_available_minutes,
+                "remaining_minutes": remaining_minutes,
+                "available_from": available_from,
+                "available_until": available_until,
+                "next_subject": next_schedule["subject_name"] if next_schedule else None,
+                "previous_subject": previous_schedule["subject_name"] if previous_schedule else None
+            }
+
+            # التحقق من كفاية المدة المتاحة للمحاضرة الأصلية
+            duration_warning = None
+            available_duration_for_lecture = available_end_minutes - required_start
+            if available_duration_for_lecture < original_duration_minutes:
+                duration_warning = {
+                    "type": "insufficient",
+                    "available_duration": available_duration_for_lecture,
+                    "required_duration": original_duration_minutes,
+                    "shortage": original_duration_minutes - available_duration_for_lecture
                 }
-                available_rooms.append(room_info)
+            elif available_duration_for_lecture == original_duration_minutes:
+                duration_warning = {
+                    "type": "exact",
+                    "message": "المدة متطابقة تماماً مع المحاضرة الأصلية"
+                }
+            elif available_duration_for_lecture > original_duration_minutes * 2:
+                duration_warning = {
+                    "type": "excess",
+                    "message": "القاعة متاحة لمدة طويلة"
+                }
+
+            available_rooms.append({
+                "id": room["id"],
+                "name": room["name"],
+                "code": room["code"],
+                "capacity": room.get("capacity"),
+                "location": room.get("location"),
+                "is_available": True,
+                "availability_info": availability_info,
+                "duration_warning": duration_warning,
+                "original_duration_minutes": original_duration_minutes
+            })
         
         # ترتيب القاعات حسب مناسبة المدة (الأقرب للمدة المطلوبة أولاً)
         def sort_key(room):
@@ -757,25 +727,24 @@ def get_room_schedules(user, room_id):
             .execute()
         )
 
-        # Get multiple doctors for each schedule
-        from models import get_schedule_doctors
-        for schedule in schedules_res.data:
-            schedule_doctors = get_schedule_doctors(schedule["id"])
-            schedule["schedule_doctors"] = schedule_doctors
-            
-            # Create a list of doctor names for display
-            if schedule_doctors:
-                doctor_names = []
-                primary_doctor = None
-                for sd in schedule_doctors:
-                    doctor_name = sd.get('doctors', {}).get('name', '')
-                    if sd.get('is_primary'):
-                        primary_doctor = doctor_name
-                    doctor_names.append(doctor_name)
-                
-                schedule["multiple_doctors_names"] = doctor_names
-                schedule["primary_doctor_name"] = primary_doctor
-                schedule["has_multiple_doctors"] = len(doctor_names) > 1
+        # Get multiple doctors for all schedules in one query
+        from models import attach_schedule_doctors
+        attach_schedule_doctors(schedules_res.data)
+
+        # Bulk-fetch the rooms that schedules were postponed to
+        postponed_room_ids = list({
+            s["postponed_to_room_id"] for s in schedules_res.data
+            if s.get("is_postponed") and s.get("postponed_to_room_id")
+        })
+        postponed_rooms = {}
+        if postponed_room_ids:
+            postponed_rooms_res = (
+                supabase.table("rooms")
+                .select("id, name, code")
+                .in_("id", postponed_room_ids)
+                .execute()
+            )
+            postponed_rooms = {r["id"]: r for r in (postponed_rooms_res.data or [])}
 
         # Check for postponements today and in the future
         from datetime import datetime
@@ -801,17 +770,11 @@ def get_room_schedules(user, room_id):
                     # Add the postponed date for frontend processing
                     schedule["postponed_full_date"] = schedule.get("postponed_date")
                     
-                    # Get the name of the postponed room if available
-                    if schedule.get("postponed_to_room_id"):
-                        postponed_room_res = (
-                            supabase.table("rooms")
-                            .select("name, code")
-                            .eq("id", schedule["postponed_to_room_id"])
-                            .execute()
-                        )
-                        if postponed_room_res.data:
-                            schedule["postponed_room_name"] = postponed_room_res.data[0].get("name", "")
-                            schedule["postponed_room_code"] = postponed_room_res.data[0].get("code", "")
+                    # Name of the postponed room if available
+                    postponed_room = postponed_rooms.get(schedule.get("postponed_to_room_id"))
+                    if postponed_room:
+                        schedule["postponed_room_name"] = postponed_room.get("name", "")
+                        schedule["postponed_room_code"] = postponed_room.get("code", "")
                     
                     # For both future and today's postponements, show only one card - the original schedule with postponement details
                     display_schedules.append(schedule)
@@ -840,41 +803,25 @@ def get_room_schedules(user, room_id):
 def get_department_statistics(user):
     """إحصائيات القسم"""
     try:
-        supabase = current_app.supabase
         dept_filter = get_user_department_filter(user)
+        snapshot = get_statistics_snapshot()
 
         if dept_filter:
-            # إحصائيات قسم محدد
-            total_rooms = supabase.table("rooms").select("id", count="exact").eq("department_id", dept_filter).eq("is_active", True).execute().count
-            
-            # Get room IDs for the department first
-            dept_rooms_res = supabase.table("rooms").select("id").eq("department_id", dept_filter).execute()
-            room_ids = [r['id'] for r in dept_rooms_res.data]
-            
-            if room_ids:
-                total_schedules = supabase.table("schedules").select("id", count="exact").eq("is_active", True).in_("room_id", room_ids).execute().count
-            else:
-                total_schedules = 0
+            # إحصائيات قسم محدد (من لقطة الإحصائيات المشتركة)
+            dept = snapshot["departments"].get(dept_filter) or {}
             stats = {
-                "total_rooms": total_rooms,
-                "total_schedules": total_schedules,
+                "total_rooms": dept.get("active_rooms", 0),
+                "total_schedules": dept.get("active_schedules", 0),
             }
 
             if user["role"] == "department_head":
-                stats["total_supervisors"] = (
-                    supabase.table("users")
-                    .select("id", count="exact")
-                    .eq("department_id", dept_filter)
-                    .eq("role", "supervisor")
-                    .eq("is_active", True)
-                    .execute()
-                    .count
-                )
+                stats["total_supervisors"] = dept.get("active_users_by_role", {}).get("supervisor", 0)
         else:
             # إحصائيات شاملة للعميد
             stats = {
-                "total_rooms": supabase.table("rooms").select("id", count="exact").eq("is_active", True).execute().count,
-                "total_schedules": supabase.table("schedules").select("id", count="exact").eq("is_active", True).execute().count,
+                "total_rooms": snapshot["totals"]["active_rooms"],
+                "total_schedules": snapshot["totals"]["active_schedules"],
+                "departments": department_breakdown(snapshot),
             }
 
         return format_response(data=stats, message="تم جلب الإحصائيات بنجاح")
@@ -0,0 +1,72 @@
+from flask import Blueprint, send_file
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import get_cached_user_by_username
+from utils.helpers import format_response
+from utils.jobs import get_job
+import io
+
+job_bp = Blueprint("jobs", __name__)
+
+
+def _load_visible_job(job_id, include_result=False):
+    """المهمة مرئية لمنشئها وللعميد والمالك فقط"""
+    job = get_job(job_id, include_result=include_result)
+    if not job:
+        return None, format_response(message="المهمة غير موجودة", success=False, status_code=404)
+
+    username = get_jwt_identity()
+    if job["created_by"] != username:
+        user = get_cached_user_by_username(username)
+        if not user or user["role"] not in ["dean", "owner"]:
+            return None, format_response(
+                message="ليس لديك صلاحية لعرض هذه المهمة", success=False, status_code=403
+            )
+    return job, None
+
+
+@job_bp.route("/<job_id>", methods=["GET"])
+@jwt_required()
+def get_job_status(job_id):
+    """حالة المهمة الخلفية: الحالة، نسبة التقدم، والنتيجة عند الانتهاء"""
+    try:
+        job, error = _load_visible_job(job_id, include_result=True)
+        if error:
+            return error
+
+        data = {k: v for k, v in job.items() if not k.startswith("result_")}
+        if job["has_file"]:
+            data["result"] = None
+            data["download_url"] = f"/api/jobs/{job_id}/result"
+        return format_response(data=data, message="تم جلب حالة المهمة بنجاح")
+
+    except Exception as e:
+        return format_response(
+            message=f"حدث خطأ: {str(e)}", success=False, status_code=500
+        )
+
+
+@job_bp.route("/<job_id>/result", methods=["GET"])
+@jwt_required()
+def download_job_result(job_id):
+    """تنزيل الملف الناتج عن المهمة (مثل PDF)"""
+    try:
+        job, error = _load_visible_job(job_id, include_result=True)
+        if error:
+            return error
+
+        if not job["has_file"]:
+            return format_response(
+                message="لا يوجد ملف ناتج لهذه المهمة", success=False, status_code=404
+            )
+
+        return send_file(
+            io.BytesIO(job["result_blob"]),
+            mimetype=job["result_mimetype"] or "application/octet-stream",
+            as_attachment=True,
+            download_name=job["result_filename"] or f"{job_id}",
+        )
+
+    except Exception as e:
+        return format_response(
+            message=f"حدث خطأ: {str(e)}", success=False, status_code=500
+        )
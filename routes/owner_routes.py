@@ -1,4 +1,4 @@
-from flask import Blueprint, request, current_app
+from flask import Blueprint, request, current_app, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import (
     get_user_by_username,
@@ -8,6 +8,8 @@ from models import (
     update_user,
     delete_user,
     check_password,
+    invalidate_user_cache,
+    apply_permissions_bump,
 )
 from utils.helpers import (
     validate_json_data,
@@ -15,8 +17,12 @@ from utils.helpers import (
     owner_required,
     user_management_required,
     get_user_department_filter,
+    parse_usage_log_filters,
+    paginated_response,
 )
+from utils.statistics import get_statistics_snapshot, department_breakdown
 from datetime import datetime
+import inspect
 
 owner_bp = Blueprint("owner", __name__)
 
@@ -26,34 +32,19 @@ owner_bp = Blueprint("owner", __name__)
 def owner_dashboard():
     """لوحة تحكم المالك - إحصائيات عامة"""
     try:
-        supabase = current_app.supabase
-        
-        # إحصائيات المستخدمين
-        users_res = supabase.table("users").select("*").execute()
-        total_users = len(users_res.data) if users_res.data else 0
-        
-        # إحصائيات الأقسام
-        departments_res = supabase.table("departments").select("*").execute()
-        total_departments = len(departments_res.data) if departments_res.data else 0
-        
-        # إحصائيات القاعات
-        rooms_res = supabase.table("rooms").select("*").eq("is_active", True).execute()
-        total_rooms = len(rooms_res.data) if rooms_res.data else 0
-        
-        # إحصائيات الجداول
-        schedules_res = supabase.table("schedules").select("*").eq("is_active", True).execute()
-        total_schedules = len(schedules_res.data) if schedules_res.data else 0
-        
-        # إحصائيات الطلاب
-        students_res = supabase.table("students").select("*").execute()
-        total_students = len(students_res.data) if students_res.data else 0
-        
+        # Served from the shared statistics snapshot (count queries, cached)
+        snapshot = get_statistics_snapshot(force=request.args.get('refresh') == 'true')
+        totals = snapshot['totals']
+
         stats = {
-            'total_users': total_users,
-            'total_departments': total_departments,
-            'total_rooms': total_rooms,
-            'total_schedules': total_schedules,
-            'total_students': total_students,
+            'total_users': totals['total_users'],
+            'total_departments': totals['total_departments'],
+            'total_rooms': totals['active_rooms'],
+            'total_schedules': totals['active_schedules'],
+            'total_students': totals['total_students'],
+            'users_by_role': totals['users_by_role'],
+            'departments': department_breakdown(snapshot),
+            'generated_at': snapshot['generated_at'],
         }
         
         return format_response(data=stats, message="تم جلب إحصائيات لوحة التحكم")
@@ -242,7 +233,9 @@ def update_user_route(user_id):
             update_data['password_hash'] = set_password(data['password'])
         
         if update_data:
+            apply_permissions_bump(user_id, update_data, current_user=user_res.data[0])
             updated_res = supabase.table("users").update(update_data).eq("id", user_id).execute()
+            invalidate_user_cache(user_id=user_id)
             
             if updated_res.data:
                 return format_response(data=updated_res.data[0], message="تم تحديث المستخدم بنجاح")
@@ -285,6 +278,7 @@ def delete_user_route(user_id):
         
         # حذف المستخدم
         supabase.table("users").delete().eq("id", user_id).execute()
+        invalidate_user_cache(user_id=user_id)
         
         return format_response(message="تم حذف المستخدم بنجاح")
         
@@ -314,16 +308,119 @@ def get_all_departments():
 @owner_bp.route("/system/logs", methods=["GET"])
 @owner_required
 def get_system_logs():
-    """الحصول على سجلات النظام (استخدامات الطلاب)"""
+    """الحصول على سجلات النظام (استخدامات الطلاب) مقسمة إلى صفحات بالمؤشر
+
+    المعاملات: limit (بحد أقصى)، cursor (من ترويسة X-Next-Cursor للصفحة السابقة)، student_id، page، from، to
+    """
     try:
-        from models import get_recent_general_student_usages
-        
+        from models import get_general_student_usages_page
+
+        filters = parse_usage_log_filters(request.args)
         limit = request.args.get('limit', 100, type=int)
-        logs = get_recent_general_student_usages(limit=limit)
-        
-        return format_response(data=logs, message="تم جلب سجلات النظام")
-        
+        logs, next_cursor = get_general_student_usages_page(
+            limit=limit, cursor=request.args.get('cursor') or None, **filters
+        )
+
+        return paginated_response(logs, next_cursor, message="تم جلب سجلات النظام")
+
+    except ValueError as e:
+        return format_response(message=str(e), success=False, status_code=400)
+    except Exception as e:
+        return format_response(
+            message=f"حدث خطأ: {str(e)}", success=False, status_code=500
+        )
+
+
+@owner_bp.route("/system/logs/counts", methods=["GET"])
+@owner_required
+def get_system_log_counts():
+    """أعداد استخدامات الطلاب حسب اليوم والصفحة (افتراضياً آخر 30 يوماً)"""
+    try:
+        from models import count_general_student_usages
+
+        counts = count_general_student_usages(**parse_usage_log_filters(request.args))
+
+        return format_response(data=counts, message="تم جلب إحصائيات السجلات")
+
+    except ValueError as e:
+        return format_response(message=str(e), success=False, status_code=400)
+    except Exception as e:
+        return format_response(
+            message=f"حدث خطأ: {str(e)}", success=False, status_code=500
+        )
+
+
+@owner_bp.route("/system/usage-logger", methods=["GET"])
+@owner_required
+def get_usage_logger_stats():
+    """عدادات مسجل استخدامات الطلاب (المكتوب، المُسقط، الفاشل، وحجم الطابور) لهذه العملية"""
+    try:
+        from utils.usage_logger import get_usage_logger
+
+        return format_response(data=get_usage_logger().stats(), message="تم جلب إحصائيات مسجل الاستخدام")
+
+    except Exception as e:
+        return format_response(
+            message=f"حدث خطأ: {str(e)}", success=False, status_code=500
+        )
+
+
+@owner_bp.route("/system/scheduler", methods=["GET"])
+@owner_required
+def get_scheduler_status():
+    """حالة مهام الصيانة المجدولة: الفترة، آخر التشغيلات، ومقاييس المدة والصفوف المعدلة"""
+    try:
+        from utils.scheduler import get_scheduler
+
+        return format_response(data=get_scheduler().status(), message="تم جلب حالة المهام المجدولة")
+
     except Exception as e:
         return format_response(
             message=f"حدث خطأ: {str(e)}", success=False, status_code=500
-        )
\ No newline at end of file
+        )
+
+
+@owner_bp.route("/system/scheduler/<job_name>/run", methods=["POST"])
+@owner_required
+def run_scheduled_job(job_name):
+    """تشغيل مهمة صيانة فوراً في الخلفية (تُتخطى إذا كانت قيد التشغيل)"""
+    try:
+        from utils.scheduler import get_scheduler
+
+        scheduler = get_scheduler()
+        if job_name not in scheduler.jobs:
+            return format_response(message="المهمة غير موجودة", success=False, status_code=404)
+
+        # dry_run is forwarded to jobs that support it; the report is returned directly
+        if request.args.get("dry_run") == "true":
+            if "dry_run" not in inspect.signature(scheduler.jobs[job_name].func).parameters:
+                return format_response(
+                    message="هذه المهمة لا تدعم المعاينة (dry_run)", success=False, status_code=400
+                )
+            job = scheduler.jobs[job_name]
+            runs_before = job.metrics["runs"]
+            report = scheduler.run_now(job_name, wait=True, dry_run=True)
+            g.skip_scope_bump = True
+            # _execute returns None both when the run was skipped and when the job raised
+            if job.metrics["runs"] == runs_before:
+                return format_response(
+                    message="تم تخطي المعاينة لأن المهمة قيد التشغيل حالياً", success=False, status_code=409
+                )
+            entry = job.history[0]
+            if entry["status"] == "failed":
+                return format_response(
+                    data=entry, message=f"فشلت معاينة المهمة: {entry['error']}", success=False, status_code=500
+                )
+            return format_response(data=report, message="معاينة المهمة دون تنفيذ أي تعديل")
+
+        scheduler.run_now(job_name)
+        return format_response(
+            data=scheduler.jobs[job_name].to_dict(),
+            message="تم بدء تشغيل المهمة",
+            status_code=202,
+        )
+
+    except Exception as e:
+        return format_response(
+            message=f"حدث خطأ: {str(e)}", success=False, status_code=500
+        )
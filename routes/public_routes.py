@@ -1,14 +1,21 @@
 from flask import Blueprint, request, send_file, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import get_room_by_code, get_schedules_by_room_id, get_all_departments, log_general_page_usage
+from models import get_room_by_code, get_schedules_by_room_id, get_all_departments, attach_schedule_doctors, get_room_timetable_cache, select_all_pages
 from utils.qr_generator import generate_room_qr
-from utils.helpers import format_response
+from utils.helpers import format_response, conditional_response, conditional_get
+from utils.cache import compute_etag, get_scope_versions
+from utils.usage_logger import log_usage_async
+from datetime import timezone
 import os
 
+# Scopes a public room timetable depends on (ETag and cached timetable entries)
+TIMETABLE_SCOPES = ("rooms", "schedules", "doctors")
+
 public_bp = Blueprint("public", __name__)
 
 
 @public_bp.route("/room/<room_code>", methods=["GET"])
+@conditional_get(("rooms",), cache_control="public, max-age=300")
 def get_room_info(room_code):
     """الحصول على معلومات القاعة (عام - بدون تسجيل دخول)"""
     try:
@@ -37,10 +44,22 @@ def get_room_info(room_code):
 
 
 @public_bp.route("/room/<room_code>/schedule", methods=["GET"])
+@conditional_get(TIMETABLE_SCOPES)
 def get_room_schedule(room_code):
     """الحصول على جدول القاعة حسب نوع الدراسة (عام - بدون تسجيل دخول)"""
     try:
         supabase = current_app.supabase
+
+        # الجدول المحسوب مسبقاً لهذه القاعة (يُحذف عند أي تعديل على جداولها)
+        # Entries carry the shared scope versions, so a write on another worker is a miss here too
+        cache_key = (room_code, request.args.get("study_type"))
+        versions = get_scope_versions(current_app, TIMETABLE_SCOPES)
+        cached = get_room_timetable_cache().get(cache_key)
+        if cached and cached.get("versions") == versions:
+            return conditional_response(
+                cached["payload"], "تم جلب الجدول بنجاح", cached["etag"], cached["last_modified"]
+            )
+
         room_res = (
             supabase.table("rooms")
             .select("*, department:departments(name)")
@@ -85,32 +104,35 @@ def get_room_schedule(room_code):
         today = datetime.now().date()
         display_schedules = []
         
-        # Get multiple doctors for each schedule first
-        from models import get_schedule_doctors
-        for schedule in schedules_res.data:
-            schedule_doctors = get_schedule_doctors(schedule["id"])
-            schedule["schedule_doctors"] = schedule_doctors
-            
-            # Create a list of doctor names for display
-            if schedule_doctors:
-                doctor_names = []
-                primary_doctor = None
-                for sd in schedule_doctors:
-                    doctor_name = sd.get('doctors', {}).get('name', '')
-                    if doctor_name:  # Only add non-empty names
-                        if sd.get('is_primary'):
-                            primary_doctor = doctor_name
-                        doctor_names.append(doctor_name)
-                
-                schedule["multiple_doctors_names"] = doctor_names
-                schedule["primary_doctor_name"] = primary_doctor
-                schedule["has_multiple_doctors"] = len(doctor_names) > 1
-            else:
-                # No multiple doctors, set default values
-                schedule["multiple_doctors_names"] = []
-                schedule["primary_doctor_name"] = None
-                schedule["has_multiple_doctors"] = False
-        
+        # Get multiple doctors for all schedules in one query
+        attach_schedule_doctors(schedules_res.data)
+
+        # Bulk-fetch the original schedules (and their rooms) of temporary move-ins
+        move_ins = [
+            s for s in schedules_res.data
+            if not (s.get("is_postponed") and s.get("postponed_date"))
+            and s.get("is_temporary_move_in") and s.get("original_schedule_id")
+        ]
+        original_schedules = {}
+        original_rooms = {}
+        if move_ins:
+            original_schedules_res = (
+                supabase.table("schedules")
+                .select("id, room_id, day_of_week, start_time, end_time, move_reason, original_booking_date")
+                .in_("id", list({s["original_schedule_id"] for s in move_ins}))
+                .execute()
+            )
+            original_schedules = {s["id"]: s for s in (original_schedules_res.data or [])}
+            original_room_ids = list({s["room_id"] for s in original_schedules.values() if s.get("room_id")})
+            if original_room_ids:
+                original_rooms_res = (
+                    supabase.table("rooms")
+                    .select("id, name, code")
+                    .in_("id", original_room_ids)
+                    .execute()
+                )
+                original_rooms = {r["id"]: r for r in (original_rooms_res.data or [])}
+
         # Process schedules to determine what should be displayed
         for schedule in schedules_res.data:
             # إذا كانت المحاضرة مؤجلة، لا تضفها إطلاقاً إلى اليوم الأصلي ولا تظهر إلا في اليوم المؤجل فقط
@@ -118,14 +140,8 @@ def get_room_schedule(room_code):
                 continue
             # Check if this is a schedule that was moved into this room temporarily
             elif schedule.get("is_temporary_move_in") and schedule.get("original_schedule_id"):
-                original_schedule_res = (
-                    supabase.table("schedules")
-                    .select("room_id, day_of_week, start_time, end_time, move_reason, original_booking_date")
-                    .eq("id", schedule["original_schedule_id"])
-                    .execute()
-                )
-                if original_schedule_res.data:
-                    original_schedule = original_schedule_res.data[0]
+                original_schedule = original_schedules.get(schedule["original_schedule_id"])
+                if original_schedule:
                     schedule["is_moved_in_display"] = True
                     schedule["original_room_id"] = original_schedule.get("room_id")
                     schedule["original_day_of_week"] = original_schedule.get("day_of_week")
@@ -134,17 +150,11 @@ def get_room_schedule(room_code):
                     schedule["move_reason"] = original_schedule.get("move_reason")
                     schedule["original_booking_date"] = original_schedule.get("original_booking_date")
 
-                    # Fetch original room name
-                    if schedule.get("original_room_id"):
-                        original_room_res = (
-                            supabase.table("rooms")
-                            .select("name, code")
-                            .eq("id", schedule["original_room_id"])
-                            .execute()
-                        )
-                        if original_room_res.data:
-                            schedule["original_room_name"] = original_room_res.data[0].get("name", "")
-                            schedule["original_room_code"] = original_room_res.data[0].get("code", "")
+                    # Original room name
+                    original_room = original_rooms.get(schedule.get("original_room_id"))
+                    if original_room:
+                        schedule["original_room_name"] = original_room.get("name", "")
+                        schedule["original_room_code"] = original_room.get("code", "")
                 display_schedules.append(schedule)
             # Regular schedule for this room with no postponement or move
             else:
@@ -209,7 +219,18 @@ def get_room_schedule(room_code):
             "schedule": organized_schedule
         }
 
-        return format_response(data=response_data, message="تم جلب الجدول بنجاح")
+        entry = {
+            "room_id": room["id"],
+            "versions": versions,
+            "payload": response_data,
+            "etag": compute_etag(response_data),
+            "last_modified": datetime.now(timezone.utc).replace(microsecond=0),
+        }
+        get_room_timetable_cache().set(cache_key, entry)
+
+        return conditional_response(
+            response_data, "تم جلب الجدول بنجاح", entry["etag"], entry["last_modified"]
+        )
 
     except Exception as e:
         import traceback
@@ -272,6 +293,7 @@ def get_room_qr(room_code):
 
 
 @public_bp.route("/departments", methods=["GET"])
+@conditional_get(("departments",), cache_control="public, max-age=600")
 def get_departments_public():
     """الحصول على قائمة الأقسام (محمية)"""
     try:
@@ -285,6 +307,7 @@ def get_departments_public():
 
 
 @public_bp.route("/departments/summary", methods=["GET"])
+@conditional_get(("departments", "rooms", "doctors", "users"), cache_control="public, max-age=300")
 def get_departments_summary():
     """إرجاع ملخص عن الأقسام: عدد القاعات، عدد الدكاترة، اسم رئيس القسم، وقائمة القاعات مع السعة واسم ملف QR (عام - بدون تسجيل دخول)"""
     try:
@@ -293,51 +316,51 @@ def get_departments_summary():
         if not departments_res.data:
             return format_response(data=[], message="لا توجد أقسام");
 
+        # Three bulk reads for all departments (paged past the 1000-row cap), grouped in memory
+        rooms = select_all_pages(
+            supabase.table("rooms")
+            .select("id,name,code,capacity,qr_code_path,department_id")
+            .eq("is_active", True)
+            .order("id")
+        )
+        doctors = select_all_pages(supabase.table("doctors").select("department_id").order("id"))
+        heads = select_all_pages(
+            supabase.table("users")
+            .select("department_id,full_name")
+            .eq("role", "department_head")
+            .order("id")
+        )
+
+        rooms_by_dept = {}
+        for r in rooms:
+            qr_path = r.get("qr_code_path")
+            rooms_by_dept.setdefault(r.get("department_id"), []).append({
+                "id": r.get("id"),
+                "name": r.get("name"),
+                "code": r.get("code"),
+                "capacity": r.get("capacity"),
+                "qr_filename": os.path.basename(qr_path) if qr_path else None,
+            })
+
+        doctors_count_by_dept = {}
+        for d in doctors:
+            dept_id = d.get("department_id")
+            doctors_count_by_dept[dept_id] = doctors_count_by_dept.get(dept_id, 0) + 1
+
+        # First department head found per department (same as limit(1) before)
+        head_by_dept = {}
+        for h in heads:
+            head_by_dept.setdefault(h.get("department_id"), h.get("full_name"))
+
         summary = []
-        import os
         for dept in departments_res.data:
             dept_id = dept.get("id")
-            # Rooms for this department
-            rooms_res = (
-                supabase.table("rooms")
-                .select("id,name,code,capacity,qr_code_path")
-                .eq("department_id", dept_id)
-                .eq("is_active", True)
-                .execute()
-            )
-            rooms = []
-            if rooms_res.data:
-                for r in rooms_res.data:
-                    qr_path = r.get("qr_code_path")
-                    qr_filename = os.path.basename(qr_path) if qr_path else None
-                    rooms.append({
-                        "id": r.get("id"),
-                        "name": r.get("name"),
-                        "code": r.get("code"),
-                        "capacity": r.get("capacity"),
-                        "qr_filename": qr_filename,
-                    })
-
-            # Count doctors in dept
-            doctors_count_res = (
-                supabase.table("doctors").select("id", count="exact").eq("department_id", dept_id).execute()
-            )
-            doctors_count = doctors_count_res.count if doctors_count_res is not None else 0
-
-            # Find department head name (user with role department_head)
-            head_res = (
-                supabase.table("users").select("full_name").eq("department_id", dept_id).eq("role", "department_head").limit(1).execute()
-            )
-            head_name = None
-            if head_res and head_res.data:
-                head_name = head_res.data[0].get("full_name")
-
             summary.append({
                 "id": dept_id,
                 "name": dept.get("name"),
-                "head_name": head_name,
-                "doctors_count": doctors_count,
-                "rooms": rooms,
+                "head_name": head_by_dept.get(dept_id),
+                "doctors_count": doctors_count_by_dept.get(dept_id, 0),
+                "rooms": rooms_by_dept.get(dept_id, []),
             })
 
         return format_response(data=summary, message="تم جلب ملخص الأقسام بنجاح")
@@ -377,6 +400,7 @@ def search_rooms():
 
 
 @public_bp.route("/room/<room_code>/view", methods=["GET"])
+@conditional_get(("rooms", "schedules", "doctors"))
 def view_room_schedule(room_code):
     """عرض جدول القاعة بشكل مباشر (بدون تسجيل دخول)"""
     try:
@@ -407,31 +431,8 @@ def view_room_schedule(room_code):
             .execute()
         )
 
-        # Get multiple doctors for each schedule
-        from models import get_schedule_doctors
-        for schedule in schedules_res.data:
-            schedule_doctors = get_schedule_doctors(schedule["id"])
-            schedule["schedule_doctors"] = schedule_doctors
-            
-            # Create a list of doctor names for display
-            if schedule_doctors:
-                doctor_names = []
-                primary_doctor = None
-                for sd in schedule_doctors:
-                    doctor_name = sd.get('doctors', {}).get('name', '')
-                    if doctor_name:  # Only add non-empty names
-                        if sd.get('is_primary'):
-                            primary_doctor = doctor_name
-                        doctor_names.append(doctor_name)
-                
-                schedule["multiple_doctors_names"] = doctor_names
-                schedule["primary_doctor_name"] = primary_doctor
-                schedule["has_multiple_doctors"] = len(doctor_names) > 1
-            else:
-                # No multiple doctors, set default values
-                schedule["multiple_doctors_names"] = []
-                schedule["primary_doctor_name"] = None
-                schedule["has_multiple_doctors"] = False
+        # Get multiple doctors for all schedules in one query
+        attach_schedule_doctors(schedules_res.data)
 
         organized_schedule = {}
         days_order = [
@@ -481,6 +482,7 @@ def view_room_schedule(room_code):
 
 
 @public_bp.route("/room/<room_code>/announcements", methods=["GET"])
+@conditional_get(("rooms", "announcements"), cache_control="public, max-age=60", ttl=60)
 def get_room_announcements(room_code):
     """الحصول على إعلانات قسم القاعة (عام - بدون تسجيل دخول)"""
     try:
@@ -536,6 +538,7 @@ def get_room_announcements(room_code):
         )
 
 @public_bp.route("/department/<int:department_id>/weekly-schedule/<stage>/<study_type>", methods=["GET"])
+@conditional_get(("rooms", "schedules", "doctors"))
 def get_full_weekly_schedule(department_id, stage, study_type):
     """
     جلب الجدول الأسبوعي الكامل لمرحلة ونوع دراسة معين في قسم.
@@ -560,25 +563,18 @@ def get_full_weekly_schedule(department_id, stage, study_type):
         if not query.data:
             return format_response(data={}, message="لا توجد بيانات جدول متاحة لهذه المرحلة.")
 
-        # Get multiple doctors for each schedule
-        from models import get_schedule_doctors
-        for schedule in query.data:
-            schedule_doctors = get_schedule_doctors(schedule["id"])
-            schedule["schedule_doctors"] = schedule_doctors
-            
-            # Create a list of doctor names for display
-            if schedule_doctors:
-                doctor_names = []
-                primary_doctor = None
-                for sd in schedule_doctors:
-                    doctor_name = sd.get('doctors', {}).get('name', '')
-                    if sd.get('is_primary'):
-                        primary_doctor = doctor_name
-                    doctor_names.append(doctor_name)
-                
-                schedule["multiple_doctors_names"] = doctor_names
-                schedule["primary_doctor_name"] = primary_doctor
-                schedule["has_multiple_doctors"] = len(doctor_names) > 1
+        # Get multiple doctors for all schedules in one query
+        attach_schedule_doctors(query.data)
+
+        # Bulk-fetch the rooms that temporary move-ins were postponed to
+        postponed_room_ids = list({
+            item["postponed_to_room_id"] for item in query.data
+            if item.get("is_temporary_move_in") and item.get("postponed_to_room_id")
+        })
+        postponed_rooms = {}
+        if postponed_room_ids:
+            rooms_res = supabase.table("rooms").select("id,name,code").in_("id", postponed_room_ids).execute()
+            postponed_rooms = {r["id"]: r for r in (rooms_res.data or [])}
 
         # Filter and organize data
         schedule_by_day = {}
@@ -594,14 +590,13 @@ def get_full_weekly_schedule(department_id, stage, study_type):
             
             # If it's a temporary move-in, use its postponed details for display
             if item.get("is_temporary_move_in"):
-                # Fetch the room name/code for the postponed_to_room_id if available
+                # Room name/code for the postponed_to_room_id if available
                 postponed_room_name = "N/A"
                 postponed_room_code = "N/A"
-                if item.get("postponed_to_room_id"):
-                    room_res = supabase.table("rooms").select("name,code").eq("id", item["postponed_to_room_id"]).execute()
-                    if room_res.data:
-                        postponed_room_name = room_res.data[0].get("name")
-                        postponed_room_code = room_res.data[0].get("code")
+                postponed_room = postponed_rooms.get(item.get("postponed_to_room_id"))
+                if postponed_room:
+                    postponed_room_name = postponed_room.get("name")
+                    postponed_room_code = postponed_room.get("code")
 
                 schedule_item = {
                     "id": item.get("id"),
@@ -688,7 +683,8 @@ def log_student_usage():
         if not student_id:
             return format_response(message='studentId is required', success=False, status_code=400)
 
-        record = log_general_page_usage(student_id, student_name, page='general', meta=meta)
-        return format_response(data=record, message='Logged student usage')
+        # Buffered: the row is written by the background batch writer
+        queued = log_usage_async(student_id, student_name, page='general', meta=meta)
+        return format_response(data={'queued': queued}, message='Logged student usage')
     except Exception as e:
         return format_response(message=f'Failed to log usage: {str(e)}', success=False, status_code=500)
\ No newline at end of file
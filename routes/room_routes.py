@@ -1,6 +1,6 @@
-from flask import Blueprint, request, send_file, current_app
+from flask import Blueprint, request, send_file, current_app, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import get_user_by_username
+from models import get_cached_user_by_username, invalidate_room_timetables, delete_room_cascade
 from utils.helpers import (
     department_access_required,
     validate_json_data,
@@ -12,6 +12,11 @@ from utils.helpers import (
     validate_academic_stage,
 )
 from utils.qr_generator import generate_room_qr, delete_room_qr
+from utils.conflict_engine import ConflictEngine
+from utils.excel_ingest import ExcelReadError, read_excel_frame
+from utils.schedule_import import prepare_schedule_rows, replace_room_schedules, sync_room_schedules
+from utils.jobs import background_job, report_progress
+from utils.maintenance import regenerate_qr_codes
 import os
 import io
 
@@ -25,7 +30,7 @@ def get_rooms():
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -93,7 +98,7 @@ def create_room():
                 )
 
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -201,7 +206,7 @@ def get_room(room_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -274,7 +279,7 @@ def update_room(room_id):
             )
 
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -317,6 +322,7 @@ def update_room(room_id):
                 .eq("id", room_id)
                 .execute()
             )
+            invalidate_room_timetables(room_id)
             return format_response(
                 data=updated_room_res.data[0], message="تم تحديث القاعة بنجاح"
             )
@@ -338,7 +344,7 @@ def delete_room(room_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -366,64 +372,19 @@ def delete_room(room_id):
                 status_code=403,
             )
 
-        # حذف جميع البيانات المرتبطة بالقاعة بالترتيب الصحيح
+        # حذف القاعة مع جداولها ومحاضريها وإعلاناتها (RPC واحد أو طلبات مجمعة بـ in_)
         try:
-            # 1. جلب جميع الجداول المرتبطة بالقاعة في أي حقل
-            schedules_res = supabase.table("schedules").select("id, moved_to_schedule_id").or_(
-                f"room_id.eq.{room_id},original_room_id.eq.{room_id},postponed_to_room_id.eq.{room_id}"
-            ).execute()
-            schedule_ids = [s["id"] for s in schedules_res.data] if schedules_res.data else []
-            
-            # أضف moved_to_schedule_id إذا كان موجوداً
-            for s in schedules_res.data:
-                if s.get("moved_to_schedule_id"):
-                    schedule_ids.append(s["moved_to_schedule_id"])
-            
-            # إزالة التكرارات
-            schedule_ids = list(set(schedule_ids))
-            
-            # 2. حذف schedule_doctors للجداول المرتبطة
-            if schedule_ids:
-                for schedule_id in schedule_ids:
-                    try:
-                        supabase.table("schedule_doctors").delete().eq("schedule_id", schedule_id).execute()
-                    except Exception as sd_err:
-                        print(f"خطأ في حذف schedule_doctors للجدول {schedule_id}: {str(sd_err)}")
-            
-            # 3. nullify أي references إلى هذه schedules
-            for schedule_id in schedule_ids:
-                try:
-                    supabase.table("schedules").update({"moved_to_schedule_id": None}).eq("moved_to_schedule_id", schedule_id).execute()
-                    supabase.table("schedules").update({"original_schedule_id": None}).eq("original_schedule_id", schedule_id).execute()
-                except Exception as ref_err:
-                    print(f"خطأ في nullify references للجدول {schedule_id}: {str(ref_err)}")
-            
-            # 4. حذف الإعلانات المرتبطة بالقاعة
-            try:
-                supabase.table("announcements").delete().eq("room_id", room_id).execute()
-            except Exception as ann_err:
-                print(f"خطأ في حذف الإعلانات: {str(ann_err)}")
-            
-            # 5. حذف الجداول (schedules)
-            if schedule_ids:
-                for schedule_id in schedule_ids:
-                    try:
-                        supabase.table("schedules").delete().eq("id", schedule_id).execute()
-                    except Exception as sch_err:
-                        print(f"خطأ في حذف الجدول {schedule_id}: {str(sch_err)}")
-            
-            # 6. حذف ملف QR إن وجد
+            result = delete_room_cascade(room_id)
+
+            # حذف ملف QR إن وجد (بعد نجاح الحذف من قاعدة البيانات)
             if room.get("qr_code_path"):
                 try:
                     delete_room_qr(room["qr_code_path"])
                 except Exception as qr_err:
                     print(f"خطأ في حذف QR: {str(qr_err)}")
-            
-            # 7. حذف القاعة نفسها
-            supabase.table("rooms").delete().eq("id", room_id).execute()
-            
-            return format_response(message="تم حذف القاعة بنجاح")
-            
+
+            return format_response(message="تم حذف القاعة بنجاح", data=result)
+
         except Exception as delete_err:
             return format_response(
                 message=f"فشل في حذف القاعة: {str(delete_err)}", 
@@ -444,7 +405,7 @@ def get_room_schedules(room_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -532,7 +493,7 @@ def create_schedule(room_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -734,134 +695,42 @@ def create_schedule(room_id):
                 status_code=400,
             )
 
-        # Check for conflicting schedules
-        conflicting_schedule_res = (
-            supabase.table("schedules")
-            .select("*")
-            .eq("room_id", room_id)
-            .eq("study_type", data["study_type"])
-            .eq("day_of_week", data["day_of_week"])
-            .eq("is_active", True)
-            .lt("start_time", data['end_time'])
-            .gt("end_time", data['start_time'])
-            .neq("end_time", data['start_time'])  # استثناء الحالات المتتالية
-            .neq("start_time", data['end_time'])  # استثناء الحالات المتتالية
-            .execute()
+        # Check room and doctor conflicts in one pass (loading only this room's and these doctors' schedules)
+        if use_multiple_doctors and doctor_ids:
+            check_doctor_ids = doctor_ids
+        else:
+            check_doctor_ids = [data["doctor_id"]] if data.get("doctor_id") else []
+        engine = ConflictEngine.load(
+            supabase, day_of_week=data["day_of_week"], study_type=data["study_type"],
+            room_ids=[room_id], doctor_ids=check_doctor_ids,
+        )
+        conflicts = engine.check(
+            room_id,
+            check_doctor_ids,
+            data["day_of_week"],
+            data["study_type"],
+            data["start_time"],
+            data["end_time"],
         )
 
-        if conflicting_schedule_res.data:
+        if conflicts["room"]:
             # Return conflicting schedule details to frontend for user action
             return format_response(
                 message="يوجد تداخل مع محاضرة أخرى في نفس القاعة والوقت. يرجى تغيير توقيت المحاضرة الأصلية أو مكانها.",
                 success=False,
                 status_code=409,  # Conflict
-                data=conflicting_schedule_res.data[0]
+                data=conflicts["room"]
             )
 
-        # Check doctor availability if doctors are specified
-        if use_multiple_doctors and doctor_ids:
-            # Check doctor availability for each doctor
-            for doctor_id in doctor_ids:
-                doctor_conflict_res = (
-                    supabase.table("schedule_doctors")
-                    .select("""
-                        schedules!schedule_doctors_schedule_id_fkey(
-                            id, study_type, day_of_week, start_time, end_time
-                        )
-                    """)
-                    .eq("doctor_id", doctor_id)
-                    .execute()
-                )
-                
-                for schedule_doctor in doctor_conflict_res.data:
-                    schedule = schedule_doctor.get('schedules')
-                    if schedule:
-                        # Parse schedule times to handle comparison correctly
-                        try:
-                            sched_start = datetime.strptime(schedule['start_time'], "%H:%M:%S").time()
-                            sched_end = datetime.strptime(schedule['end_time'], "%H:%M:%S").time()
-                        except ValueError:
-                            # Fallback to %H:%M if no seconds
-                            sched_start = datetime.strptime(schedule['start_time'], "%H:%M").time()
-                            sched_end = datetime.strptime(schedule['end_time'], "%H:%M").time()
-                        
-                        if (schedule['study_type'] == data['study_type'] and
-                            schedule['day_of_week'] == data['day_of_week'] and
-                            sched_start < end_time and
-                            sched_end > start_time and
-                            sched_end != start_time and
-                            sched_start != end_time):
-                            
-                            doctor_info = supabase.table("doctors").select("name").eq("id", doctor_id).execute()
-                            doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
-                            return format_response(
-                                message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
-                                success=False,
-                                status_code=400,
-                            )
-        elif data.get("doctor_id"):
-            # Check single doctor availability in schedules table
-            doctor_conflict_res = (
-                supabase.table("schedules")
-                .select("*")
-                .eq("doctor_id", data["doctor_id"])
-                .eq("study_type", data["study_type"])
-                .eq("day_of_week", data["day_of_week"])
-                .eq("is_active", True)
-                .lt("start_time", data['end_time'])
-                .gt("end_time", data['start_time'])
-                .neq("end_time", data['start_time'])
-                .neq("start_time", data['end_time'])
-                .execute()
-            )
-            
-            if doctor_conflict_res.data:
-                doctor_info = supabase.table("doctors").select("name").eq("id", data["doctor_id"]).execute()
-                doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
-                return format_response(
-                    message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
-                    success=False,
-                    status_code=400,
-                )
-            
-            # Also check in schedule_doctors table for multiple doctor schedules
-            doctor_conflict_res_multi = (
-                supabase.table("schedule_doctors")
-                .select("""
-                    schedules!schedule_doctors_schedule_id_fkey(
-                        id, study_type, day_of_week, start_time, end_time
-                    )
-                """)
-                .eq("doctor_id", data["doctor_id"])
-                .execute()
+        if conflicts["doctor"]:
+            conflict_doctor_id, _ = conflicts["doctor"]
+            doctor_info = supabase.table("doctors").select("name").eq("id", conflict_doctor_id).execute()
+            doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
+            return format_response(
+                message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
+                success=False,
+                status_code=400,
             )
-            
-            for schedule_doctor in doctor_conflict_res_multi.data:
-                schedule = schedule_doctor.get('schedules')
-                if schedule:
-                    # Parse schedule times to handle comparison correctly
-                    try:
-                        sched_start = datetime.strptime(schedule['start_time'], "%H:%M:%S").time()
-                        sched_end = datetime.strptime(schedule['end_time'], "%H:%M:%S").time()
-                    except ValueError:
-                        # Fallback to %H:%M if no seconds
-                        sched_start = datetime.strptime(schedule['start_time'], "%H:%M").time()
-                        sched_end = datetime.strptime(schedule['end_time'], "%H:%M").time()
-                    
-                    if (schedule['study_type'] == data['study_type'] and
-                        schedule['day_of_week'] == data['day_of_week'] and
-                        sched_start < end_time and
-                        sched_end > start_time and
-                        sched_end != start_time and
-                        sched_start != end_time):
-                        
-                        doctor_info = supabase.table("doctors").select("name").eq("id", data["doctor_id"]).execute()
-                        doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
-                        return format_response(
-                            message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
-                            success=False,
-                            status_code=400,
-                        )
 
         # Create regular schedule
         schedule_data = {
@@ -934,6 +803,7 @@ def create_schedule(room_id):
             from models import get_schedule_doctors
             schedule_with_doctors = get_schedule_doctors(schedule["id"])
             schedule["schedule_doctors"] = schedule_with_doctors
+            invalidate_room_timetables(room_id)
             
             return format_response(
                 data=schedule,
@@ -942,6 +812,7 @@ def create_schedule(room_id):
             )
 
         # For single doctor case
+        invalidate_room_timetables(room_id)
         return format_response(
             data=schedule,
             message="تم إنشاء الجدول بنجاح",
@@ -1005,21 +876,10 @@ def create_schedule_with_multiple_doctors(data, user, room_id):
             )
 
         # Check for conflicting schedules
-        conflicting_schedule_res = (
-            supabase.table("schedules")
-            .select("*")
-            .eq("room_id", room_id)
-            .eq("study_type", data["study_type"])
-            .eq("day_of_week", data["day_of_week"])
-            .eq("is_active", True)
-            .lt("start_time", data['end_time'])
-            .gt("end_time", data['start_time'])
-            .neq("end_time", data['start_time'])  # استثناء الحالات المتتالية
-            .neq("start_time", data['end_time'])  # استثناء الحالات المتتالية
-            .execute()
+        engine = ConflictEngine.load(
+            supabase, day_of_week=data["day_of_week"], study_type=data["study_type"], room_ids=[room_id]
         )
-
-        if conflicting_schedule_res.data:
+        if engine.room_conflict(room_id, data["day_of_week"], data["study_type"], data["start_time"], data["end_time"]):
             return format_response(
                 message="يوجد تداخل مع جدول آخر في نفس الوقت",
                 success=False,
@@ -1082,70 +942,19 @@ def create_schedule_with_multiple_doctors(data, user, room_id):
                     status_code=400,
                 )
         
-        # Check doctor availability for each doctor
-        for doctor_id in doctor_ids:
-            # Check in schedule_doctors table
-            doctor_conflict_res = (
-                supabase.table("schedule_doctors")
-                .select("""
-                    schedules!schedule_doctors_schedule_id_fkey(
-                        id, study_type, day_of_week, start_time, end_time
-                    )
-                """)
-                .eq("doctor_id", doctor_id)
-                .execute()
-            )
-            
-            for schedule_doctor in doctor_conflict_res.data:
-                schedule = schedule_doctor.get('schedules')
-                if schedule:
-                    # Parse schedule times to handle comparison correctly
-                    try:
-                        sched_start = datetime.strptime(schedule['start_time'], "%H:%M:%S").time()
-                        sched_end = datetime.strptime(schedule['end_time'], "%H:%M:%S").time()
-                    except ValueError:
-                        # Fallback to %H:%M if no seconds
-                        sched_start = datetime.strptime(schedule['start_time'], "%H:%M").time()
-                        sched_end = datetime.strptime(schedule['end_time'], "%H:%M").time()
-                    
-                    if (schedule['study_type'] == data['study_type'] and
-                        schedule['day_of_week'] == data['day_of_week'] and
-                        sched_start < end_time and
-                        sched_end > start_time and
-                        sched_end != start_time and
-                        sched_start != end_time):
-                        
-                        doctor_info = supabase.table("doctors").select("name").eq("id", doctor_id).execute()
-                        doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
-                        return format_response(
-                            message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
-                            success=False,
-                            status_code=400,
-                        )
-            
-            # Also check in schedules table for legacy single doctor schedules
-            doctor_conflict_res_legacy = (
-                supabase.table("schedules")
-                .select("*")
-                .eq("doctor_id", doctor_id)
-                .eq("study_type", data["study_type"])
-                .eq("day_of_week", data["day_of_week"])
-                .eq("is_active", True)
-                .lt("start_time", data['end_time'])
-                .gt("end_time", data['start_time'])
-                .neq("end_time", data['start_time'])
-                .neq("start_time", data['end_time'])
-                .execute()
+        # Check doctor availability (primary and assistant assignments)
+        doctor_conflict = engine.doctor_conflict(
+            doctor_ids, data["day_of_week"], data["study_type"], data["start_time"], data["end_time"]
+        )
+        if doctor_conflict:
+            conflict_doctor_id, _ = doctor_conflict
+            doctor_info = supabase.table("doctors").select("name").eq("id", conflict_doctor_id).execute()
+            doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
+            return format_response(
+                message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
+                success=False,
+                status_code=400,
             )
-            
-            if doctor_conflict_res_legacy.data:
-                doctor_info = supabase.table("doctors").select("name").eq("id", doctor_id).execute()
-                doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
-                return format_response(
-                    message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
-                    success=False,
-                    status_code=400,
-                )
 
         use_multiple_doctors = True
 
@@ -1220,6 +1029,7 @@ def create_schedule_with_multiple_doctors(data, user, room_id):
             from models import get_schedule_doctors
             schedule_with_doctors = get_schedule_doctors(schedule["id"])
             schedule["schedule_doctors"] = schedule_with_doctors
+            invalidate_room_timetables(room_id)
             
             return format_response(
                 data=schedule,
@@ -1243,7 +1053,7 @@ def update_schedule(room_id, schedule_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -1310,7 +1120,7 @@ def update_schedule(room_id, schedule_id):
         use_multiple_doctors = data.get("use_multiple_doctors", False)
         
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -1347,6 +1157,21 @@ def update_schedule(room_id, schedule_id):
 
         update_data = {"subject_name": data["subject_name"]}
 
+        # Determine study_type and day_of_week for conflict checks
+        check_study_type = data.get("study_type", current_schedule["study_type"])
+        check_day_of_week = data.get("day_of_week", current_schedule["day_of_week"])
+        # Doctors to check for availability (only when changed)
+        if use_multiple_doctors:
+            check_doctor_ids = data.get("doctor_ids", [])
+        elif data.get("doctor_id") and data["doctor_id"] != current_schedule.get("doctor_id"):
+            check_doctor_ids = [data["doctor_id"]]
+        else:
+            check_doctor_ids = []
+        engine = ConflictEngine.load(
+            supabase, day_of_week=check_day_of_week, study_type=check_study_type,
+            room_ids=[room_id, data.get("room_id")], doctor_ids=check_doctor_ids,
+        )
+
         # Handle room_id change
         if "room_id" in data and data["room_id"] != room_id:
             new_room_id = data["room_id"]
@@ -1357,19 +1182,14 @@ def update_schedule(room_id, schedule_id):
                 )
             
             # Conflict check in the new room
-            conflicting_schedule_in_new_room_res = (
-                supabase.table("schedules")
-                .select("id")
-                .eq("room_id", new_room_id)
-                .eq("study_type", current_schedule["study_type"])
-                .eq("day_of_week", current_schedule["day_of_week"])
-                .eq("is_active", True)
-                .lt("start_time", current_schedule['end_time'])
-                .gt("end_time", current_schedule['start_time'])
-                .execute()
-            )
-
-            if conflicting_schedule_in_new_room_res.data:
+            if engine.room_conflict(
+                new_room_id,
+                check_day_of_week,
+                check_study_type,
+                data.get("start_time", current_schedule["start_time"]),
+                data.get("end_time", current_schedule["end_time"]),
+                exclude_ids=[schedule_id],
+            ):
                 return format_response(
                     message="القاعة الجديدة مشغولة في هذا الوقت",
                     success=False,
@@ -1396,10 +1216,6 @@ def update_schedule(room_id, schedule_id):
         if "notes" in data:
             update_data["notes"] = data.get("notes")
 
-        # Determine study_type and day_of_week for conflict checks
-        check_study_type = data.get("study_type", current_schedule["study_type"])
-        check_day_of_week = data.get("day_of_week", current_schedule["day_of_week"])
-
         if "start_time" in data and "end_time" in data:
             if not validate_time_format(
                 data["start_time"]
@@ -1430,20 +1246,14 @@ def update_schedule(room_id, schedule_id):
                 )
 
             # Check for conflicting schedules in room
-            conflicting_schedule_res = (
-                supabase.table("schedules")
-                .select("id")
-                .eq("room_id", room_id)
-                .eq("study_type", check_study_type)
-                .eq("day_of_week", check_day_of_week)
-                .eq("is_active", True)
-                .neq("id", schedule_id) # Exclude current schedule from conflict check
-                .lt("start_time", data['end_time'])
-                .gt("end_time", data['start_time'])
-                .execute()
-            )
-
-            if conflicting_schedule_res.data:
+            if engine.room_conflict(
+                room_id,
+                check_day_of_week,
+                check_study_type,
+                data["start_time"],
+                data["end_time"],
+                exclude_ids=[schedule_id],  # Exclude current schedule from conflict check
+            ):
                 return format_response(
                     message="يوجد تداخل مع جدول آخر في نفس الوقت",
                     success=False,
@@ -1454,73 +1264,23 @@ def update_schedule(room_id, schedule_id):
             update_data["end_time"] = data["end_time"]
 
         # Check doctor availability if doctor changed
-        if use_multiple_doctors:
-            doctor_ids = data.get("doctor_ids", [])
-            for doctor_id in doctor_ids:
-                doctor_conflict_res = (
-                    supabase.table("schedule_doctors")
-                    .select("""
-                        schedules!schedule_doctors_schedule_id_fkey(
-                            id, study_type, day_of_week, start_time, end_time
-                        )
-                    """)
-                    .eq("doctor_id", doctor_id)
-                    .execute()
-                )
-                
-                for schedule_doctor in doctor_conflict_res.data:
-                    schedule = schedule_doctor.get('schedules')
-                    if (schedule and 
-                        schedule['id'] != schedule_id and  # Exclude current schedule
-                        schedule['study_type'] == check_study_type and
-                        schedule['day_of_week'] == check_day_of_week):
-                        
-                        # Parse schedule times to handle comparison correctly
-                        try:
-                            sched_start = datetime.strptime(schedule['start_time'], "%H:%M:%S").time()
-                            sched_end = datetime.strptime(schedule['end_time'], "%H:%M:%S").time()
-                        except ValueError:
-                            # Fallback to %H:%M if no seconds
-                            sched_start = datetime.strptime(schedule['start_time'], "%H:%M").time()
-                            sched_end = datetime.strptime(schedule['end_time'], "%H:%M").time()
-                        
-                        # Use new times if updating, else current
-                        check_start = start_time if "start_time" in data else datetime.strptime(current_schedule['start_time'], "%H:%M").time()
-                        check_end = end_time if "end_time" in data else datetime.strptime(current_schedule['end_time'], "%H:%M").time()
-                        
-                        if (sched_start < check_end and
-                            sched_end > check_start):
-                            
-                            doctor_info = supabase.table("doctors").select("name").eq("id", doctor_id).execute()
-                            doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
-                            return format_response(
-                                message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
-                                success=False,
-                                status_code=400,
-                            )
-        else:
-            # Check single doctor availability
-            if data.get("doctor_id") and data["doctor_id"] != current_schedule.get("doctor_id"):
-                doctor_conflict_res = (
-                    supabase.table("schedules")
-                    .select("id, doctors!fk_doctor(name)")
-                    .eq("doctor_id", data["doctor_id"])
-                    .eq("study_type", check_study_type)
-                    .eq("day_of_week", check_day_of_week)
-                    .eq("is_active", True)
-                    .neq("id", schedule_id) # Exclude current schedule from conflict check
-                    .lt("start_time", data.get('end_time', current_schedule['end_time']))
-                    .gt("end_time", data.get('start_time', current_schedule['start_time']))
-                    .execute()
-                )
-                
-                if doctor_conflict_res.data:
-                    doctor_name = doctor_conflict_res.data[0].get('doctors', {}).get('name', 'غير معروف') if doctor_conflict_res.data else 'غير معروف'
-                    return format_response(
-                        message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
-                        success=False,
-                        status_code=400,
-                    )
+        doctor_conflict = engine.doctor_conflict(
+            check_doctor_ids,
+            check_day_of_week,
+            check_study_type,
+            data.get("start_time", current_schedule["start_time"]),
+            data.get("end_time", current_schedule["end_time"]),
+            exclude_ids=[schedule_id],  # Exclude current schedule from conflict check
+        )
+        if doctor_conflict:
+            conflict_doctor_id, _ = doctor_conflict
+            doctor_info = supabase.table("doctors").select("name").eq("id", conflict_doctor_id).execute()
+            doctor_name = doctor_info.data[0]['name'] if doctor_info.data else 'غير معروف'
+            return format_response(
+                message=f"الدكتور {doctor_name} لديه تداخل في هذا الوقت مع محاضرة أخرى",
+                success=False,
+                status_code=400,
+            )
 
         # Update lecture type and grouping fields
         if 'lecture_type' in data or db_lecture_type:
@@ -1571,6 +1331,7 @@ def update_schedule(room_id, schedule_id):
             schedule_doctors = get_schedule_doctors(schedule_id)
             updated_schedule["schedule_doctors"] = schedule_doctors
 
+        invalidate_room_timetables(room_id, update_data.get("room_id"))
         return format_response(
             data=updated_schedule, message="تم تحديث الجدول بنجاح"
         )
@@ -1626,6 +1387,7 @@ def delete_schedule(user, room_id, schedule_id):
             supabase.table("schedules").delete().eq("id", schedule["moved_to_schedule_id"]).execute()
 
         supabase.table("schedules").delete().eq("id", schedule_id).execute()
+        invalidate_room_timetables(room_id, schedule.get("postponed_to_room_id"))
 
         return format_response(message="تم حذف الجدول بنجاح")
 
@@ -1645,7 +1407,7 @@ def get_room_qr(room_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -1695,7 +1457,7 @@ def regenerate_room_qr(room_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
 
         if not user:
@@ -1751,6 +1513,51 @@ def regenerate_room_qr(room_id):
         )
 
 
+@room_bp.route("/regenerate-qr", methods=["POST"])
+@jwt_required()
+@background_job("qr_regenerate_all")
+def regenerate_all_rooms_qr():
+    """إعادة إنشاء QR Code لجميع القاعات ضمن صلاحية المستخدم (يفضل استدعاؤها مع async=true)"""
+    try:
+        supabase = current_app.supabase
+        username = get_jwt_identity()
+        user = get_cached_user_by_username(username)
+
+        if not user:
+            return format_response(
+                message="المستخدم غير موجود", success=False, status_code=404
+            )
+
+        if user["role"] not in ["owner", "dean", "department_head", "supervisor"]:
+            return format_response(
+                message="صلاحيات غير كافية", success=False, status_code=403
+            )
+
+        query = supabase.table("rooms").select("id, code, qr_code_path").eq("is_active", True)
+        if user["role"] not in ["dean", "owner"]:
+            if not user.get("department_id"):
+                return format_response(
+                    message="المستخدم غير مرتبط بقسم",
+                    success=False,
+                    status_code=403,
+                )
+            query = query.eq("department_id", user["department_id"])
+        rooms = query.execute().data or []
+
+        result = regenerate_qr_codes(rooms, progress=report_progress)
+        regenerated, failed = result["regenerated"], result["failed"]
+
+        return format_response(
+            message=f"تم إعادة إنشاء QR Code لـ {len(regenerated)} قاعة",
+            data={"regenerated": regenerated, "failed": failed},
+        )
+
+    except Exception as e:
+        return format_response(
+            message=f"حدث خطأ: {str(e)}", success=False, status_code=500
+        )
+
+
 @room_bp.route("/<int:room_id>/schedules/<int:schedule_id>/postpone", methods=["PUT"])
 @jwt_required()
 def postpone_schedule(room_id, schedule_id):
@@ -1758,7 +1565,7 @@ def postpone_schedule(room_id, schedule_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -1854,46 +1661,32 @@ def postpone_schedule(room_id, schedule_id):
             )
 
         # Check for conflicts in the postponed room at the specified time
-        conflicting_schedule_res = (
-            supabase.table("schedules")
-            .select("*")
-            .eq("room_id", data["postponed_to_room_id"])
-            .eq("day_of_week", original_schedule["day_of_week"]) # Use original day of week for conflict check
-            .eq("is_active", True)
-            .execute()
+        # (on the weekday of the postponed date, not the original lecture day)
+        postponed_day_of_week = postponed_date_obj.strftime("%A").lower()
+        engine = ConflictEngine.load(
+            supabase,
+            day_of_week=postponed_day_of_week,
+            # All study types: a morning lecture must not land on an evening one in the same slot
+            room_ids=[data["postponed_to_room_id"]],
+            # Temporary move-ins only block the specific date they were booked for
+            predicate=lambda s: not s.get("is_temporary_move_in")
+            or s.get("original_booking_date") == data["postponed_date"],
         )
-        
-        # Filter conflicts in Python since Supabase query builder has limitations
-        conflicts = []
-        if conflicting_schedule_res.data:
-            new_start = data["postponed_start_time"]
-            new_end = data["postponed_end_time"]
-            for existing_schedule in conflicting_schedule_res.data:
-                from datetime import datetime
-                # تحويل الأوقات إلى كائنات وقت
-                fmt = "%H:%M"
-                try:
-                    new_start_time = datetime.strptime(new_start, fmt).time()
-                    new_end_time = datetime.strptime(new_end, fmt).time()
-                    existing_start_time = datetime.strptime(existing_schedule["start_time"], fmt).time()
-                    existing_end_time = datetime.strptime(existing_schedule["end_time"], fmt).time()
-                except Exception as e:
-                    print(f"[ERROR] فشل تحويل الوقت: {e}")
-                    continue
-
-                # تحقق التداخل الفعلي مع استثناء الحالات المتتالية
-                if (
-                    (new_start_time < existing_end_time and new_end_time > existing_start_time)
-                    and not (new_start_time == existing_end_time or new_end_time == existing_start_time)
-                ):
-                    conflicts.append(existing_schedule)
-        
-        if conflicts:
+        conflict = engine.room_conflict(
+            data["postponed_to_room_id"],
+            postponed_day_of_week,
+            None,
+            data["postponed_start_time"],
+            data["postponed_end_time"],
+            exclude_ids=[schedule_id],
+        )
+
+        if conflict:
             return format_response(
                 message="يوجد تعارض مع محاضرة أخرى في القاعة المؤقتة وفي نفس الوقت",
                 success=False,
                 status_code=409,  # Conflict
-                data=conflicts[0]
+                data=conflict
             )
 
         # جلب معلومات القسمين
@@ -2025,6 +1818,7 @@ def postpone_schedule(room_id, schedule_id):
         }
         
         supabase.table("schedules").update(update_original_schedule_data).eq("id", schedule_id).execute()
+        invalidate_room_timetables(room_id, data["postponed_to_room_id"])
 
         # تحديد هل النقل بين قسمين مختلفين أم نفس القسم
         is_cross_department = original_dept_id != new_dept_id and new_dept_id is not None
@@ -2123,14 +1917,31 @@ def postpone_schedule(room_id, schedule_id):
         )
 
 
+def _get_upload_options():
+    """قراءة خيارات رفع الجداول: mode (replace أو diff) و dry_run من النموذج أو الرابط"""
+    mode = (request.form.get("mode") or request.args.get("mode") or "replace").strip().lower()
+    dry_run = str(request.form.get("dry_run") or request.args.get("dry_run") or "").strip().lower()
+    return mode, dry_run in ("1", "true", "yes")
+
+
+def _diff_summary(report):
+    return {
+        "created_count": len(report["created"]),
+        "updated_count": len(report["updated"]),
+        "deleted_count": len(report["deleted"]),
+        "unchanged_count": report["unchanged_count"],
+    }
+
+
 @room_bp.route("/<int:room_id>/schedules/upload", methods=["POST"])
 @jwt_required()
+@background_job("schedule_upload")
 def upload_weekly_schedule(room_id):
     """تحميل جدول أسبوعي من ملف Excel"""
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -2171,33 +1982,16 @@ def upload_weekly_schedule(room_id):
                 status_code=400,
             )
 
-        # Save file temporarily
-        import os
-        import tempfile
-        import pandas as pd
-        
-        # Create a temporary file
-        temp_dir = tempfile.mkdtemp()
-        temp_file_path = os.path.join(temp_dir, file.filename)
-        file.save(temp_file_path)
-
-        # Read Excel file
+        # Stream the workbook straight from the upload (no temp file)
         try:
-            df = pd.read_excel(temp_file_path)
-        except Exception as e:
-            # Clean up temp file
-            os.remove(temp_file_path)
-            os.rmdir(temp_dir)
+            df = read_excel_frame(file)
+        except ExcelReadError as e:
             return format_response(
                 message=f"خطأ في قراءة ملف Excel: {str(e)}",
                 success=False,
                 status_code=400,
             )
 
-        # Clean up temp file
-        os.remove(temp_file_path)
-        os.rmdir(temp_dir)
-
         # Validate required columns
         required_columns = [
             "study_type",
@@ -2234,177 +2028,41 @@ def upload_weekly_schedule(room_id):
                 status_code=403,
             )
 
-        # Get IDs of schedules to be deleted
-        schedules_to_delete_res = supabase.table("schedules").select("id").eq("room_id", room_id).execute()
-        schedules_to_delete_ids = [s["id"] for s in schedules_to_delete_res.data]
-
-        if schedules_to_delete_ids:
-            # Nullify moved_to_schedule_id references to schedules in this room
-            supabase.table("schedules").update({"moved_to_schedule_id": None}).in_("moved_to_schedule_id", schedules_to_delete_ids).execute()
-            
-            # Nullify original_schedule_id references to schedules in this room
-            supabase.table("schedules").update({"original_schedule_id": None}).in_("original_schedule_id", schedules_to_delete_ids).execute()
-        # Delete all existing schedules for this room before uploading new ones
-        supabase.table("schedules").delete().eq("room_id", room_id).execute()
+        mode, dry_run = _get_upload_options()
+        if mode not in ("replace", "diff"):
+            return format_response(
+                message="وضع الرفع غير صحيح (replace أو diff)",
+                success=False,
+                status_code=400,
+            )
 
-        # Process each row in the Excel file
-        created_schedules = []
-        errors = []
-        warnings = []  # For non-critical issues like doctor name not found
-        
-        # Get all doctors once to avoid repeated database calls
+        # Validate the whole sheet at once (column-wise) before touching the database
         from models import get_all_doctors
-        all_doctors = get_all_doctors()
-        doctor_name_to_id = {doctor['name'].strip().lower(): doctor['id'] for doctor in all_doctors}
-        
-        for index, row in df.iterrows():
-            try:
-                # Check for NaN values in critical fields
-                if pd.isna(row["start_time"]):
-                    errors.append(f"الصف {index + 2}: وقت البدء مفقود أو غير صالح")
-                    continue
-                if pd.isna(row["end_time"]):
-                    errors.append(f"الصف {index + 2}: وقت الانتهاء مفقود أو غير صالح")
-                    continue
-                if pd.isna(row["subject_name"]):
-                    errors.append(f"الصف {index + 2}: اسم المادة مفقود أو غير صالح")
-                    continue
-                if pd.isna(row["instructor_name"]):
-                    errors.append(f"الصف {index + 2}: اسم المدرس مفقود أو غير صالح")
-                    continue
-
-                # Validate data
-                if not validate_study_type(row["study_type"]):
-                    errors.append(f"الصف {index + 2}: نوع الدراسة غير صحيح")
-                    continue
-
-                if not validate_academic_stage(row["academic_stage"]):
-                    errors.append(f"الصف {index + 2}: المرحلة الدراسية غير صحيحة")
-                    continue
-
-                if not validate_day_of_week(row["day_of_week"]):
-                    errors.append(f"الصف {index + 2}: يوم الأسبوع غير صحيح")
-                    continue
-
-                if not validate_time_format(row["start_time"]) or not validate_time_format(row["end_time"]):
-                    errors.append(f"الصف {index + 2}: صيغة الوقت غير صحيحة (استخدم HH:MM)")
-                    continue
-
-                if not row.get("instructor_name") or not str(row["instructor_name"]).strip():
-                    errors.append(f"الصف {index + 2}: اسم المدرس مطلوب")
-                    continue
-                
-                instructor_name = str(row["instructor_name"]).strip()
-                # Check if doctor name exists in database
-                doctor_id = doctor_name_to_id.get(instructor_name.lower())
-                if not doctor_id:
-                    # Try exact case-sensitive match as fallback
-                    exact_match = next((doc['id'] for doc in all_doctors if doc['name'].strip() == instructor_name), None)
-                    if exact_match:
-                        doctor_id = exact_match
-                    else:
-                        warnings.append(f"الصف {index + 2}: اسم المدرس '{instructor_name}' غير موجود في قاعدة البيانات. سيتم حفظ الاسم كنص فقط.")
-
-                from datetime import datetime
+        rows, row_errors, row_warnings = prepare_schedule_rows(df, get_all_doctors())
+
+        for row in rows:
+            row["department_id"] = room["department_id"]
+
+        diff = None
+        if mode == "diff" or dry_run:
+            # Apply only the delta against the room's current rows (or just preview it)
+            report, write_errors = sync_room_schedules(supabase, room_id, rows, dry_run=dry_run)
+            created_schedules = report["created"]
+            diff = _diff_summary(report)
+            wrote = not dry_run and any(diff[k] for k in ("created_count", "updated_count", "deleted_count"))
+        else:
+            # Replace the room's schedules: unlink, delete, in-memory conflict check, chunked insert
+            created_schedules, write_errors = replace_room_schedules(supabase, room_id, rows)
+            wrote = True
+        row_errors.extend(write_errors)
 
-                # Convert time columns from Excel number format to HH:MM string format
-                # Excel stores time as a fraction of a day. Pandas reads it as float.
-                # Convert to datetime object, then format to HH:MM string.
-                try:
-                    # Check if the time is already a string (e.g., '08:30')
-                    if isinstance(row["start_time"], (int, float)):
-                        start_time_excel = pd.to_datetime(row["start_time"], unit='D', origin='1899-12-30') # Excel's epoch
-                        start_time_str = start_time_excel.strftime("%H:%M")
-                    else: # Assume it's already a string, apply padding logic
-                        start_time_str = str(row["start_time"])
-                        if len(start_time_str) == 4 and start_time_str[1] == ':': # e.g., "8:30"
-                            start_time_str = "0" + start_time_str
-
-                    if isinstance(row["end_time"], (int, float)):
-                        end_time_excel = pd.to_datetime(row["end_time"], unit='D', origin='1899-12-30') # Excel's epoch
-                        end_time_str = end_time_excel.strftime("%H:%M")
-                    else: # Assume it's already a string, apply padding logic
-                        end_time_str = str(row["end_time"])
-                        if len(end_time_str) == 4 and end_time_str[1] == ':': # e.g., "8:30"
-                            end_time_str = "0" + end_time_str
-
-                except Exception as e:
-                    errors.append(f"الصف {index + 2}: خطأ في تحويل الوقت من Excel - {str(e)}")
-                    continue
-
-                # Now use start_time_str and end_time_str for validation and insertion
-                if not validate_time_format(start_time_str) or not validate_time_format(end_time_str):
-                    errors.append(f"الصف {index + 2}: صيغة الوقت غير صحيحة (استخدم HH:MM)")
-                    continue
+        errors = [f"الصف {n}: {message}" for n, message in sorted(row_errors, key=lambda item: item[0])]
+        warnings = [f"الصف {n}: {message}" for n, message in row_warnings]
 
-                try:
-                    start_time = datetime.strptime(start_time_str, "%H:%M").time()
-                    end_time = datetime.strptime(end_time_str, "%H:%M").time()
-                except ValueError:
-                    errors.append(f"الصف {index + 2}: صيغة الوقت غير صحيحة، يجب أن تكون بصيغة HH:MM (مثال: 08:30)")
-                    continue
-
-                if start_time >= end_time:
-                    errors.append(f"الصف {index + 2}: وقت البداية يجب أن يكون قبل وقت النهاية")
-                    continue
-
-                # Determine lecture type, section/group for this row
-                lecture_type_row = str(row.get("lecture_type", "نظري")).strip() or "نظري"
-                db_lecture_type = "theoretical" if lecture_type_row == "نظري" else "practical"
-                if lecture_type_row == "نظري":
-                    section = int(row.get("section", 1)) if pd.notna(row.get("section")) else 1
-                    group = None
-                else:
-                    group = str(row.get("group", "A")).strip() if pd.notna(row.get("group")) else "A"
-                    section = None
-
-                # Check for conflicting schedules using the parsed start/end time strings
-                # (previous conditional builder removed) - build below using explicit fields
-                # Build a proper query using start_time_str and end_time_str
-                conflicting_schedule_res = (
-                    supabase.table("schedules")
-                    .select("*")
-                    .eq("room_id", room_id)
-                    .eq("study_type", row["study_type"]) 
-                    .eq("day_of_week", row["day_of_week"]) 
-                    .eq("is_active", True)
-                    .lt("start_time", end_time_str)
-                    .gt("end_time", start_time_str)
-                    .execute()
-                )
-
-                if conflicting_schedule_res.data:
-                    errors.append(f"الصف {index + 2}: يوجد تداخل مع محاضرة أخرى في نفس القاعة والوقت")
-                    continue
-
-                # Create schedule
-                schedule_data = {
-                    "room_id": room_id,
-                    "department_id": room["department_id"], # Add department_id
-                    "study_type": row["study_type"].lower(),
-                    "academic_stage": row["academic_stage"].lower(),
-                    "day_of_week": row["day_of_week"],
-                    "start_time": start_time_str,
-                    "end_time": end_time_str,
-                    "subject_name": row["subject_name"],
-                    "instructor_name": instructor_name,  # Always save the name for display
-                    "notes": str(row.get("notes")) if pd.notna(row.get("notes")) else "",
-                    "lecture_type": db_lecture_type,
-                    "section_number": section,
-                    "group_letter": group,
-                    "is_active": True
-                }
-                
-                # Add doctor_id if doctor name was found in database
-                if doctor_id:
-                    schedule_data["doctor_id"] = doctor_id
-                
-                schedule_res = supabase.table("schedules").insert(schedule_data).execute()
-                created_schedules.append(schedule_res.data[0] if schedule_res.data else None)
-                
-            except Exception as e:
-                errors.append(f"الصف {index + 2}: خطأ في معالجة البيانات - {str(e)}")
-                continue
+        if wrote:
+            invalidate_room_timetables(room_id)
+        else:
+            g.skip_scope_bump = True
 
         # Prepare response
         response_data = {
@@ -2415,6 +2073,19 @@ def upload_weekly_schedule(room_id):
             "warnings": warnings,
             "warning_count": len(warnings)
         }
+        if diff is not None:
+            response_data["mode"] = "diff"
+            response_data["dry_run"] = dry_run
+            response_data["diff"] = diff
+        if dry_run:
+            response_data["changes"] = report
+            return format_response(
+                data=response_data,
+                message=(
+                    f"معاينة دون حفظ: {diff['created_count']} إضافة، {diff['updated_count']} تعديل، "
+                    f"{diff['deleted_count']} حذف، {diff['unchanged_count']} بدون تغيير"
+                ),
+            )
         
         if errors and warnings:
             return format_response(
@@ -2445,6 +2116,7 @@ def upload_weekly_schedule(room_id):
             )
 
     except Exception as e:
+        invalidate_room_timetables()
         print(f"ERROR in upload_weekly_schedule: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -2455,12 +2127,13 @@ def upload_weekly_schedule(room_id):
 
 @room_bp.route("/schedules/upload-general", methods=["POST"])
 @jwt_required()
+@background_job("schedule_upload_general")
 def upload_general_weekly_schedule():
     """تحميل جدول أسبوعي عام من ملف Excel لجميع القاعات"""
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -2498,28 +2171,16 @@ def upload_general_weekly_schedule():
                 status_code=400,
             )
 
-        import os
-        import tempfile
-        import pandas as pd
-        
-        temp_dir = tempfile.mkdtemp()
-        temp_file_path = os.path.join(temp_dir, file.filename)
-        file.save(temp_file_path)
-
+        # Stream the workbook straight from the upload (no temp file)
         try:
-            df = pd.read_excel(temp_file_path)
-        except Exception as e:
-            os.remove(temp_file_path)
-            os.rmdir(temp_dir)
+            df = read_excel_frame(file)
+        except ExcelReadError as e:
             return format_response(
                 message=f"خطأ في قراءة ملف Excel: {str(e)}",
                 success=False,
                 status_code=400,
             )
 
-        os.remove(temp_file_path)
-        os.rmdir(temp_dir)
-
         required_columns = [
             "room_code", # New required column for room identification
             "study_type",
@@ -2542,161 +2203,122 @@ def upload_general_weekly_schedule():
                 status_code=400,
             )
 
-        created_schedules = []
+        mode, dry_run = _get_upload_options()
+        if mode not in ("replace", "diff"):
+            return format_response(
+                message="وضع الرفع غير صحيح (replace أو diff)",
+                success=False,
+                status_code=400,
+            )
+        use_diff = mode == "diff" or dry_run
+
+        # Validate the whole sheet at once (column-wise)
+        from models import get_all_doctors, _chunked
+        rows, row_errors, row_warnings = prepare_schedule_rows(df, get_all_doctors())
+        room_codes = df["room_code"].astype(str).str.strip()
+        department_names = df["department_name"].fillna("").astype(str).str.strip()
+
+        # Resolve all room codes and department names in two bulk queries
+        room_id_by_code = {}
+        for chunk in _chunked(sorted(set(room_codes))):
+            room_res = supabase.table("rooms").select("id, code").in_("code", chunk).execute()
+            room_id_by_code.update({r["code"]: r["id"] for r in room_res.data or []})
+        department_id_by_name = {}
+        wanted_departments = sorted(set(department_names) - {""})
+        for chunk in _chunked(wanted_departments):
+            department_res = supabase.table("departments").select("id, name").in_("name", chunk).execute()
+            department_id_by_name.update({d["name"]: d["id"] for d in department_res.data or []})
+
         errors = []
-        warnings = []  # For non-critical issues like doctor name not found
-        
-        # Get all doctors once to avoid repeated database calls
-        from models import get_all_doctors
-        all_doctors = get_all_doctors()
-        doctor_name_to_id = {doctor['name'].strip().lower(): doctor['id'] for doctor in all_doctors}
-        
-        # Group schedules by room_code
-        schedules_by_room = {}
-        for index, row in df.iterrows():
-            room_code = str(row["room_code"]).strip()
-            if room_code not in schedules_by_room:
-                schedules_by_room[room_code] = []
-            schedules_by_room[room_code].append((index, row))
-
-        for room_code, rows_data in schedules_by_room.items():
-            # Get room_id from room_code
-            room_res = supabase.table("rooms").select("id").eq("code", room_code).execute()
-            if not room_res.data:
-                errors.append(f"رمز القاعة '{room_code}' غير موجود في النظام. تم تخطي الجداول المرتبطة به.")
-                for index, _ in rows_data:
-                    errors.append(f"الصف {index + 2}: رمز القاعة غير صالح")
+        warnings = []
+        unknown_rooms = [code for code in dict.fromkeys(room_codes) if code not in room_id_by_code]
+        for room_code in unknown_rooms:
+            errors.append(f"رمز القاعة '{room_code}' غير موجود في النظام. تم تخطي الجداول المرتبطة به.")
+            for n in (room_codes.index[room_codes == room_code] + 2):
+                errors.append(f"الصف {n}: رمز القاعة غير صالح")
+
+        # Group the valid rows by room; department errors are reported per row
+        row_errors_by_room = {}
+        rows_by_room = {}
+        for n, message in row_errors:
+            row_errors_by_room.setdefault(room_codes[n - 2], []).append((n, message))
+        for n, message in row_warnings:
+            room_code = room_codes[n - 2]
+            if room_code in room_id_by_code:
+                warnings.append(f"الصف {n} (القاعة {room_code}): {message}")
+        for row in rows:
+            room_code = room_codes[row["_index"]]
+            department_name = department_names[row["_index"]]
+            if not department_name:
+                row_errors_by_room.setdefault(room_code, []).append((row["_row"], "اسم القسم مفقود."))
                 continue
-            room_id = room_res.data[0]["id"]
-
-            # Delete all existing schedules for this room before uploading new ones
-            # This ensures a clean slate for each room's schedule
-            schedules_to_delete_res = supabase.table("schedules").select("id").eq("room_id", room_id).execute()
-            schedules_to_delete_ids = [s["id"] for s in schedules_to_delete_res.data]
-            if schedules_to_delete_ids:
-                supabase.table("schedules").update({"moved_to_schedule_id": None}).in_("moved_to_schedule_id", schedules_to_delete_ids).execute()
-                supabase.table("schedules").update({"original_schedule_id": None}).in_("original_schedule_id", schedules_to_delete_ids).execute()
-            supabase.table("schedules").delete().eq("room_id", room_id).execute()
-
-            for index, row in rows_data:
-                try:
-                    if pd.isna(row["start_time"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): وقت البدء مفقود أو غير صالح")
-                        continue
-                    if pd.isna(row["end_time"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): وقت الانتهاء مفقود أو غير صالح")
-                        continue
-                    if pd.isna(row["subject_name"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): اسم المادة مفقود أو غير صالح")
-                        continue
-                    if pd.isna(row["instructor_name"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): اسم المدرس مفقود أو غير صالح")
-                        continue
-
-                    if not validate_study_type(row["study_type"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): نوع الدراسة غير صحيح")
-                        continue
-
-                    if not validate_academic_stage(row["academic_stage"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): المرحلة الدراسية غير صحيحة")
-                        continue
-
-                    if not validate_day_of_week(row["day_of_week"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): يوم الأسبوع غير صحيح")
-                        continue
-
-                    if not validate_time_format(row["start_time"]) or not validate_time_format(row["end_time"]):
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): صيغة الوقت غير صحيحة (استخدم HH:MM)")
-                        continue
-
-                    if not str(row.get("instructor_name", "")).strip():
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): اسم المدرس مطلوب")
-                        continue
-                    
-                    instructor_name = str(row["instructor_name"]).strip()
-                    # Check if doctor name exists in database
-                    doctor_id = doctor_name_to_id.get(instructor_name.lower())
-                    if not doctor_id:
-                        # Try exact case-sensitive match as fallback
-                        exact_match = next((doc['id'] for doc in all_doctors if doc['name'].strip() == instructor_name), None)
-                        if exact_match:
-                            doctor_id = exact_match
-                        else:
-                            warnings.append(f"الصف {index + 2} (القاعة {room_code}): اسم المدرس '{instructor_name}' غير موجود في قاعدة البيانات. سيتم حفظ الاسم كنص فقط.")
-
-                    from datetime import datetime
-
-                    try:
-                        start_time = datetime.strptime(str(row["start_time"]), "%H:%M").time()
-                        end_time = datetime.strptime(str(row["end_time"]), "%H:%M").time()
-                    except ValueError:
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): صيغة الوقت غير صحيحة، يجب أن تكون بصيغة HH:MM (مثال: 08:30)")
-                        continue
-
-                    if start_time >= end_time:
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): وقت البداية يجب أن يكون قبل وقت النهاية")
-                        continue
-
-                    # Get department_id from department_name
-                    department_name = str(row.get("department_name", "")).strip()
-                    department_id = None
-                    if department_name:
-                        department_res = supabase.table("departments").select("id").eq("name", department_name).execute()
-                        if department_res.data:
-                            department_id = department_res.data[0]["id"]
-                        else:
-                            errors.append(f"الصف {index + 2} (القاعة {room_code}): اسم القسم '{department_name}' غير موجود في النظام. تم تخطي هذا الصف.")
-                            continue # Skip this row if department not found
-                    else:
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): اسم القسم مفقود.")
-                        continue
-
-                    # Determine lecture type and grouping for this row
-                    lecture_type_row = str(row.get("lecture_type", "نظري")).strip() or "نظري"
-                    db_lecture_type = "theoretical" if lecture_type_row == "نظري" else "practical"
-                    if lecture_type_row == "نظري":
-                        try:
-                            section = int(row.get("section", 1)) if pd.notna(row.get("section")) else 1
-                        except Exception:
-                            section = 1
-                        group = None
-                    else:
-                        group = str(row.get("group", "A")).strip() if pd.notna(row.get("group")) else "A"
-                        section = None
-
-                    start_time_str = str(row["start_time"])
-                    end_time_str = str(row["end_time"])
-
-                    schedule_data = {
-                        "room_id": room_id,
-                        "study_type": row["study_type"].lower(),
-                        "academic_stage": row["academic_stage"].lower(),
-                        "day_of_week": row["day_of_week"],
-                        "start_time": str(row["start_time"]),
-                        "end_time": str(row["end_time"]),
-                        "subject_name": row["subject_name"],
-                        "instructor_name": instructor_name,  # Always save the name for display
-                        "notes": str(row.get("notes")) if pd.notna(row.get("notes")) else "",
-                        "lecture_type": db_lecture_type,
-                        "section_number": section,
-                        "group_letter": group,
-                        "is_active": True,
-                        "department_id": department_id, # Add department_id here
-                    }
-                    
-                    # Add doctor_id if doctor name was found in database
-                    if doctor_id:
-                        schedule_data["doctor_id"] = doctor_id
-                    
-                    schedule_res = supabase.table("schedules").insert(schedule_data).execute()
-                    if schedule_res.data:
-                        created_schedules.append({**schedule_res.data[0], "room_code": room_code})
-                    else:
-                        errors.append(f"الصف {index + 2} (القاعة {room_code}): فشل في إنشاء الجدول")
-                    
-                except Exception as e:
-                    errors.append(f"الصف {index + 2} (القاعة {room_code}): خطأ في معالجة البيانات - {str(e)}")
-                    continue
+            if department_name not in department_id_by_name:
+                row_errors_by_room.setdefault(room_code, []).append(
+                    (row["_row"], f"اسم القسم '{department_name}' غير موجود في النظام. تم تخطي هذا الصف.")
+                )
+                continue
+            row["department_id"] = department_id_by_name[department_name]
+            rows_by_room.setdefault(room_code, []).append(row)
+
+        # Process rooms concurrently on a bounded pool; each room is written in bulk
+        from concurrent.futures import ThreadPoolExecutor
+
+        chunk_size = current_app.config.get("SCHEDULE_INSERT_CHUNK_SIZE", 500)
+        max_workers = current_app.config.get("SCHEDULE_UPLOAD_MAX_WORKERS", 4)
+        room_codes_to_process = [code for code in dict.fromkeys(room_codes) if code in room_id_by_code]
+
+        def process_room(room_code):
+            room_rows = rows_by_room.get(room_code, [])
+            try:
+                if use_diff:
+                    report, write_errors = sync_room_schedules(
+                        supabase, room_id_by_code[room_code], room_rows, chunk_size, dry_run=dry_run
+                    )
+                    return report["created"], write_errors, report
+                created, write_errors = replace_room_schedules(
+                    supabase, room_id_by_code[room_code], room_rows, chunk_size
+                )
+                return created, write_errors, None
+            except Exception as e:
+                return [], [
+                    (row["_row"], f"خطأ في معالجة البيانات - {str(e)}") for row in room_rows
+                ], None
+
+        created_schedules = []
+        rooms_report = []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(room_codes_to_process) or 1))) as executor:
+            results = executor.map(process_room, room_codes_to_process)
+            for position, (room_code, (created, write_errors, report)) in enumerate(
+                zip(room_codes_to_process, results), start=1
+            ):
+                report_progress(position / len(room_codes_to_process), f"القاعة {room_code}")
+                room_errors = sorted(row_errors_by_room.get(room_code, []) + write_errors, key=lambda item: item[0])
+                created_schedules.extend({**schedule, "room_code": room_code} for schedule in created)
+                errors.extend(f"الصف {n} (القاعة {room_code}): {message}" for n, message in room_errors)
+                room_report = {
+                    "room_code": room_code,
+                    "created_count": len(created),
+                    "error_count": len(room_errors),
+                }
+                if report is not None:
+                    room_report.update(_diff_summary(report))
+                    if dry_run:
+                        room_report["changes"] = report
+                rooms_report.append(room_report)
+
+        diff = None
+        if use_diff:
+            diff = {
+                key: sum(r.get(key, 0) for r in rooms_report)
+                for key in ("created_count", "updated_count", "deleted_count", "unchanged_count")
+            }
+        wrote = not dry_run and (
+            diff is None or any(diff[k] for k in ("created_count", "updated_count", "deleted_count"))
+        )
+        if wrote:
+            invalidate_room_timetables(*[room_id_by_code[code] for code in room_codes_to_process])
+        else:
+            g.skip_scope_bump = True
 
         response_data = {
             "created_count": len(created_schedules),
@@ -2704,8 +2326,21 @@ def upload_general_weekly_schedule():
             "errors": errors,
             "error_count": len(errors),
             "warnings": warnings,
-            "warning_count": len(warnings)
+            "warning_count": len(warnings),
+            "rooms": rooms_report,
         }
+        if diff is not None:
+            response_data["mode"] = "diff"
+            response_data["dry_run"] = dry_run
+            response_data["diff"] = diff
+        if dry_run:
+            return format_response(
+                data=response_data,
+                message=(
+                    f"معاينة دون حفظ: {diff['created_count']} إضافة، {diff['updated_count']} تعديل، "
+                    f"{diff['deleted_count']} حذف، {diff['unchanged_count']} بدون تغيير"
+                ),
+            )
         
         if errors and warnings:
             return format_response(
@@ -2736,6 +2371,7 @@ def upload_general_weekly_schedule():
             )
 
     except Exception as e:
+        invalidate_room_timetables()
         print(f"ERROR in upload_general_weekly_schedule: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -2746,6 +2382,7 @@ def upload_general_weekly_schedule():
 
 @room_bp.route("/<int:room_id>/schedules/download-pdf", methods=["GET"])
 @jwt_required()
+@background_job("schedule_pdf")
 def download_schedule_pdf(room_id):
     """تنزيل الجدول الأسبوعي لقاعة معينة كملف PDF"""
     try:
@@ -2767,7 +2404,7 @@ def download_schedule_pdf(room_id):
             )
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -2923,7 +2560,7 @@ def delete_all_schedules(room_id):
     try:
         supabase = current_app.supabase
         username = get_jwt_identity()
-        user = get_user_by_username(username)
+        user = get_cached_user_by_username(username)
 
         if not user:
             return format_response(
@@ -2966,6 +2603,7 @@ def delete_all_schedules(room_id):
             supabase.table("schedules").update({"original_schedule_id": None}).in_("original_schedule_id", schedules_to_delete_ids).execute()
         # Delete all existing schedules for this room
         supabase.table("schedules").delete().eq("room_id", room_id).execute()
+        invalidate_room_timetables()
 
         return format_response(message="تم حذف جميع جداول القاعة بنجاح")
 
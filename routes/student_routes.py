@@ -1,24 +1,27 @@
 from flask import Blueprint, request, jsonify, current_app
-import pandas as pd
 import uuid
-import random
 from datetime import datetime
-from models import create_student, update_student, get_student_by_id, get_students_by_section_and_stage, get_schedules_by_section_and_stage, get_student_ids_by_department_stage_study, find_student_by_unique_fields, delete_student, search_students, get_all_departments, get_student_full_schedule
+from models import get_student_by_id, get_students_by_section_and_stage, get_schedules_by_section_and_stage, search_students, get_all_departments, get_student_full_schedule
+from models import get_students_by_department_stage, get_students_by_ids, get_conflicting_doctor_codes, upsert_students, insert_students, delete_students_bulk
 from models import get_supabase # Assuming get_supabase is needed for direct schedule queries
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_cors import cross_origin
 from utils.helpers import get_current_user, department_access_required
+from utils.excel_ingest import iter_excel_rows
+from utils.id_allocator import reserve_student_ids
+from utils.jobs import background_job, report_progress
 
 # Helper function to generate a unique 4-digit student ID
 def generate_unique_4_digit_id():
-    supabase = get_supabase()
-    while True:
-        # Generate a random 4-digit number (0000-9999)
-        new_id = str(random.randint(0, 9999)).zfill(4)
-        # Check if the ID already exists in the database
-        response = supabase.table('students').select('student_id').eq('student_id', new_id).execute()
-        if not response.data:
-            return new_id
+    # Served from the in-memory ID allocator (also avoids doctor codes)
+    return reserve_student_ids(1)[0]
+
+def _roster_key(name, section, group, study_type):
+    """Key used to match an uploaded row to an existing student (compared as text)"""
+    return tuple('' if v is None else str(v).strip() for v in (name, section, group, study_type))
+
+def _student_changed(existing: dict, data: dict) -> bool:
+    return any(str(existing.get(k)) != str(v) for k, v in data.items())
 
 def get_department_id_by_name(department_name):
     departments = get_all_departments()
@@ -71,6 +74,7 @@ student_bp = Blueprint('student_bp', __name__)
 @student_bp.route('/upload_students_excel', methods=['POST'])
 @jwt_required()
 @cross_origin()
+@background_job('student_roster_upload')
 def upload_students_excel():
     current_user = get_current_user()
     if not current_user:
@@ -100,18 +104,25 @@ def upload_students_excel():
             target_academic_stage = convert_stage_to_text(stage_from_form)
             target_study_type = convert_study_type_to_english(study_type_from_form)
 
-            # Get existing student IDs only for the current department + stage + study_type
-            existing_student_ids = set(get_student_ids_by_department_stage_study(user_department_id, target_academic_stage, target_study_type))
-            uploaded_student_ids = set()
+            # One prefetch of the department + stage roster (all study types, since a row may
+            # override the form's study type); matching below happens in memory
+            roster = get_students_by_department_stage(user_department_id, target_academic_stage)
+            roster_by_id = {str(s['student_id']): s for s in roster}
+            roster_by_fields = {}
+            for student in roster:
+                key = _roster_key(student.get('name'), student.get('section'), student.get('group'), student.get('study_type'))
+                roster_by_fields.setdefault(key, student)
+            # Only the current department + stage + study_type is considered for deletion
+            existing_student_ids = {
+                str(s['student_id']) for s in roster if s.get('study_type') == target_study_type
+            }
 
-            df = pd.read_excel(file)
-            students_data = []
-            for index, row in df.iterrows():
+            # First pass: read and validate every row before writing anything
+            parsed_rows = []
+            for row_number, row in iter_excel_rows(file):
                 student_name = row.get('name') or row.get('Name')
                 student_section = row.get('section') or row.get('Section')
                 student_group = row.get('group') or row.get('Group')
-                # Use the upload form's stage as the canonical stage for all rows
-                student_stage = target_academic_stage
                 # Allow per-row study_type to override the form-provided type if present
                 student_study_type = convert_study_type_to_english(row.get('study_type') or row.get('Study Type') or study_type_from_form)
 
@@ -119,13 +130,14 @@ def upload_students_excel():
                 excel_student_id = row.get('student_id') or row.get('Student ID')
 
                 if not all([student_name, student_section, student_group]):
-                    return jsonify({'error': f'Missing data in row {index + 2}: name, section, or group'}), 400
+                    return jsonify({'error': f'Missing data in row {row_number}: name, section, or group'}), 400
 
                 student_data = {
                     'name': student_name,
                     'section': student_section,
                     'group': student_group,
-                    'academic_stage': student_stage,
+                    # Use the upload form's stage as the canonical stage for all rows
+                    'academic_stage': target_academic_stage,
                     'department_id': user_department_id,  # Use department from current user
                     'department_head_id': current_user.get('id')  # Record which department head uploaded this student
                 }
@@ -133,41 +145,65 @@ def upload_students_excel():
                 if student_study_type:
                     student_data['study_type'] = student_study_type
 
+                parsed_rows.append((row_number, str(excel_student_id) if excel_student_id else None, student_data))
+
+            report_progress(0.4, f'{len(parsed_rows)} rows validated')
+
+            # Students referenced by ID from outside this roster are fetched in one query
+            outside_ids = {sid for _, sid, _ in parsed_rows if sid and sid not in roster_by_id}
+            known_students = {**get_students_by_ids(outside_ids), **roster_by_id} if outside_ids else roster_by_id
+
+            students_data = []
+            upserts = {}
+            new_students = []
+            uploaded_student_ids = set()
+            for row_number, excel_student_id, student_data in parsed_rows:
                 if excel_student_id:
-                    # Attempt to update existing student
-                    existing_student = get_student_by_id(str(excel_student_id))
-                    if existing_student:
-                        # Ensure department_head_id is updated to current uploader as well
-                        student_data['department_head_id'] = current_user.get('id')
-                        update_student(str(excel_student_id), student_data)
-                        students_data.append({'student_id': str(excel_student_id), **student_data})
-                        uploaded_student_ids.add(str(excel_student_id))
-                    else:
-                        return jsonify({'error': f'Student with ID {excel_student_id} not found for update in row {index + 2}'}), 404
+                    existing_student = known_students.get(excel_student_id)
+                    if not existing_student:
+                        return jsonify({'error': f'Student with ID {excel_student_id} not found for update in row {row_number}'}), 404
                 else:
                     # Try to find an existing student by unique identifying fields so we don't change their ID
-                    matched = find_student_by_unique_fields(user_department_id, student_name, student_section, student_group, student_stage, student_study_type)
-                    if matched:
-                        # Update the matched student but do NOT change their student_id
-                        matched_id = matched.get('student_id')
-                        student_data['department_head_id'] = current_user.get('id')
-                        update_student(str(matched_id), student_data)
-                        students_data.append({'student_id': str(matched_id), **student_data})
-                        uploaded_student_ids.add(str(matched_id))
-                    else:
-                        # Create new student with generated ID
-                        # WARNING: 4-digit IDs have limited uniqueness (0000-9999). Collisions are possible in large datasets.
-                        new_student_id = generate_unique_4_digit_id()
-                        student_data['student_id'] = new_student_id
-                        # Ensure department_head_id is set for new students
-                        student_data['department_head_id'] = current_user.get('id')
-                        create_student(student_data)
-                        students_data.append(student_data)
-                        uploaded_student_ids.add(new_student_id)
-            
-            # Delete students not present in the uploaded Excel file, scoped to the current department/stage/study_type
-            for student_id_to_delete in existing_student_ids - uploaded_student_ids:
-                delete_student(student_id_to_delete)
+                    existing_student = roster_by_fields.get(_roster_key(
+                        student_data['name'], student_data['section'], student_data['group'], student_data.get('study_type')
+                    ))
+
+                if existing_student:
+                    # Update the matched student but do NOT change their student_id
+                    student_id = str(existing_student['student_id'])
+                    if _student_changed(existing_student, student_data):
+                        upserts[student_id] = {**existing_student, **student_data}
+                    students_data.append({'student_id': student_id, **student_data})
+                    uploaded_student_ids.add(student_id)
+                else:
+                    new_students.append(student_data)
+
+            if new_students:
+                # One batch reservation from the ID allocator, re-checked against students and doctor codes
+                new_ids = reserve_student_ids(len(new_students))
+                # Guard against doctor codes this process has cached since the allocator was loaded (one in-memory check)
+                clashing = get_conflicting_doctor_codes(new_ids)
+                while clashing:
+                    replacements = iter(reserve_student_ids(len(clashing)))
+                    new_ids = [next(replacements) if int(i) in clashing else i for i in new_ids]
+                    clashing = get_conflicting_doctor_codes(new_ids)
+                for student_data, new_student_id in zip(new_students, new_ids):
+                    student_data['student_id'] = new_student_id
+                    students_data.append(student_data)
+                    uploaded_student_ids.add(new_student_id)
+
+            report_progress(0.6, 'Applying changes')
+
+            # Apply the delta: chunked upserts for changed rows we already own, plain inserts for
+            # new rows (an ID collision never overwrites another student; insert_students retries
+            # the chunk with fresh IDs) and one in_ delete for removed rows
+            if upserts:
+                upsert_students(list(upserts.values()))
+            if new_students:
+                insert_students(new_students)
+            removed_ids = existing_student_ids - uploaded_student_ids
+            if removed_ids:
+                delete_students_bulk(removed_ids)
 
             return jsonify({'message': 'Students data uploaded successfully', 'students': students_data}), 200
         except Exception as e:
@@ -193,27 +229,8 @@ def get_student_schedule(student_id):
     # Use the new function to get schedules by section, stage, group, and study_type
     schedule_data = get_schedules_by_section_and_stage(student_section, student_stage, student_group, student_study_type)
     
-    # Add multiple doctors processing
-    if schedule_data:
-        from models import get_schedule_doctors
-        for schedule in schedule_data:
-            schedule_doctors = get_schedule_doctors(schedule["id"])
-            schedule["schedule_doctors"] = schedule_doctors
-            
-            # Create a list of doctor names for display
-            if schedule_doctors:
-                doctor_names = []
-                primary_doctor = None
-                for sd in schedule_doctors:
-                    doctor_name = sd.get('doctors', {}).get('name', '')
-                    if sd.get('is_primary'):
-                        primary_doctor = doctor_name
-                    doctor_names.append(doctor_name)
-                
-                schedule["multiple_doctors_names"] = doctor_names
-                schedule["primary_doctor_name"] = primary_doctor
-                schedule["has_multiple_doctors"] = len(doctor_names) > 1
-    
+    # schedule_doctors and the multiple doctors fields are attached by the
+    # shared enrichment in models (enrich_schedules)
     if schedule_data:
         return jsonify({'student_schedule': schedule_data}), 200
     else:
@@ -232,27 +249,8 @@ def get_student_full_schedule_route(student_id):
 
     schedule_data = get_student_full_schedule(student_id)
     
-    # Add multiple doctors processing
-    if schedule_data:
-        from models import get_schedule_doctors
-        for schedule in schedule_data:
-            schedule_doctors = get_schedule_doctors(schedule["id"])
-            schedule["schedule_doctors"] = schedule_doctors
-            
-            # Create a list of doctor names for display
-            if schedule_doctors:
-                doctor_names = []
-                primary_doctor = None
-                for sd in schedule_doctors:
-                    doctor_name = sd.get('doctors', {}).get('name', '')
-                    if sd.get('is_primary'):
-                        primary_doctor = doctor_name
-                    doctor_names.append(doctor_name)
-                
-                schedule["multiple_doctors_names"] = doctor_names
-                schedule["primary_doctor_name"] = primary_doctor
-                schedule["has_multiple_doctors"] = len(doctor_names) > 1
-    
+    # schedule_doctors and the multiple doctors fields are attached by the
+    # shared enrichment in models (enrich_schedules)
     if schedule_data:
         return jsonify({'student_schedule': schedule_data, 'student': student}), 200
     else:
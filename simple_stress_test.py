@@ -186,6 +186,7 @@ class SimpleStressTest:
             {"endpoint": "/", "method": "GET", "name": "الصفحة الرئيسية"},
             {"endpoint": "/api/health", "method": "GET", "name": "فحص صحة النظام"},
             {"endpoint": "/api/departments", "method": "GET", "name": "قائمة الأقسام"},
+            {"endpoint": "/api/public/departments/summary", "method": "GET", "name": "ملخص الأقسام"},
             {"endpoint": "/api/rooms", "method": "GET", "name": "قائمة القاعات"},
             {"endpoint": "/api/schedule/current", "method": "GET", "name": "الجدول الحالي"},
         ]
@@ -0,0 +1,206 @@
+"""اختبارات عدد الطلبات إلى Supabase: عميل وهمي يعد استدعاءات execute() لكل جدول
+
+تضمن أن عدد الاستعلامات لا يتبع عدد الصفوف (الأقسام، المحاضرات...) وأن القراءات الكبيرة تُقسم على صفحات.
+"""
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("flask_jwt_extended")
+pytest.importorskip("supabase")
+
+from flask import Flask
+
+
+class _Result:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """يقبل أي سلسلة من دوال الاستعلام (select/eq/in_/order...) ويعيد صفوف الجدول عند execute()"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self._range = None
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        self.client.calls.append(self.table)
+        rows = self.client.tables.get(self.table, [])
+        if self._range is not None:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        return _Result(list(rows), count=len(rows))
+
+
+class FakeSupabase:
+    def __init__(self, tables):
+        self.tables = tables
+        self.calls = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return FakeQuery(self, f"rpc:{name}")
+
+    def count(self, table):
+        return self.calls.count(table)
+
+
+def _make_app(tables):
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.supabase = FakeSupabase(tables)
+    return app
+
+
+def _departments_summary(department_count, rooms_per_department=2):
+    from routes.public_routes import get_departments_summary
+
+    departments = [{"id": i, "name": f"Dept {i}"} for i in range(1, department_count + 1)]
+    rooms = [
+        {"id": d["id"] * 1000 + r, "name": f"R{r}", "code": f"D{d['id']}R{r}", "capacity": 30,
+         "qr_code_path": None, "department_id": d["id"]}
+        for d in departments for r in range(rooms_per_department)
+    ]
+    app = _make_app({
+        "departments": departments,
+        "rooms": rooms,
+        "doctors": [{"department_id": d["id"]} for d in departments],
+        "users": [{"department_id": d["id"], "full_name": f"Head {d['id']}"} for d in departments],
+    })
+    with app.test_request_context("/api/public/departments/summary"):
+        response = get_departments_summary()
+    assert response.status_code == 200
+    return app.supabase
+
+
+def test_departments_summary_query_count_is_flat():
+    small = _departments_summary(3)
+    large = _departments_summary(60)
+    assert len(small.calls) == len(large.calls) == 4
+    for table in ("departments", "rooms", "doctors", "users"):
+        assert large.count(table) == 1
+
+
+def test_departments_summary_pages_rooms_past_row_cap():
+    # 1200 rooms: the rooms read needs two pages instead of being cut off at 1000 rows
+    client = _departments_summary(3, rooms_per_department=400)
+    assert client.count("rooms") == 2
+
+
+def _schedules(count, room_id=1):
+    """count محاضرات عادية في القاعة ومثلها محاضرات منقولة إليها مؤقتاً من القاعة 2"""
+    base = {"study_type": "morning", "is_active": True, "academic_stage": "first", "day_of_week": "sunday",
+            "start_time": "08:00", "end_time": "09:00", "subject_name": "Math"}
+    regular = [{**base, "id": i, "room_id": room_id} for i in range(1, count + 1)]
+    originals = [{**base, "id": 10000 + i, "room_id": 2} for i in range(1, count + 1)]
+    move_ins = [
+        {**base, "id": 20000 + i, "room_id": room_id, "is_temporary_move_in": True, "original_schedule_id": 10000 + i}
+        for i in range(1, count + 1)
+    ]
+    return regular + move_ins, originals
+
+
+def _schedule_doctors(schedules):
+    return [
+        {"schedule_id": s["id"], "doctor_id": 7, "is_primary": True, "doctors": {"id": 7, "name": "Dr. A"}}
+        for s in schedules
+    ]
+
+
+def test_attach_schedule_doctors_one_query_per_chunk():
+    from models import IN_FILTER_CHUNK_SIZE, attach_schedule_doctors
+
+    for count in (3, IN_FILTER_CHUNK_SIZE):
+        schedules, _ = _schedules(count)
+        app = _make_app({"schedule_doctors": _schedule_doctors(schedules)})
+        with app.app_context():
+            attach_schedule_doctors(schedules)
+        # 2 * count schedules -> ceil(2 * count / IN_FILTER_CHUNK_SIZE) junction queries
+        assert app.supabase.calls == ["schedule_doctors"] * -(-len(schedules) // IN_FILTER_CHUNK_SIZE)
+        assert all(s["primary_doctor_name"] == "Dr. A" for s in schedules)
+
+
+def _room_schedule(count):
+    from routes.public_routes import get_room_schedule
+
+    schedules, originals = _schedules(count)
+    app = _make_app({
+        "rooms": [
+            {"id": 1, "name": "Room 1", "code": "R1", "capacity": 30, "department": {"name": "Dept"}},
+            {"id": 2, "name": "Room 2", "code": "R2", "capacity": 30, "department": {"name": "Dept"}},
+        ],
+        "schedules": schedules + originals,
+        "schedule_doctors": _schedule_doctors(schedules),
+    })
+    with app.test_request_context("/api/public/room/R1/schedule?study_type=morning"):
+        response = get_room_schedule("R1")
+    assert response.status_code == 200
+    return app.supabase
+
+
+def test_room_schedule_bulk_fetches_doctors_and_move_ins():
+    small = _room_schedule(2)
+    large = _room_schedule(40)
+    # room, schedules, one junction chunk, original schedules of move-ins, their rooms
+    assert len(small.calls) == len(large.calls) == 5
+    assert large.count("schedule_doctors") == 1
+    assert large.count("schedules") == 2
+    assert large.count("rooms") == 2
+
+
+_ROOM = {"id": 1, "name": "Room 1", "code": "R1", "capacity": 30, "department": {"name": "Dept"},
+         "description": None, "qr_code_path": None, "is_active": True, "created_at": "2025-01-01T00:00:00"}
+
+
+def test_view_room_schedule_query_count_is_flat():
+    from routes.public_routes import view_room_schedule
+
+    calls = []
+    for count in (2, 40):
+        schedules, _ = _schedules(count)
+        app = _make_app({
+            "rooms": [_ROOM],
+            "schedules": schedules,
+            "schedule_doctors": _schedule_doctors(schedules),
+        })
+        with app.test_request_context("/api/public/room/R1/view"):
+            response = view_room_schedule("R1")
+        assert response.status_code == 200
+        calls.append(app.supabase.calls)
+    # room, schedules, one junction chunk
+    assert calls[0] == calls[1] == ["rooms", "schedules", "schedule_doctors"]
+
+
+def test_full_weekly_schedule_query_count_is_flat():
+    from routes.public_routes import get_full_weekly_schedule
+
+    calls = []
+    for count in (2, 40):
+        schedules, _ = _schedules(count)
+        for schedule in schedules:
+            if schedule.get("is_temporary_move_in"):
+                schedule.update({
+                    "postponed_to_room_id": 2, "postponed_date": "2026-10-18",
+                    "postponed_start_time": "10:00", "postponed_end_time": "11:00",
+                })
+        app = _make_app({
+            "rooms": [{"id": 2, "name": "Room 2", "code": "R2"}],
+            "schedules": schedules,
+            "schedule_doctors": _schedule_doctors(schedules),
+        })
+        with app.test_request_context("/api/public/department/1/weekly-schedule/first/morning"):
+            response = get_full_weekly_schedule(1, "first", "morning")
+        assert response.status_code == 200
+        calls.append(app.supabase.calls)
+    # schedules, one junction chunk, the rooms of temporary move-ins
+    assert calls[0] == calls[1] == ["schedules", "schedule_doctors", "rooms"]
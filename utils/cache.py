@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+_MISSING = object()
+
+
+class TTLCache:
+    """ذاكرة تخزين مؤقت محدودة الحجم مع مدة صلاحية (LRU + TTL) وآمنة بين الخيوط"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def pop_where(self, predicate):
+        """حذف جميع العناصر التي تحقق الشرط predicate(key, value)"""
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+def compute_etag(payload) -> str:
+    """حساب ETag من محتوى الاستجابة (بصمة SHA-1 لتمثيل JSON مرتب)"""
+    raw = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+_scope_lock = threading.Lock()
+
+
+class ScopeVersionStore:
+    """أرقام إصدارات النطاقات في ملف SQLite مشترك بين عمال الخادم على نفس الجهاز
+
+    بدونه تكون الأرقام خاصة بكل عملية، فيستمر عامل آخر في إرجاع 304 ببيانات قديمة بعد كتابة
+    تمت في عامل مختلف حتى تنتهي صلاحية فهرس ETags.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS scope_versions (scope TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, scopes) -> tuple:
+        scopes = tuple(scopes)
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                f"SELECT scope, version FROM scope_versions WHERE scope IN ({', '.join('?' * len(scopes))})",
+                scopes,
+            ).fetchall()
+        versions = dict(rows)
+        return tuple(versions.get(scope, 0) for scope in scopes)
+
+    def bump(self, scopes):
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO scope_versions (scope, version) VALUES (?, 1) "
+                "ON CONFLICT(scope) DO UPDATE SET version = version + 1",
+                [(scope,) for scope in scopes],
+            )
+
+
+def _scope_store(app):
+    # SCOPE_VERSIONS_DB_PATH unset (e.g. a bare test app): versions stay in this process only
+    path = app.config.get('SCOPE_VERSIONS_DB_PATH')
+    if not path:
+        return None
+    store = app.extensions.get('scope_version_store')
+    if store is None:
+        with _scope_lock:
+            store = app.extensions.setdefault('scope_version_store', ScopeVersionStore(path))
+    return store
+
+
+def get_scope_versions(app, scopes) -> tuple:
+    """أرقام الإصدارات الحالية لنطاقات البيانات (rooms، schedules، ...) الخاصة بالتطبيق"""
+    store = _scope_store(app)
+    if store is not None:
+        return store.get(scopes)
+    versions = app.extensions.setdefault('scope_versions', {})
+    return tuple(versions.get(scope, 0) for scope in scopes)
+
+
+def bump_scope_versions(app, *scopes):
+    """زيادة إصدار النطاقات المحددة بعد تعديل بياناتها (يُبطل ETags المرتبطة بها في كل العمال)"""
+    store = _scope_store(app)
+    if store is not None:
+        store.bump(scopes)
+        return
+    versions = app.extensions.setdefault('scope_versions', {})
+    with _scope_lock:
+        for scope in scopes:
+            versions[scope] = versions.get(scope, 0) + 1
+
+
+def get_app_cache(app, name: str, maxsize: int, ttl: float) -> TTLCache:
+    """إرجاع ذاكرة مؤقتة مسماة مرتبطة بتطبيق Flask (تُنشأ عند أول استخدام)"""
+    caches = app.extensions.setdefault('ttl_caches', {})
+    cache = caches.get(name)
+    if cache is None:
+        cache = caches.setdefault(name, TTLCache(maxsize=maxsize, ttl=ttl))
+    return cache
@@ -0,0 +1,171 @@
+from utils.intervals import IntervalIndex, to_minutes
+
+
+def _norm_id(value):
+    """توحيد المعرفات (قد تصل كنص من JSON أو Excel وكرقم من قاعدة البيانات)"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class ConflictEngine:
+    """محرك موحد لكشف تداخل المحاضرات في القاعات ولدى الدكاترة
+
+    يحتفظ بفهرسين من الفترات الزمنية (IntervalIndex):
+      - القاعات بالمفتاح (room_id, day_of_week, study_type)
+      - الدكاترة بالمفتاح (doctor_id, day_of_week, study_type)، ويشمل ذلك
+        الدكتور المسجل في schedules.doctor_id والدكاترة المرتبطين عبر schedule_doctors.
+
+    الفترات نصف مفتوحة، لذا المحاضرات المتتالية (نهاية إحداها = بداية الأخرى) لا تُعد تداخلاً.
+    """
+
+    def __init__(self):
+        self.rooms = IntervalIndex()
+        self.doctors = IntervalIndex()
+        self.study_types = set()
+
+    @classmethod
+    def load(cls, supabase, day_of_week=None, study_type=None, room_ids=None, predicate=None, doctor_ids=None):
+        """بناء المحرك من الجداول النشطة باستعلام واحد للجداول واستعلام مجمع لـ schedule_doctors
+
+        مع room_ids و/أو doctor_ids يتم تحميل الجداول التي يمكن أن تتداخل فقط: جداول هذه القاعات
+        وجداول هؤلاء الدكاترة (doctor_id أو عبر schedule_doctors)، بدلاً من كل جداول اليوم.
+        predicate (اختياري) دالة تستقبل سجل الجدول وتحدد ما إذا كان يدخل في الفحص.
+        """
+        from models import _chunked, select_all_pages
+
+        def scoped(query):
+            query = query.eq("is_active", True)
+            if day_of_week:
+                query = query.eq("day_of_week", day_of_week)
+            if study_type:
+                query = query.eq("study_type", study_type)
+            return query.order("id")
+
+        if room_ids is None and doctor_ids is None:
+            schedules = select_all_pages(scoped(supabase.table("schedules").select("*")))
+        else:
+            by_id = {}
+
+            def collect(column, values):
+                for chunk in _chunked(values):
+                    rows = select_all_pages(scoped(supabase.table("schedules").select("*").in_(column, chunk)))
+                    by_id.update((row["id"], row) for row in rows)
+
+            collect("room_id", {_norm_id(r) for r in room_ids or () if r is not None})
+            doctors = {_norm_id(d) for d in doctor_ids or () if d is not None}
+            collect("doctor_id", doctors)
+            linked = set()
+            for chunk in _chunked(doctors):
+                links = select_all_pages(
+                    supabase.table("schedule_doctors").select("schedule_id").in_("doctor_id", chunk).order("schedule_id")
+                )
+                linked.update(link["schedule_id"] for link in links)
+            collect("id", linked - set(by_id))
+            schedules = list(by_id.values())
+
+        if predicate is not None:
+            schedules = [s for s in schedules if predicate(s)]
+
+        assistants = {}
+        schedule_ids = [s["id"] for s in schedules]
+        for chunk in _chunked(schedule_ids):
+            links = (
+                supabase.table("schedule_doctors")
+                .select("schedule_id, doctor_id")
+                .in_("schedule_id", chunk)
+                .execute()
+            )
+            for link in links.data or []:
+                assistants.setdefault(link["schedule_id"], []).append(link["doctor_id"])
+
+        engine = cls()
+        for schedule in schedules:
+            engine.add(schedule, assistants.get(schedule["id"], ()))
+        return engine
+
+    def add(self, schedule, doctor_ids=()):
+        """إضافة جدول (سجل من schedules) إلى الفهارس؛ مفيد أثناء الرفع لكشف التداخل داخل الملف نفسه"""
+        if not schedule:
+            return
+        day = schedule.get("day_of_week")
+        study_type = schedule.get("study_type")
+        self.study_types.add(study_type)
+        start = to_minutes(schedule.get("start_time"))
+        end = to_minutes(schedule.get("end_time"))
+
+        if schedule.get("room_id") is not None:
+            self.rooms.add((_norm_id(schedule["room_id"]), day, study_type), start, end, schedule)
+
+        doctors = {_norm_id(d) for d in doctor_ids if d is not None}
+        if schedule.get("doctor_id") is not None:
+            doctors.add(_norm_id(schedule["doctor_id"]))
+        for doctor_id in doctors:
+            self.doctors.add((doctor_id, day, study_type), start, end, schedule)
+
+    @staticmethod
+    def _first(index, key, start, end, exclude_ids):
+        start, end = to_minutes(start), to_minutes(end)
+        if start is None or end is None:
+            return None
+        excluded = {_norm_id(i) for i in exclude_ids or () if i is not None}
+        for _, _, schedule in index.overlapping(key, start, end):
+            if _norm_id(schedule.get("id")) not in excluded:
+                return schedule
+        return None
+
+    def room_conflict(self, room_id, day_of_week, study_type, start_time, end_time, exclude_ids=()):
+        """أول جدول يتداخل في القاعة المحددة (أو None)؛ study_type=None يفحص كل أنواع الدراسة"""
+        if room_id is None:
+            return None
+        if study_type is None:
+            # A room holds one lecture at a time whatever the study type
+            for loaded_type in sorted(self.study_types, key=str):
+                schedule = self.room_conflict(room_id, day_of_week, loaded_type, start_time, end_time, exclude_ids)
+                if schedule:
+                    return schedule
+            return None
+        key = (_norm_id(room_id), day_of_week, study_type)
+        return self._first(self.rooms, key, start_time, end_time, exclude_ids)
+
+    def doctor_conflict(self, doctor_ids, day_of_week, study_type, start_time, end_time, exclude_ids=()):
+        """أول دكتور لديه تداخل: (doctor_id, الجدول المتداخل) أو None"""
+        for doctor_id in doctor_ids or ():
+            if doctor_id is None:
+                continue
+            key = (_norm_id(doctor_id), day_of_week, study_type)
+            schedule = self._first(self.doctors, key, start_time, end_time, exclude_ids)
+            if schedule:
+                return doctor_id, schedule
+        return None
+
+    def check(self, room_id, doctor_ids, day_of_week, study_type, start_time, end_time, exclude_ids=()):
+        """فحص القاعة والدكاترة معاً: {"room": جدول أو None، "doctor": (doctor_id, جدول) أو None}"""
+        return {
+            "room": self.room_conflict(room_id, day_of_week, study_type, start_time, end_time, exclude_ids),
+            "doctor": self.doctor_conflict(doctor_ids, day_of_week, study_type, start_time, end_time, exclude_ids),
+        }
+
+    def check_many(self, slots, add_clean=False):
+        """فحص مجموعة من الفترات المرشحة دفعة واحدة
+
+        كل عنصر قاموس بالحقول: room_id, doctor_ids, day_of_week, study_type,
+        start_time, end_time, exclude_ids (اختياري). عند add_clean=True تُضاف الفترات
+        الخالية من التداخل إلى المحرك بحيث تُفحص الفترات اللاحقة مقابلها أيضاً.
+        """
+        results = []
+        for slot in slots:
+            result = self.check(
+                slot.get("room_id"),
+                slot.get("doctor_ids", ()),
+                slot.get("day_of_week"),
+                slot.get("study_type"),
+                slot.get("start_time"),
+                slot.get("end_time"),
+                slot.get("exclude_ids", ()),
+            )
+            if add_clean and not result["room"] and not result["doctor"]:
+                self.add(slot, slot.get("doctor_ids", ()))
+            results.append(result)
+        return results
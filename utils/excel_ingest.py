@@ -0,0 +1,123 @@
+from flask import current_app
+
+
+class ExcelReadError(Exception):
+    """تعذر قراءة ملف Excel المرفوع"""
+
+
+def _chunk_size(chunk_size):
+    if chunk_size is None:
+        chunk_size = current_app.config.get('EXCEL_INGEST_CHUNK_SIZE', 500)
+    return max(1, int(chunk_size))
+
+
+def _open_stream(file):
+    stream = getattr(file, 'stream', file)
+    try:
+        stream.seek(0)
+    except (AttributeError, OSError):
+        pass
+    return stream
+
+
+def _iter_xlsx_rows(stream):
+    """قراءة صفوف ملف xlsx تدريجياً (openpyxl بوضع read_only) مع رقم الصف في Excel"""
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ExcelReadError(str(e))
+
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c).strip() if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+        for row_number, values in enumerate(rows, start=2):
+            if values is None or all(v is None or (isinstance(v, str) and not v.strip()) for v in values):
+                continue
+            values = list(values[:len(columns)]) + [None] * (len(columns) - len(values))
+            yield row_number, dict(zip(columns, values))
+    finally:
+        workbook.close()
+
+
+def _iter_xls_rows(stream):
+    """ملفات xls القديمة لا يدعمها openpyxl؛ تُقرأ عبر pandas من الذاكرة دون ملف مؤقت"""
+    import pandas as pd
+
+    try:
+        df = pd.read_excel(stream)
+    except Exception as e:
+        raise ExcelReadError(str(e))
+    df.columns = [str(c).strip() for c in df.columns]
+    for index, record in zip(df.index, df.to_dict(orient='records')):
+        yield index + 2, {k: (None if pd.isna(v) else v) for k, v in record.items()}
+
+
+def iter_excel_rows(file):
+    """قراءة صفوف الملف المرفوع كقواميس (row_number, {column: value}) دون تحميل الملف كاملاً"""
+    stream = _open_stream(file)
+    filename = (getattr(file, 'filename', '') or '').lower()
+    if filename.endswith('.xls'):
+        return _iter_xls_rows(stream)
+    return _iter_xlsx_rows(stream)
+
+
+def iter_excel_chunks(file, chunk_size=None):
+    """قراءة الملف على دفعات ثابتة الحجم كـ DataFrame
+
+    فهرس كل DataFrame هو (رقم الصف في Excel - 2)، لذا تبقى رسائل الأخطاء بصيغة `index + 2` صحيحة.
+    """
+    import pandas as pd
+
+    size = _chunk_size(chunk_size)
+    columns = None
+    batch, numbers = [], []
+    for row_number, record in iter_excel_rows(file):
+        if columns is None:
+            columns = list(record.keys())
+        batch.append(record)
+        numbers.append(row_number - 2)
+        if len(batch) >= size:
+            yield pd.DataFrame.from_records(batch, columns=columns, index=numbers)
+            batch, numbers = [], []
+    if batch:
+        yield pd.DataFrame.from_records(batch, columns=columns, index=numbers)
+
+
+def excel_columns(file):
+    """أسماء الأعمدة في الصف الأول (للتحقق من الأعمدة المطلوبة قبل المعالجة)"""
+    stream = _open_stream(file)
+    filename = (getattr(file, 'filename', '') or '').lower()
+    if filename.endswith('.xls'):
+        import pandas as pd
+        try:
+            columns = [str(c).strip() for c in pd.read_excel(stream, nrows=0).columns]
+        except Exception as e:
+            raise ExcelReadError(str(e))
+    else:
+        from openpyxl import load_workbook
+        try:
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+        except Exception as e:
+            raise ExcelReadError(str(e))
+        try:
+            header = next(workbook.active.iter_rows(max_row=1, values_only=True), ()) or ()
+            columns = [str(c).strip() for c in header if c is not None]
+        finally:
+            workbook.close()
+    _open_stream(file)
+    return columns
+
+
+def read_excel_frame(file, chunk_size=None):
+    """قراءة الملف كاملاً إلى DataFrame واحد بالبث على دفعات (للملفات الصغيرة مثل الجداول الأسبوعية)"""
+    import pandas as pd
+
+    chunks = list(iter_excel_chunks(file, chunk_size))
+    if not chunks:
+        return pd.DataFrame(columns=excel_columns(file))
+    return pd.concat(chunks)
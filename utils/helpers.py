@@ -1,7 +1,39 @@
-from flask import jsonify
+from flask import jsonify, current_app
 from functools import wraps
-from flask_jwt_extended import get_jwt_identity, jwt_required
-from models import get_user_by_username
+import hashlib
+from flask_jwt_extended import get_jwt, get_jwt_identity, jwt_required
+from models import get_cached_user_by_username, get_permissions_version
+from utils.cache import get_app_cache, get_scope_versions, bump_scope_versions
+
+# نطاقات البيانات التي تتأثر بعمليات الكتابة في كل blueprint (لإبطال ETags العامة)
+WRITE_SCOPES_BY_BLUEPRINT = {
+    'rooms': ('rooms', 'schedules', 'announcements'),
+    'dean': ('announcements', 'departments', 'schedules', 'users'),
+    'department': ('announcements', 'rooms', 'users'),
+    'owner': ('users', 'departments'),
+    'doctor_bp': ('doctors', 'schedules'),
+    'student_bp': ('students',),
+    'admin': ('students',),
+}
+
+def get_authorized_user():
+    """الحصول على المستخدم المصرح له من JWT
+
+    عند تفعيل JWT_ROLE_CLAIMS وكان رقم إصدار الصلاحيات في التوكن مطابقاً للحالي
+    يتم بناء المستخدم من الـ claims مباشرة دون قراءة جدول users، وإلا يتم الرجوع لقاعدة البيانات.
+    """
+    username = get_jwt_identity()
+    if current_app.config.get('JWT_ROLE_CLAIMS'):
+        claims = get_jwt()
+        if claims.get('role') and claims.get('uid') is not None:
+            if get_permissions_version(claims['uid']) == claims.get('perm_ver', 0):
+                return {
+                    'id': claims['uid'],
+                    'username': username,
+                    'role': claims['role'],
+                    'department_id': claims.get('department_id'),
+                }
+    return get_cached_user_by_username(username)
 
 def admin_required(f):
     """ديكوريتر للتحقق من صلاحيات العميد"""
@@ -9,11 +41,8 @@ def admin_required(f):
     @jwt_required()
     def decorated_function(*args, **kwargs):
         try:
-            # الحصول على اسم المستخدم من JWT
-            username = get_jwt_identity()
-            
-            # البحث عن المستخدم في قاعدة البيانات
-            user = get_user_by_username(username)
+            # الحصول على المستخدم من JWT (من الـ claims أو من قاعدة البيانات)
+            user = get_authorized_user()
             role = user.get('role') if user else None
             if not user or role not in ['owner', 'dean', 'department_head']:
                 return format_response(data=None, message='مطلوب صلاحيات العميد أو أعلى', success=False, status_code=403)
@@ -34,11 +63,8 @@ def user_management_required(f):
     @jwt_required()
     def decorated_function(*args, **kwargs):
         try:
-            # الحصول على اسم المستخدم من JWT
-            username = get_jwt_identity()
-            
-            # البحث عن المستخدم في قاعدة البيانات
-            user = get_user_by_username(username)
+            # الحصول على المستخدم من JWT (من الـ claims أو من قاعدة البيانات)
+            user = get_authorized_user()
             role = user.get('role') if user else None
             if not user or role not in ['owner', 'dean', 'department_head', 'supervisor']:
                 return format_response(data=None, message='مطلوب صلاحيات إدارة المستخدمين', success=False, status_code=403)
@@ -59,11 +85,8 @@ def department_access_required(f):
     @jwt_required()
     def decorated_function(*args, **kwargs):
         try:
-            # الحصول على اسم المستخدم من JWT
-            username = get_jwt_identity()
-            
-            # البحث عن المستخدم في قاعدة البيانات
-            user = get_user_by_username(username)
+            # الحصول على المستخدم من JWT (من الـ claims أو من قاعدة البيانات)
+            user = get_authorized_user()
             if not user:
                 return format_response(data=None, message='المستخدم غير موجود', success=False, status_code=404)
             
@@ -85,11 +108,8 @@ def owner_required(f):
     @jwt_required()
     def decorated_function(*args, **kwargs):
         try:
-            # الحصول على اسم المستخدم من JWT
-            username = get_jwt_identity()
-            
-            # البحث عن المستخدم في قاعدة البيانات
-            user = get_user_by_username(username)
+            # الحصول على المستخدم من JWT (من الـ claims أو من قاعدة البيانات)
+            user = get_authorized_user()
             role = user.get('role') if user else None
             if not user or role != 'owner':
                 return format_response(data=None, message='مطلوب صلاحيات المالك', success=False, status_code=403)
@@ -141,6 +161,87 @@ def format_response(data=None, message=None, success=True, status_code=200):
     }
     return jsonify(response), status_code
 
+def paginated_response(items, next_cursor, message=None):
+    """استجابة صفحة من نتائج مقسمة بالمؤشر: data تبقى قائمة (متوافقة مع الواجهات الحالية)
+    والمؤشر التالي في ترويسة X-Next-Cursor (فارغة في الصفحة الأخيرة)
+    """
+    response, status_code = format_response(data=items, message=message)
+    response.headers['X-Next-Cursor'] = next_cursor or ''
+    response.headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+    return response, status_code
+
+def conditional_response(data, message, etag, last_modified=None, cache_control='public, no-cache'):
+    """استجابة قياسية مع ETag و Last-Modified، وترجع 304 إذا لم يتغير المحتوى لدى العميل"""
+    from flask import request, make_response
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(
+            last_modified and request.if_modified_since
+            and last_modified <= request.if_modified_since
+        )
+
+    if not_modified:
+        response = make_response('', 304)
+    else:
+        response, _ = format_response(data=data, message=message)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+def conditional_get(scopes, cache_control='public, no-cache', ttl=300):
+    """ديكوريتر لدعم الطلبات الشرطية (ETag / 304) في الواجهات العامة
+
+    يحفظ ETag آخر استجابة لكل مسار مع أرقام إصدار النطاقات (scopes) التي تعتمد عليها،
+    فإذا أرسل العميل نفس الـ ETag ولم تتغير النطاقات تُرجع 304 مباشرة قبل تنفيذ الدالة.
+    أرقام الإصدارات مشتركة بين العمال عبر SCOPE_VERSIONS_DB_PATH، لذا كتابة في عامل تُبطل الفهرس في الباقي.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from flask import request, make_response
+            index = get_app_cache(
+                current_app, 'etag_index',
+                maxsize=current_app.config.get('ETAG_INDEX_MAXSIZE', 2048), ttl=ttl,
+            )
+            key = request.full_path
+            versions = get_scope_versions(current_app, scopes)
+
+            entry = index.get(key)
+            if entry and entry['versions'] == versions and request.if_none_match.contains(entry['etag']):
+                response = make_response('', 304)
+                response.set_etag(entry['etag'])
+                response.headers['Cache-Control'] = cache_control
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                etag, _ = response.get_etag()
+                if not etag:
+                    etag = hashlib.sha1(response.get_data()).hexdigest()
+                    response.set_etag(etag)
+                index.set(key, {'etag': etag, 'versions': versions}, ttl=ttl)
+                response.headers['Cache-Control'] = cache_control
+                response.make_conditional(request)
+            return response
+        return decorated_function
+    return decorator
+
+def bump_scopes_after_write(response):
+    """after_request: إبطال ETags العامة بعد أي عملية كتابة ناجحة"""
+    from flask import request, g
+    if g.get('skip_scope_bump'):
+        # The view reported that nothing was written (e.g. a dry-run preview)
+        return response
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and response.status_code < 400:
+        scopes = WRITE_SCOPES_BY_BLUEPRINT.get(request.blueprint)
+        if scopes:
+            bump_scope_versions(current_app, *scopes)
+    return response
+
 def get_user_department_filter(user):
     """الحصول على فلتر القسم حسب المستخدم"""
     if user['role'] in ['owner', 'dean']:
@@ -173,11 +274,37 @@ def validate_academic_stage(stage):
     return stage.lower() in valid_stages
 
 
+def parse_usage_log_filters(args):
+    """قراءة فلاتر سجل الاستخدام من الطلب (student_id, page, from, to)
+
+    from/to بصيغة YYYY-MM-DD أو ISO؛ التاريخ بدون وقت في to يشمل اليوم كاملاً.
+    ترجع قاموساً بقيم ISO جاهزة للاستعلام، أو ترفع ValueError عند صيغة غير صحيحة.
+    """
+    from datetime import datetime, timedelta
+
+    def parse(value, name, end_of_day=False):
+        if not value:
+            return None
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f"صيغة التاريخ غير صحيحة في {name}")
+        if end_of_day and len(value.strip()) == 10:
+            parsed += timedelta(days=1)
+        return parsed.isoformat()
+
+    return {
+        'student_id': (args.get('student_id') or '').strip() or None,
+        'page': (args.get('page') or '').strip() or None,
+        'date_from': parse(args.get('from'), 'from'),
+        'date_to': parse(args.get('to'), 'to', end_of_day=True),
+    }
+
 def get_user_role(username: str):
     """
     Retrieves the role of a user given their username.
     """
-    user = get_user_by_username(username)
+    user = get_cached_user_by_username(username)
     return user.get('role') if user else None
 
 def get_current_user():
@@ -187,4 +314,4 @@ def get_current_user():
     username = get_jwt_identity()
     if not username:
         return None
-    return get_user_by_username(username)
\ No newline at end of file
+    return get_cached_user_by_username(username)
\ No newline at end of file
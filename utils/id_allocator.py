@@ -0,0 +1,218 @@
+import random
+import threading
+import time
+from flask import current_app
+
+# رموز الطلاب (0000-9999) ورموز الدكاترة (1000-9999) تشترك في نفس المجال ولا يجوز أن تتكرر بينهما
+ID_SPACE_SIZE = 10000
+DOCTOR_CODE_MIN = 1000
+
+
+class IdAllocator:
+    """مخصص معرفات رباعية الأرقام يعتمد على خريطة بتات (bitmap) للمعرفات المستخدمة
+
+    المعرفات الحرة محفوظة في قائمتين مخلوطتين عشوائياً (أقل من 1000 ومن 1000 فأكثر)،
+    لذا يتم الحجز بـ O(1) دون استعلامات لقاعدة البيانات.
+    """
+
+    def __init__(self, used_ids=(), size: int = ID_SPACE_SIZE, split: int = DOCTOR_CODE_MIN):
+        self.size = size
+        self.split = split
+        self._bits = bytearray((size + 7) // 8)
+        self._lock = threading.Lock()
+        self.crowded_warned = False
+        for value in used_ids:
+            self._set(value)
+        self._low = [i for i in range(0, split) if not self._test(i)]
+        self._high = [i for i in range(split, size) if not self._test(i)]
+        random.shuffle(self._low)
+        random.shuffle(self._high)
+
+    def _test(self, value: int) -> bool:
+        return bool(self._bits[value >> 3] & (1 << (value & 7)))
+
+    def _set(self, value: int):
+        if 0 <= value < self.size:
+            self._bits[value >> 3] |= 1 << (value & 7)
+
+    @property
+    def used_count(self) -> int:
+        return sum(bin(byte).count('1') for byte in self._bits)
+
+    @property
+    def occupancy(self) -> float:
+        return self.used_count / self.size
+
+    def is_used(self, value) -> bool:
+        value = _to_int(value)
+        return value is not None and 0 <= value < self.size and self._test(value)
+
+    def _pop(self, pool):
+        # Free lists may hold entries marked used later by mark_used(); skip them
+        while pool:
+            value = pool.pop()
+            if not self._test(value):
+                self._set(value)
+                return value
+        return None
+
+    def _pop_any(self, minimum: int):
+        if minimum >= self.split:
+            return self._pop(self._high)
+        # Draw from both ranges in proportion to their free slots
+        first, second = self._low, self._high
+        if random.random() * (len(first) + len(second)) >= len(first):
+            first, second = second, first
+        value = self._pop(first)
+        return value if value is not None else self._pop(second)
+
+    def reserve(self, count: int = 1, minimum: int = 0) -> list:
+        """حجز عدد من المعرفات الحرة (minimum=1000 لرموز الدكاترة)"""
+        reserved = []
+        with self._lock:
+            while len(reserved) < count:
+                value = self._pop_any(minimum)
+                if value is None:
+                    # Roll back the partial reservation before failing
+                    for v in reserved:
+                        self._release(v)
+                    raise ValueError('No free 4-digit IDs left')
+                reserved.append(value)
+        return reserved
+
+    def mark_used(self, *values):
+        with self._lock:
+            for value in values:
+                value = _to_int(value)
+                if value is not None:
+                    self._set(value)
+
+    def _release(self, value: int):
+        if 0 <= value < self.size and self._test(value):
+            self._bits[value >> 3] &= ~(1 << (value & 7)) & 0xFF
+            (self._low if value < self.split else self._high).append(value)
+
+    def release(self, *values):
+        with self._lock:
+            for value in values:
+                value = _to_int(value)
+                if value is not None:
+                    self._release(value)
+
+
+def _to_int(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return int(text) if text.isdigit() else None
+
+
+def _fetch_column(supabase, table: str, column: str):
+    from models import select_all_pages
+
+    return [row.get(column) for row in select_all_pages(supabase.table(table).select(column).order(column))]
+
+
+_allocator_lock = threading.Lock()
+
+
+def get_id_allocator(app=None) -> IdAllocator:
+    """المخصص الخاص بالتطبيق؛ يُحمَّل مرة واحدة من students.student_id و doctors.doctor_code
+    ويُعاد تحميله بعد ID_ALLOCATOR_TTL_SECONDS لالتقاط التغييرات من خارج هذه العملية.
+    """
+    app = app or current_app._get_current_object()
+    state = app.extensions.get('id_allocator')
+    ttl = app.config.get('ID_ALLOCATOR_TTL_SECONDS', 300)
+    if state and time.monotonic() - state[0] < ttl:
+        return state[1]
+    with _allocator_lock:
+        state = app.extensions.get('id_allocator')
+        if state and time.monotonic() - state[0] < ttl:
+            return state[1]
+        supabase = app.supabase
+        used = [_to_int(v) for v in _fetch_column(supabase, 'students', 'student_id')]
+        used += [_to_int(v) for v in _fetch_column(supabase, 'doctors', 'doctor_code')]
+        allocator = IdAllocator(v for v in used if v is not None)
+        app.extensions['id_allocator'] = (time.monotonic(), allocator)
+        return allocator
+
+
+def _warn_if_crowded(allocator: IdAllocator):
+    # Warn once when the threshold is crossed (not on every reservation); re-armed after it drops back
+    threshold = current_app.config.get('ID_ALLOCATOR_WARN_OCCUPANCY', 0.8)
+    occupancy = allocator.occupancy
+    if occupancy < threshold:
+        allocator.crowded_warned = False
+        return
+    if allocator.crowded_warned:
+        return
+    allocator.crowded_warned = True
+    current_app.logger.warning(
+        'ID space is %.0f%% full (%d of %d four-digit IDs used)',
+        occupancy * 100, allocator.used_count, allocator.size,
+    )
+
+
+def _taken_in_db(supabase, values) -> set:
+    """المعرفات (من values) المستخدمة فعلاً في قاعدة البيانات كرقم طالب أو رمز دكتور
+
+    الخريطة خاصة بكل عملية وتتقادم حتى ID_ALLOCATOR_TTL_SECONDS، لذا تُعامل كتلميح
+    ويتم التحقق من المعرفات المحجوزة قبل الكتابة (استعلام in_ واحد لكل دفعة).
+    """
+    from models import _chunked
+
+    taken = set()
+    for chunk in _chunked(sorted(values)):
+        students = (
+            supabase.table('students').select('student_id')
+            .in_('student_id', [str(v).zfill(4) for v in chunk]).execute().data or []
+        )
+        doctors = supabase.table('doctors').select('doctor_code').in_('doctor_code', chunk).execute().data or []
+        taken.update(_to_int(row.get('student_id')) for row in students)
+        taken.update(_to_int(row.get('doctor_code')) for row in doctors)
+    taken.discard(None)
+    return taken
+
+
+def _reserve_verified(allocator: IdAllocator, count: int, minimum: int = 0, max_attempts: int = 5) -> list:
+    """حجز count معرفاً من الخريطة ثم التحقق منها في قاعدة البيانات واستبدال المستخدم منها"""
+    supabase = current_app.supabase
+    reserved = allocator.reserve(count, minimum=minimum)
+    for _ in range(max_attempts):
+        # Taken IDs stay marked used in the bitmap, so the next reservation skips them
+        taken = _taken_in_db(supabase, reserved)
+        if not taken:
+            return reserved
+        replacements = iter(allocator.reserve(len(taken), minimum=minimum))
+        reserved = [next(replacements) if v in taken else v for v in reserved]
+    raise ValueError('Could not reserve free IDs: the in-memory allocator is out of sync with the database')
+
+
+def reserve_student_ids(count: int = 1) -> list:
+    """حجز معرفات طلاب جديدة كنصوص من 4 خانات (مثل '0042') بعد التحقق منها في قاعدة البيانات"""
+    allocator = get_id_allocator()
+    ids = [str(v).zfill(4) for v in _reserve_verified(allocator, count)]
+    _warn_if_crowded(allocator)
+    return ids
+
+
+def reserve_doctor_code() -> int:
+    """حجز رمز دكتور جديد (1000-9999) بعد التحقق منه في قاعدة البيانات"""
+    allocator = get_id_allocator()
+    code = _reserve_verified(allocator, 1, minimum=DOCTOR_CODE_MIN)[0]
+    _warn_if_crowded(allocator)
+    return code
+
+
+def mark_ids_used(*values):
+    """تسجيل معرفات مستخدمة تم تحديدها يدوياً (مثل doctor_code مُرسل في الطلب)"""
+    state = current_app.extensions.get('id_allocator')
+    if state:
+        state[1].mark_used(*values)
+
+
+def release_ids(*values):
+    """إعادة معرفات محذوفة إلى المخزون الحر"""
+    state = current_app.extensions.get('id_allocator')
+    if state:
+        state[1].release(*values)
@@ -0,0 +1,78 @@
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+
+def to_minutes(value):
+    """تحويل وقت بصيغة HH:MM أو HH:MM:SS إلى عدد الدقائق منذ منتصف الليل (أو None)"""
+    if value is None:
+        return None
+    try:
+        parts = str(value).strip().split(':')
+        return int(parts[0]) * 60 + int(parts[1])
+    except (ValueError, IndexError):
+        return None
+
+
+class IntervalIndex:
+    """فهرس فترات زمنية مرتبة لكل مفتاح (مثل: القاعة/اليوم/نوع الدراسة)
+
+    كل فترة نصف مفتوحة [start, end) بالدقائق، ويُرفق بها عنصر (مثل سجل الجدول).
+    الاستعلامات تعتمد على البحث الثنائي في قوائم مرتبة بالبداية وبالنهاية.
+    """
+
+    def __init__(self):
+        self._pending = defaultdict(list)
+        self._by_start = {}
+        self._by_end = {}
+
+    def add(self, key, start, end, item=None):
+        """إضافة فترة؛ الفترات ذات الأوقات غير الصالحة يتم تجاهلها"""
+        if isinstance(start, str):
+            start = to_minutes(start)
+        if isinstance(end, str):
+            end = to_minutes(end)
+        if start is None or end is None or end <= start:
+            return False
+        self._pending[key].append((start, end, item))
+        self._by_start.pop(key, None)
+        self._by_end.pop(key, None)
+        return True
+
+    def _sorted(self, key):
+        if key not in self._by_start:
+            intervals = self._pending.get(key, [])
+            by_start = sorted(intervals, key=lambda iv: (iv[0], iv[1]))
+            by_end = sorted(intervals, key=lambda iv: (iv[1], iv[0]))
+            self._by_start[key] = ([iv[0] for iv in by_start], by_start)
+            self._by_end[key] = ([iv[1] for iv in by_end], by_end)
+        return self._by_start[key], self._by_end[key]
+
+    def keys(self):
+        return list(self._pending.keys())
+
+    def intervals(self, key):
+        """جميع الفترات للمفتاح مرتبة حسب البداية: [(start, end, item), ...]"""
+        (_, by_start), _ = self._sorted(key)
+        return list(by_start)
+
+    def overlapping(self, key, start, end):
+        """الفترات التي تتداخل مع [start, end) مرتبة حسب البداية"""
+        (starts, by_start), _ = self._sorted(key)
+        limit = bisect_left(starts, end)
+        return [iv for iv in by_start[:limit] if iv[1] > start]
+
+    def first_overlap(self, key, start, end):
+        overlaps = self.overlapping(key, start, end)
+        return overlaps[0] if overlaps else None
+
+    def previous(self, key, start):
+        """آخر فترة تنتهي عند start أو قبله (أو None)"""
+        _, (ends, by_end) = self._sorted(key)
+        pos = bisect_right(ends, start)
+        return by_end[pos - 1] if pos else None
+
+    def next(self, key, end):
+        """أول فترة تبدأ عند end أو بعده (أو None)"""
+        (starts, by_start), _ = self._sorted(key)
+        pos = bisect_left(starts, end)
+        return by_start[pos] if pos < len(by_start) else None
@@ -0,0 +1,299 @@
+import base64
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import wraps
+from flask import current_app, request
+from flask_jwt_extended import create_access_token
+
+# حالات المهمة
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+_local = threading.local()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    created_by TEXT,
+    request TEXT NOT NULL,
+    result TEXT,
+    result_blob BLOB,
+    result_mimetype TEXT,
+    result_filename TEXT,
+    status_code INTEGER,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner_pid INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+_PUBLIC_FIELDS = (
+    'id', 'kind', 'status', 'progress', 'message', 'created_by', 'status_code',
+    'error', 'attempts', 'created_at', 'updated_at',
+)
+
+
+class JobStore:
+    """جدول المهام في SQLite (يبقى بعد إعادة تشغيل العامل)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, kind: str, request_data: dict, created_by=None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, created_by, request, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, JOB_QUEUED, created_by, json.dumps(request_data), now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def claim(self, job_id: str) -> bool:
+        """نقل المهمة من queued إلى running بشكل ذري (يمنع تشغيلها مرتين)"""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, owner_pid = ?, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (JOB_RUNNING, os.getpid(), time.time(), job_id, JOB_QUEUED),
+            )
+            return cur.rowcount == 1
+
+    def update(self, job_id: str, **fields):
+        if not fields:
+            return
+        fields['updated_at'] = time.time()
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def recover_interrupted(self, max_attempts: int):
+        """إعادة المهام المنقطعة (عامل متوقف) إلى الطابور، أو إفشالها بعد تجاوز عدد المحاولات"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, status, attempts, owner_pid FROM jobs WHERE status IN (?, ?)",
+                (JOB_QUEUED, JOB_RUNNING),
+            ).fetchall()
+        resumable = []
+        for row in rows:
+            if row['status'] == JOB_RUNNING and _pid_alive(row['owner_pid']):
+                continue
+            if row['attempts'] >= max_attempts:
+                self.update(
+                    row['id'], status=JOB_FAILED,
+                    error='انقطع تنفيذ المهمة بسبب إعادة تشغيل الخادم',
+                )
+                continue
+            self.update(row['id'], status=JOB_QUEUED)
+            resumable.append(row['id'])
+        return resumable
+
+    def purge(self, older_than_seconds: float):
+        cutoff = time.time() - older_than_seconds
+        with self._connect() as conn:
+            cur = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JOB_SUCCEEDED, JOB_FAILED, cutoff),
+            )
+            return cur.rowcount
+
+
+def _pid_alive(pid) -> bool:
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+class JobRunner:
+    """منفذ المهام داخل العملية: مجموعة خيوط محدودة تعيد تشغيل الطلب الأصلي عبر test_client"""
+
+    def __init__(self, app, recover: bool = True):
+        self.app = app
+        self.store = JobStore(app.config.get('JOBS_DB_PATH', os.path.join('instance', 'jobs.sqlite3')))
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config.get('JOBS_MAX_WORKERS', 2),
+            thread_name_prefix='job',
+        )
+        if not recover:
+            # Script runs: leave queued/interrupted jobs to the server workers
+            return
+        self.store.purge(app.config.get('JOBS_RETENTION_HOURS', 24) * 3600)
+        for job_id in self.store.recover_interrupted(app.config.get('JOBS_MAX_ATTEMPTS', 2)):
+            self.executor.submit(self._run, job_id)
+
+    def submit(self, kind: str, request_data: dict, created_by=None) -> str:
+        job_id = self.store.create(kind, request_data, created_by)
+        self.executor.submit(self._run, job_id)
+        return job_id
+
+    def _run(self, job_id: str):
+        if not self.store.claim(job_id):
+            return
+        job = self.store.get(job_id)
+        _local.job = (self.store, job_id)
+        try:
+            data = json.loads(job['request'])
+            body = {key: value for key, value in data.get('form', {}).items()}
+            for key, item in data.get('files', {}).items():
+                body[key] = (io.BytesIO(base64.b64decode(item['content'])), item['filename'], item.get('mimetype'))
+
+            # The bearer token is never stored: replay as the creator with a short-lived token
+            # minted now, so requeued jobs do not fail on an expired original token
+            with self.app.app_context():
+                token = create_access_token(
+                    identity=job['created_by'],
+                    expires_delta=timedelta(seconds=self.app.config.get('JOBS_TOKEN_TTL_SECONDS', 300)),
+                )
+
+            client = self.app.test_client()
+            response = client.open(
+                data['path'],
+                method=data['method'],
+                query_string=data.get('args', {}),
+                headers={'Authorization': f'Bearer {token}'},
+                data=body if body else data.get('body'),
+                content_type=None if body else data.get('content_type'),
+            )
+
+            fields = {
+                'status': JOB_SUCCEEDED if response.status_code < 400 else JOB_FAILED,
+                'status_code': response.status_code,
+                'progress': 1.0,
+            }
+            if response.is_json:
+                fields['result'] = json.dumps(response.get_json())
+            else:
+                fields['result_blob'] = response.get_data()
+                fields['result_mimetype'] = response.mimetype
+                disposition = response.headers.get('Content-Disposition', '')
+                if 'filename=' in disposition:
+                    fields['result_filename'] = disposition.split('filename=', 1)[1].strip('"; ')
+            if response.status_code >= 400:
+                fields['error'] = f'HTTP {response.status_code}'
+            self.store.update(job_id, **fields)
+        except Exception as e:
+            self.app.logger.exception('Background job %s failed', job_id)
+            self.store.update(job_id, status=JOB_FAILED, error=str(e))
+        finally:
+            _local.job = None
+
+
+def init_jobs(app, recover: bool = True):
+    """تهيئة نظام المهام الخلفية وإلحاقه بالتطبيق (recover=False: دون استئناف المهام المنقطعة)"""
+    runner = JobRunner(app, recover=recover)
+    app.extensions['job_runner'] = runner
+    return runner
+
+
+def get_job_runner() -> JobRunner:
+    return current_app.extensions['job_runner']
+
+
+def get_job(job_id: str, include_result: bool = False):
+    """حالة المهمة كقاموس (بدون بيانات الطلب المخزنة)"""
+    job = get_job_runner().store.get(job_id)
+    if not job:
+        return None
+    public = {field: job.get(field) for field in _PUBLIC_FIELDS}
+    public['has_file'] = job.get('result_blob') is not None
+    if include_result:
+        public['result'] = json.loads(job['result']) if job.get('result') else None
+        public['result_blob'] = job.get('result_blob')
+        public['result_mimetype'] = job.get('result_mimetype')
+        public['result_filename'] = job.get('result_filename')
+    return public
+
+
+def report_progress(fraction: float, message: str = None):
+    """تحديث تقدم المهمة الحالية (لا يفعل شيئاً عند التنفيذ المباشر خارج المهام)"""
+    job = getattr(_local, 'job', None)
+    if not job:
+        return
+    store, job_id = job
+    fields = {'progress': max(0.0, min(1.0, float(fraction)))}
+    if message is not None:
+        fields['message'] = message
+    store.update(job_id, **fields)
+
+
+def _capture_request() -> dict:
+    # No headers are kept: the identity is stored as created_by and a fresh token is minted on replay
+    args = {k: v for k, v in request.args.items() if k != 'async'}
+    data = {'method': request.method, 'path': request.path, 'args': args}
+    if request.files:
+        data['form'] = request.form.to_dict()
+        data['files'] = {
+            key: {
+                'filename': f.filename,
+                'mimetype': f.mimetype,
+                'content': base64.b64encode(f.read()).decode('ascii'),
+            }
+            for key, f in request.files.items()
+        }
+    elif request.form:
+        data['form'] = request.form.to_dict()
+    else:
+        data['body'] = request.get_data(as_text=True)
+        data['content_type'] = request.content_type
+    return data
+
+
+def background_job(kind: str):
+    """ديكوريتر: عند تمرير async=true يتم تنفيذ الطلب كمهمة خلفية وإرجاع رقم المهمة فوراً (202)
+
+    يوضع بعد jwt_required حتى يتم التحقق من التوكن قبل إنشاء المهمة.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if str(request.args.get('async', '')).strip().lower() not in ('1', 'true', 'yes'):
+                return f(*args, **kwargs)
+            from flask import g
+            from flask_jwt_extended import get_jwt_identity
+            from utils.helpers import format_response
+
+            job_id = get_job_runner().submit(kind, _capture_request(), created_by=get_jwt_identity())
+            # Nothing is written yet; the replayed request bumps the public ETags when it runs
+            g.skip_scope_bump = True
+            return format_response(
+                data={'job_id': job_id, 'status': JOB_QUEUED, 'status_url': f'/api/jobs/{job_id}'},
+                message='تم إنشاء المهمة وسيتم تنفيذها في الخلفية',
+                status_code=202,
+            )
+        return decorated_function
+    return decorator
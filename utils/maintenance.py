@@ -0,0 +1,243 @@
+import glob
+import os
+from datetime import date
+from flask import current_app
+
+# مهام الصيانة الدورية (كانت سكربتات منفصلة). كل دالة تعمل داخل سياق التطبيق
+# وترجع عدد الصفوف/الملفات التي تم تعديلها (أو تقريراً فيه rows) ليسجلها المجدول في مقاييس التشغيل.
+
+POSTPONEMENT_REVERT_FIELDS = {
+    "is_postponed": False,
+    "is_moved_out": False,
+    "postponed_date": None,
+    "postponed_to_room_id": None,
+    "postponed_reason": None,
+    "postponed_start_time": None,
+    "postponed_end_time": None,
+    "original_booking_date": None,
+    "moved_to_schedule_id": None,
+}
+
+
+def revert_past_postponements(dry_run: bool = False) -> dict:
+    """إرجاع المحاضرات المؤجلة التي مضى تاريخ تأجيلها وحذف الحجوزات المؤقتة المرتبطة بها
+
+    تعمل على مجموعات: تحديث واحد بـ in_ للمحاضرات الأصلية وحذف واحد بـ in_ للحجوزات المؤقتة
+    (مقسمة على دفعات IN_FILTER_CHUNK_SIZE). التشغيل المتكرر آمن: الحجوزات المؤقتة يتم إيجادها
+    أيضاً بتاريخها (original_booking_date) فلا يبقى منها شيء لو انقطع تشغيل سابق بعد التحديث.
+    مع dry_run=True يُرجع التقرير فقط دون أي كتابة.
+    """
+    from models import _chunked, select_all_pages
+
+    supabase = current_app.supabase
+    today = date.today().isoformat()
+
+    originals = select_all_pages(
+        supabase.table("schedules")
+        .select("id, moved_to_schedule_id, postponed_date")
+        .eq("is_postponed", True)
+        .lt("postponed_date", today)
+        .order("id")
+    )
+    original_ids = [row["id"] for row in originals]
+
+    temporary_ids = {row["moved_to_schedule_id"] for row in originals if row.get("moved_to_schedule_id")}
+    temporary_ids.update(
+        row["id"]
+        for row in select_all_pages(
+            supabase.table("schedules")
+            .select("id")
+            .eq("is_temporary_move_in", True)
+            .lt("original_booking_date", today)
+            .order("id")
+        )
+    )
+    # Temporary move-ins linked only through original_schedule_id
+    for chunk in _chunked(original_ids):
+        res = (
+            supabase.table("schedules")
+            .select("id")
+            .eq("is_temporary_move_in", True)
+            .in_("original_schedule_id", chunk)
+            .execute()
+        )
+        temporary_ids.update(row["id"] for row in res.data or [])
+    temporary_ids = sorted(temporary_ids)
+
+    report = {
+        "dry_run": dry_run,
+        "reverted": original_ids,
+        "deleted_temporary": temporary_ids,
+        "rows": len(original_ids) + len(temporary_ids),
+    }
+    if dry_run or not report["rows"]:
+        return report
+
+    # Clear the links first so deleting the temporary rows never trips moved_to_schedule_id
+    for chunk in _chunked(original_ids):
+        supabase.table("schedules").update(POSTPONEMENT_REVERT_FIELDS).in_("id", chunk).execute()
+    for chunk in _chunked(temporary_ids):
+        supabase.table("schedule_doctors").delete().in_("schedule_id", chunk).execute()
+        supabase.table("schedules").delete().in_("id", chunk).execute()
+
+    return report
+
+
+def _apply_instructor_names(supabase, changes: dict) -> int:
+    """changes: {schedule_id: new_name}؛ تحديث واحد بـ in_ لكل اسم (مقسم على دفعات)"""
+    from models import _chunked
+
+    ids_by_name = {}
+    for schedule_id, name in changes.items():
+        ids_by_name.setdefault(name, []).append(schedule_id)
+    for name, schedule_ids in ids_by_name.items():
+        for chunk in _chunked(sorted(schedule_ids)):
+            supabase.table("schedules").update({"instructor_name": name}).in_("id", chunk).execute()
+    return len(changes)
+
+
+def _sync_doctor_instructor_name(supabase, doctor_id) -> dict:
+    """المسار التزايدي بعد تعديل اسم دكتور واحد: جداوله فقط (doctor_id أو كدكتور أساسي)"""
+    from models import _chunked, select_all_pages
+
+    doctor_res = supabase.table("doctors").select("id, name").eq("id", doctor_id).execute()
+    if not doctor_res.data:
+        return {}
+    name = doctor_res.data[0]["name"]
+
+    candidate_ids = {
+        row["id"]
+        for row in select_all_pages(
+            supabase.table("schedules").select("id").eq("is_active", True).eq("doctor_id", doctor_id).order("id")
+        )
+    }
+    primary_ids = {
+        row["schedule_id"]
+        for row in select_all_pages(
+            supabase.table("schedule_doctors").select("schedule_id")
+            .eq("doctor_id", doctor_id).eq("is_primary", True).order("schedule_id")
+        )
+    }
+
+    changes = {}
+    for chunk in _chunked(sorted(candidate_ids | primary_ids)):
+        schedules = supabase.table("schedules").select("id, instructor_name").in_("id", chunk).execute().data or []
+        # A schedule whose primary doctor is someone else keeps that doctor's name
+        other_primary = {
+            row["schedule_id"]
+            for row in supabase.table("schedule_doctors").select("schedule_id, doctor_id")
+            .eq("is_primary", True).in_("schedule_id", chunk).execute().data or []
+            if row["doctor_id"] != doctor_id
+        }
+        for schedule in schedules:
+            if schedule["id"] in other_primary and schedule["id"] not in primary_ids:
+                continue
+            if schedule["instructor_name"] != name:
+                changes[schedule["id"]] = name
+    return changes
+
+
+def sync_instructor_names(doctor_id=None, dry_run: bool = False) -> dict:
+    """مزامنة instructor_name مع اسم الدكتور
+
+    الاسم المطلوب لكل جدول هو اسم الدكتور الأساسي في schedule_doctors إن وجد، وإلا اسم doctor_id
+    (للجداول الفعالة). تتم المطابقة في الذاكرة: قراءة واحدة للدكاترة وواحدة للجداول، ثم تحديث
+    الجداول المختلفة فقط بطلبات in_ مجمعة حسب الاسم. مع doctor_id تتم مزامنة جداول هذا الدكتور فقط.
+    """
+    from models import select_all_pages
+
+    supabase = current_app.supabase
+
+    if doctor_id is not None:
+        changes = _sync_doctor_instructor_name(supabase, doctor_id)
+    else:
+        names = {
+            row["id"]: row["name"]
+            for row in select_all_pages(supabase.table("doctors").select("id, name").order("id"))
+        }
+        primary_by_schedule = {
+            row["schedule_id"]: row["doctor_id"]
+            for row in select_all_pages(
+                supabase.table("schedule_doctors").select("schedule_id, doctor_id")
+                .eq("is_primary", True).order("schedule_id")
+            )
+        }
+        schedules = select_all_pages(
+            supabase.table("schedules").select("id, doctor_id, instructor_name, is_active").order("id")
+        )
+
+        changes = {}
+        for schedule in schedules:
+            if schedule["id"] in primary_by_schedule:
+                expected = names.get(primary_by_schedule[schedule["id"]])
+            elif schedule.get("doctor_id") is not None and schedule.get("is_active"):
+                expected = names.get(schedule["doctor_id"])
+            else:
+                continue
+            if expected and schedule["instructor_name"] != expected:
+                changes[schedule["id"]] = expected
+
+    report = {
+        "dry_run": dry_run,
+        "doctor_id": doctor_id,
+        "updated": [{"schedule_id": k, "instructor_name": v} for k, v in sorted(changes.items())],
+        "rows": len(changes),
+    }
+    if not dry_run and changes:
+        _apply_instructor_names(supabase, changes)
+    return report
+
+
+def regenerate_qr_codes(rooms=None, progress=None) -> dict:
+    """إعادة إنشاء QR Code للقاعات المحددة (أو لكل القاعات الفعالة)
+
+    progress(fraction, message) اختيارية لتحديث تقدم المهمة الخلفية.
+    """
+    from utils.qr_generator import generate_room_qr, delete_room_qr
+
+    supabase = current_app.supabase
+    if rooms is None:
+        rooms = supabase.table("rooms").select("id, code, qr_code_path").eq("is_active", True).execute().data or []
+
+    regenerated = []
+    failed = []
+    for position, room in enumerate(rooms, start=1):
+        if room.get("qr_code_path") and os.path.exists(room["qr_code_path"]):
+            try:
+                delete_room_qr(room["qr_code_path"])
+            except Exception:
+                pass
+
+        qr_path = generate_room_qr(room["code"], room["id"])
+        if qr_path:
+            supabase.table("rooms").update({"qr_code_path": qr_path}).eq("id", room["id"]).execute()
+            regenerated.append({"room_id": room["id"], "code": room["code"], "qr_code_path": qr_path})
+        else:
+            failed.append({"room_id": room["id"], "code": room["code"]})
+        if progress:
+            progress(position / len(rooms), f"القاعة {room['code']}")
+
+    return {"regenerated": regenerated, "failed": failed, "rows": len(regenerated)}
+
+
+def delete_qr_code_files() -> int:
+    """حذف جميع ملفات QR المولدة وتصفير qr_code_path (تُنشأ من جديد عند الطلب)"""
+    qr_folder = current_app.config.get("QR_CODE_FOLDER", "static/qrcodes")
+    deleted_count = 0
+    for qr_file in glob.glob(os.path.join(qr_folder, "room_*_qr.png")):
+        try:
+            os.remove(qr_file)
+            deleted_count += 1
+        except OSError as e:
+            current_app.logger.warning("Could not delete %s: %s", qr_file, e)
+
+    current_app.supabase.table("rooms").update({"qr_code_path": None}).neq("id", 0).execute()
+    return deleted_count
+
+
+def purge_finished_jobs() -> int:
+    """حذف سجلات المهام الخلفية المنتهية الأقدم من JOBS_RETENTION_HOURS"""
+    from utils.jobs import get_job_runner
+
+    hours = current_app.config.get("JOBS_RETENTION_HOURS", 24)
+    return get_job_runner().store.purge(hours * 3600)
@@ -0,0 +1,322 @@
+import datetime as _dt
+from flask import current_app
+from utils.conflict_engine import ConflictEngine
+
+VALID_STUDY_TYPES = ['morning', 'evening']
+VALID_ACADEMIC_STAGES = ['first', 'second', 'third', 'fourth']
+VALID_DAYS = ['sunday', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday']
+
+# ترتيب الفحوصات مطابق للفحص السابق صفاً بصف: أول خطأ في الصف هو الذي يُسجل
+_MISSING_CHECKS = (
+    ("start_time", "وقت البدء مفقود أو غير صالح"),
+    ("end_time", "وقت الانتهاء مفقود أو غير صالح"),
+    ("subject_name", "اسم المادة مفقود أو غير صالح"),
+    ("instructor_name", "اسم المدرس مفقود أو غير صالح"),
+)
+
+
+def _excel_time_to_str(value):
+    """تحويل قيمة وقت من Excel (نص، كسر من اليوم، time/datetime) إلى HH:MM أو None"""
+    if value is None:
+        return None
+    if isinstance(value, (_dt.time, _dt.datetime)):
+        return value.strftime("%H:%M")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value != value or not 0 <= value < 1:  # NaN أو خارج نطاق اليوم
+            return None
+        minutes = int(round(value * 24 * 60))
+        return f"{minutes // 60:02d}:{minutes % 60:02d}" if minutes < 24 * 60 else None
+    text = str(value).strip()
+    try:
+        return _dt.datetime.strptime(text, "%H:%M").strftime("%H:%M")
+    except ValueError:
+        return None
+
+
+def normalize_time_column(series):
+    """تحويل عمود أوقات كامل إلى نصوص HH:MM (القيم غير الصالحة تصبح None)"""
+    return series.map(_excel_time_to_str)
+
+
+def _clean_text(series):
+    return series.fillna("").astype(str).str.strip()
+
+
+def prepare_schedule_rows(df, doctors):
+    """التحقق من صفوف ملف الجدول الأسبوعي دفعة واحدة باستخدام عمليات pandas على الأعمدة
+
+    تُرجع (rows, errors, warnings):
+      - rows: قائمة قواميس جاهزة للإدراج (بدون room_id/department_id) مع المفتاح "_row" لرقم الصف في Excel
+      - errors / warnings: قوائم من (رقم الصف، رسالة) مرتبة حسب الصف
+    """
+    import pandas as pd
+
+    row_numbers = pd.Series(df.index + 2, index=df.index)
+    error_of = pd.Series(None, index=df.index, dtype=object)
+
+    def flag(mask, message):
+        mask = mask & error_of.isna()
+        error_of[mask] = message
+
+    for column, message in _MISSING_CHECKS:
+        flag(df[column].isna(), message)
+
+    study_type = _clean_text(df["study_type"]).str.lower()
+    academic_stage = _clean_text(df["academic_stage"]).str.lower()
+    day_of_week = _clean_text(df["day_of_week"]).str.lower()
+    flag(~study_type.isin(VALID_STUDY_TYPES), "نوع الدراسة غير صحيح")
+    flag(~academic_stage.isin(VALID_ACADEMIC_STAGES), "المرحلة الدراسية غير صحيحة")
+    flag(~day_of_week.isin(VALID_DAYS), "يوم الأسبوع غير صحيح")
+
+    start_time = normalize_time_column(df["start_time"])
+    end_time = normalize_time_column(df["end_time"])
+    flag(start_time.isna() | end_time.isna(), "صيغة الوقت غير صحيحة (استخدم HH:MM)")
+
+    instructor = _clean_text(df["instructor_name"])
+    flag(instructor == "", "اسم المدرس مطلوب")
+
+    # مطابقة أسماء الدكاترة (بدون حساسية لحالة الأحرف ثم مطابقة تامة)
+    by_lower = {d['name'].strip().lower(): d['id'] for d in doctors if d.get('name')}
+    by_exact = {d['name'].strip(): d['id'] for d in doctors if d.get('name')}
+    doctor_id = instructor.str.lower().map(by_lower)
+    doctor_id = doctor_id.where(doctor_id.notna(), instructor.map(by_exact))
+
+    warnings = [
+        (n, f"اسم المدرس '{name}' غير موجود في قاعدة البيانات. سيتم حفظ الاسم كنص فقط.")
+        for n, name in zip(
+            row_numbers[error_of.isna() & doctor_id.isna()],
+            instructor[error_of.isna() & doctor_id.isna()],
+        )
+    ]
+
+    # "HH:MM" المبطنة بالأصفار قابلة للمقارنة نصياً
+    flag(start_time.fillna("") >= end_time.fillna(""), "وقت البداية يجب أن يكون قبل وقت النهاية")
+
+    if "lecture_type" in df.columns:
+        lecture_type = _clean_text(df["lecture_type"]).replace("", "نظري")
+    else:
+        lecture_type = pd.Series("نظري", index=df.index)
+    is_theoretical = lecture_type == "نظري"
+
+    # الشعبة الفارغة تعني 1 (كما في السابق)، أما القيمة غير الرقمية فهي خطأ في الصف وليست 1
+    section_raw = df["section"].where(_clean_text(df["section"]) != "")
+    section_number = pd.to_numeric(section_raw, errors="coerce")
+    bad_section = section_raw.notna() & (section_number.isna() | (section_number % 1 != 0))
+    flag(is_theoretical & bad_section, "رقم الشعبة غير صحيح")
+    section = section_number.where(~bad_section).fillna(1).astype(int)
+    group = _clean_text(df["group"]).replace("", "A")
+    notes = _clean_text(df["notes"]) if "notes" in df.columns else pd.Series("", index=df.index)
+    subject = _clean_text(df["subject_name"])
+
+    errors = [(n, message) for n, message in zip(row_numbers[error_of.notna()], error_of[error_of.notna()])]
+
+    valid = error_of.isna()
+    rows = []
+    for idx in df.index[valid.to_numpy()]:
+        theoretical = bool(is_theoretical[idx])
+        row = {
+            "_row": int(row_numbers[idx]),
+            "_index": idx,
+            "study_type": study_type[idx],
+            "academic_stage": academic_stage[idx],
+            "day_of_week": day_of_week[idx],
+            "start_time": start_time[idx],
+            "end_time": end_time[idx],
+            "subject_name": subject[idx],
+            "instructor_name": instructor[idx],  # Always save the name for display
+            "notes": notes[idx],
+            "lecture_type": "theoretical" if theoretical else "practical",
+            "section_number": int(section[idx]) if theoretical else None,
+            "group_letter": None if theoretical else group[idx],
+            "is_active": True,
+            # Always present so every row in a bulk insert has the same keys
+            "doctor_id": int(doctor_id[idx]) if pd.notna(doctor_id[idx]) else None,
+        }
+        rows.append(row)
+
+    return rows, errors, warnings
+
+
+def bulk_insert_schedules(supabase, rows, chunk_size=None):
+    """إدراج الصفوف المقبولة على دفعات
+
+    تُرجع (created, failed) حيث failed قائمة من (الصف، رسالة الخطأ) للدفعات التي فشلت.
+    المفاتيح الداخلية التي تبدأ بـ "_" (مثل "_row") تُزال قبل الإرسال.
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config.get('SCHEDULE_INSERT_CHUNK_SIZE', 500)
+
+    created = []
+    failed = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        payload = [{k: v for k, v in row.items() if not k.startswith("_")} for row in chunk]
+        try:
+            res = supabase.table("schedules").insert(payload).execute()
+            created.extend(res.data or [])
+        except Exception as e:
+            failed.extend((row, str(e)) for row in chunk)
+    return created, failed
+
+
+def replace_room_schedules(supabase, room_id, rows, chunk_size=None):
+    """استبدال جميع جداول قاعة بالصفوف المقبولة من الملف
+
+    فك روابط التأجيل/النقل، حذف الجداول الحالية، كشف التداخل بين صفوف الملف في الذاكرة
+    ثم الإدراج المجمع. تُرجع (created, row_errors) حيث row_errors قائمة من (رقم الصف، رسالة).
+    """
+    schedules_to_delete_res = supabase.table("schedules").select("id").eq("room_id", room_id).execute()
+    schedules_to_delete_ids = [s["id"] for s in schedules_to_delete_res.data]
+
+    if schedules_to_delete_ids:
+        # Nullify moved_to_schedule_id / original_schedule_id references to schedules in this room
+        supabase.table("schedules").update({"moved_to_schedule_id": None}).in_("moved_to_schedule_id", schedules_to_delete_ids).execute()
+        supabase.table("schedules").update({"original_schedule_id": None}).in_("original_schedule_id", schedules_to_delete_ids).execute()
+    supabase.table("schedules").delete().eq("room_id", room_id).execute()
+
+    # The room is now empty, so only rows of this file can clash with each other
+    engine = ConflictEngine()
+    row_errors = []
+    accepted_rows = []
+    for row in rows:
+        row["room_id"] = room_id
+        if engine.room_conflict(room_id, row["day_of_week"], row["study_type"], row["start_time"], row["end_time"]):
+            row_errors.append((row["_row"], "يوجد تداخل مع محاضرة أخرى في نفس القاعة والوقت"))
+            continue
+        engine.add(row)
+        accepted_rows.append(row)
+
+    created, failed_rows = bulk_insert_schedules(supabase, accepted_rows, chunk_size)
+    row_errors.extend(
+        (row["_row"], f"خطأ في معالجة البيانات - {error}") for row, error in failed_rows
+    )
+    return created, row_errors
+
+
+# الحقول التي تحدد "نفس المحاضرة" عند مقارنة الملف بالجداول الحالية
+SCHEDULE_MATCH_FIELDS = (
+    "study_type", "academic_stage", "day_of_week", "start_time", "end_time",
+    "lecture_type", "section_number", "group_letter",
+)
+# الحقول التي تُحدَّث إذا تغيرت قيمتها في الملف
+SCHEDULE_UPDATE_FIELDS = (
+    "subject_name", "instructor_name", "notes", "doctor_id", "department_id", "is_active",
+)
+_TEXT_FIELDS = ("subject_name", "instructor_name", "notes")
+
+
+def _field_value(row, field):
+    value = row.get(field)
+    if field in ("start_time", "end_time") and value is not None:
+        return str(value)[:5]
+    if field in _TEXT_FIELDS and value is None:
+        return ""
+    return value
+
+
+def _match_key(row):
+    key = []
+    for field in SCHEDULE_MATCH_FIELDS:
+        value = _field_value(row, field)
+        key.append(value.lower() if isinstance(value, str) else value)
+    return tuple(key)
+
+
+def diff_room_schedules(existing, rows):
+    """حساب الفرق بين الجداول الحالية للقاعة وصفوف الملف
+
+    تُرجع (to_insert, to_update, to_delete, unchanged_count) حيث to_update قائمة من
+    (السجل الحالي، التغييرات) و to_delete قائمة السجلات الحالية غير الموجودة في الملف.
+    """
+    pool = {}
+    for schedule in existing:
+        pool.setdefault(_match_key(schedule), []).append(schedule)
+
+    to_insert, to_update = [], []
+    unchanged = 0
+    for row in rows:
+        candidates = pool.get(_match_key(row))
+        if not candidates:
+            to_insert.append(row)
+            continue
+        current = candidates.pop(0)
+        changes = {
+            field: row.get(field)
+            for field in SCHEDULE_MATCH_FIELDS + SCHEDULE_UPDATE_FIELDS
+            if field in row and _field_value(current, field) != _field_value(row, field)
+        }
+        if changes:
+            to_update.append((current, changes))
+        else:
+            unchanged += 1
+
+    to_delete = [schedule for candidates in pool.values() for schedule in candidates]
+    return to_insert, to_update, to_delete, unchanged
+
+
+def sync_room_schedules(supabase, room_id, rows, chunk_size=None, dry_run=False):
+    """مزامنة جداول قاعة مع صفوف الملف بتطبيق الفرق فقط (إدراج/تحديث/حذف على دفعات)
+
+    الجداول المؤقتة (is_temporary_move_in) لا تدخل في المقارنة ولا تُحذف.
+    عند dry_run=True لا تتم أي كتابة ويُعاد الفرق للمعاينة.
+    تُرجع (report, row_errors) حيث report قاموس يحتوي created/updated/deleted وعدد غير المتغير.
+    """
+    from models import _chunked
+
+    existing_res = supabase.table("schedules").select("*").eq("room_id", room_id).execute()
+    existing = [s for s in existing_res.data or [] if not s.get("is_temporary_move_in")]
+
+    # Clashes are checked against the sheet itself, which becomes the room's regular timetable
+    engine = ConflictEngine()
+    row_errors = []
+    accepted_rows = []
+    for row in rows:
+        row["room_id"] = room_id
+        if engine.room_conflict(room_id, row["day_of_week"], row["study_type"], row["start_time"], row["end_time"]):
+            row_errors.append((row["_row"], "يوجد تداخل مع محاضرة أخرى في نفس القاعة والوقت"))
+            continue
+        engine.add(row)
+        accepted_rows.append(row)
+
+    to_insert, to_update, to_delete, unchanged = diff_room_schedules(existing, accepted_rows)
+    report = {
+        "created": [{k: v for k, v in row.items() if not k.startswith("_")} for row in to_insert],
+        "updated": [{"id": current["id"], "changes": changes} for current, changes in to_update],
+        "deleted": [current["id"] for current in to_delete],
+        "unchanged_count": unchanged,
+    }
+    if dry_run:
+        return report, row_errors
+
+    if chunk_size is None:
+        chunk_size = current_app.config.get('SCHEDULE_INSERT_CHUNK_SIZE', 500)
+
+    delete_ids = report["deleted"]
+    for chunk in _chunked(delete_ids, chunk_size):
+        # Nullify references to the removed schedules before deleting them
+        supabase.table("schedules").update({"moved_to_schedule_id": None}).in_("moved_to_schedule_id", chunk).execute()
+        supabase.table("schedules").update({"original_schedule_id": None}).in_("original_schedule_id", chunk).execute()
+        supabase.table("schedules").delete().in_("id", chunk).execute()
+
+    # Updates are sent as full rows so one upsert per chunk can carry different changes
+    upserts = [{**current, **changes} for current, changes in to_update]
+    updated = []
+    for start in range(0, len(upserts), chunk_size):
+        chunk = upserts[start:start + chunk_size]
+        try:
+            res = supabase.table("schedules").upsert(chunk).execute()
+            updated.extend(res.data or [])
+        except Exception as e:
+            row_errors.extend(
+                (row["_row"], f"خطأ في معالجة البيانات - {str(e)}")
+                for row in accepted_rows
+                if any(_match_key(row) == _match_key(u) for u in chunk)
+            )
+
+    created, failed_rows = bulk_insert_schedules(supabase, to_insert, chunk_size)
+    row_errors.extend(
+        (row["_row"], f"خطأ في معالجة البيانات - {error}") for row, error in failed_rows
+    )
+    report["created"] = created
+    report["updated"] = updated
+    return report, row_errors
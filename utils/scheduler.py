@@ -0,0 +1,303 @@
+import atexit
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-flight is enforced per process only
+    fcntl = None
+
+
+class _FileLock:
+    """قفل غير حاجز بين العمليات (عدة عمال للخادم على نفس الجهاز) عبر flock"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def acquire(self) -> bool:
+        if fcntl is None:
+            return True
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class ScheduledJob:
+    """مهمة مسجلة في المجدول: دورية (interval بالثواني) أو عند الطلب فقط (interval=None)"""
+
+    def __init__(self, name: str, func, interval=None, description: str = None, history_size: int = 20):
+        self.name = name
+        self.func = func
+        self.interval = float(interval) if interval else None
+        self.description = description
+        self.next_run = None
+        self.lock = threading.Lock()
+        self.history = deque(maxlen=history_size)
+        self.metrics = {
+            'runs': 0,
+            'failures': 0,
+            'skipped': 0,
+            'rows_touched': 0,
+            'total_duration_ms': 0.0,
+            'last_duration_ms': None,
+            'last_run_at': None,
+            'last_status': None,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'description': self.description,
+            'interval_seconds': self.interval,
+            'running': self.lock.locked(),
+            'seconds_until_next_run': (
+                max(0, round(self.next_run - time.monotonic())) if self.next_run is not None else None
+            ),
+            'metrics': dict(self.metrics),
+            'history': list(self.history),
+        }
+
+
+def _rows_from_result(result) -> int:
+    if isinstance(result, bool) or result is None:
+        return 0
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict):
+        return int(result.get('rows', 0) or 0)
+    if isinstance(result, (list, tuple, set)):
+        return len(result)
+    return 0
+
+
+class Scheduler:
+    """مجدول مهام الصيانة داخل العملية
+
+    - سجل مهام مسماة، دورية أو عند الطلب (run_now)
+    - jitter عشوائي على كل فترة حتى لا تتزامن المهام بين عمال الخادم
+    - تشغيل فردي (single-flight): قفل داخل العملية + قفل ملف بين العمليات، والتشغيل المتداخل يُتخطى
+    - سجل آخر التشغيلات ومقاييس المدة وعدد الصفوف المعدلة لكل مهمة
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.jobs = {}
+        self.jitter_ratio = max(0.0, float(app.config.get('SCHEDULER_JITTER_RATIO', 0.1)))
+        self.lock_dir = app.config.get('SCHEDULER_LOCK_DIR', os.path.join('instance', 'scheduler'))
+        self.history_size = app.config.get('SCHEDULER_HISTORY_SIZE', 20)
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config.get('SCHEDULER_MAX_WORKERS', 2),
+            thread_name_prefix='scheduler-job',
+        )
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _jittered(self, interval: float) -> float:
+        return interval + random.uniform(0, interval * self.jitter_ratio)
+
+    def register(self, name: str, func, interval=None, description: str = None, run_at_start: bool = False):
+        """تسجيل مهمة؛ interval=None تعني مهمة عند الطلب فقط"""
+        job = ScheduledJob(name, func, interval, description, self.history_size)
+        if job.interval:
+            delay = random.uniform(0, job.interval * self.jitter_ratio) if run_at_start else self._jittered(job.interval)
+            job.next_run = time.monotonic() + delay
+        self.jobs[name] = job
+        self._wake.set()
+        return job
+
+    def _execute(self, job: ScheduledJob, trigger: str, **kwargs):
+        if not job.lock.acquire(blocking=False):
+            job.metrics['skipped'] += 1
+            return None
+        file_lock = _FileLock(os.path.join(self.lock_dir, f"{job.name}.lock"))
+        try:
+            if not file_lock.acquire():
+                # Another server process is running this job right now
+                job.metrics['skipped'] += 1
+                return None
+            started = time.perf_counter()
+            entry = {
+                'started_at': datetime.now(timezone.utc).isoformat(),
+                'trigger': trigger,
+                'status': 'succeeded',
+                'rows': 0,
+                'error': None,
+            }
+            result = None
+            try:
+                with self.app.app_context():
+                    result = job.func(**kwargs)
+                entry['rows'] = _rows_from_result(result)
+            except Exception as e:
+                entry['status'] = 'failed'
+                entry['error'] = str(e)
+                job.metrics['failures'] += 1
+                self.app.logger.exception('Scheduled job %s failed', job.name)
+            finally:
+                file_lock.release()
+
+            entry['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            job.history.appendleft(entry)
+            job.metrics['runs'] += 1
+            job.metrics['rows_touched'] += entry['rows']
+            job.metrics['total_duration_ms'] += entry['duration_ms']
+            job.metrics['last_duration_ms'] = entry['duration_ms']
+            job.metrics['last_run_at'] = entry['started_at']
+            job.metrics['last_status'] = entry['status']
+            return result
+        finally:
+            job.lock.release()
+
+    def run_now(self, name: str, wait: bool = False, **kwargs):
+        """تشغيل مهمة فوراً (عند الطلب)؛ مع wait=True ترجع نتيجة المهمة"""
+        job = self.jobs[name]
+        future = self._executor.submit(self._execute, job, 'manual', **kwargs)
+        return future.result() if wait else future
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if job.next_run is not None and job.next_run <= now:
+                    job.next_run = now + self._jittered(job.interval)
+                    self._executor.submit(self._execute, job, 'schedule')
+            pending = [job.next_run for job in self.jobs.values() if job.next_run is not None]
+            wait = (min(pending) - time.monotonic()) if pending else 60
+            self._wake.clear()
+            self._wake.wait(max(0.5, wait))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+        self._executor.shutdown(wait=False)
+
+    def status(self) -> list:
+        return [job.to_dict() for job in self.jobs.values()]
+
+
+def get_scheduler() -> Scheduler:
+    from flask import current_app
+
+    return current_app.extensions['scheduler']
+
+
+def run_job_once(name: str, **kwargs):
+    """تشغيل مهمة مسجلة مرة واحدة من سكربت يدوي (بنفس قفل التشغيل الفردي الذي يستخدمه الخادم)
+
+    ترجع (النتيجة، سجل التشغيل)، والسجل None إذا كانت المهمة قيد التشغيل في عملية أخرى.
+    """
+    from app import create_app
+
+    # No job recovery, usage logger or scheduler loop: the script must not pick up the server's work
+    app = create_app(background_services=False)
+    job = app.extensions['scheduler'].jobs[name]
+    runs_before = job.metrics['runs']
+    result = app.extensions['scheduler'].run_now(name, wait=True, **kwargs)
+    entry = job.history[0] if job.metrics['runs'] > runs_before else None
+    return result, entry
+
+
+def sweep_expired_announcements():
+    """حذف الإعلانات المنتهية الصلاحية بطلب حذف واحد، وإبطال ETags الإعلانات العامة عند الحذف"""
+    from flask import current_app
+    from models import delete_expired_announcements
+    from utils.cache import bump_scope_versions
+
+    deleted = delete_expired_announcements()
+    if deleted:
+        bump_scope_versions(current_app, 'announcements')
+        current_app.logger.info('Deleted %d expired announcements', len(deleted))
+    return deleted
+
+
+def _revert_past_postponements(dry_run: bool = False):
+    from flask import current_app
+    from models import invalidate_room_timetables
+    from utils.cache import bump_scope_versions
+    from utils.maintenance import revert_past_postponements
+
+    report = revert_past_postponements(dry_run=dry_run)
+    if report['rows'] and not dry_run:
+        invalidate_room_timetables()
+        bump_scope_versions(current_app, 'schedules')
+    return report
+
+
+def _sync_instructor_names(dry_run: bool = False):
+    from flask import current_app
+    from models import invalidate_room_timetables
+    from utils.cache import bump_scope_versions
+    from utils.maintenance import sync_instructor_names
+
+    report = sync_instructor_names(dry_run=dry_run)
+    if report['rows'] and not dry_run:
+        invalidate_room_timetables()
+        bump_scope_versions(current_app, 'schedules')
+    return report
+
+
+def init_scheduler(app, start: bool = True) -> Scheduler:
+    """تسجيل مهام الصيانة وتشغيل المجدول (يمكن تعطيله بـ SCHEDULER_ENABLED=False أو start=False)"""
+    from utils.maintenance import regenerate_qr_codes, delete_qr_code_files, purge_finished_jobs
+
+    scheduler = Scheduler(app)
+    scheduler.register(
+        'sweep_expired_announcements', sweep_expired_announcements,
+        interval=app.config.get('ANNOUNCEMENT_SWEEP_INTERVAL_SECONDS', 300),
+        description='حذف الإعلانات المنتهية الصلاحية', run_at_start=True,
+    )
+    scheduler.register(
+        'revert_past_postponements', _revert_past_postponements,
+        interval=app.config.get('POSTPONEMENT_REVERT_INTERVAL_SECONDS', 900),
+        description='إرجاع المحاضرات المؤجلة بعد مضي تاريخ التأجيل', run_at_start=True,
+    )
+    scheduler.register(
+        'sync_instructor_names', _sync_instructor_names,
+        interval=app.config.get('INSTRUCTOR_SYNC_INTERVAL_SECONDS', 86400),
+        description='مزامنة أسماء المحاضرين مع جدول الدكاترة',
+    )
+    scheduler.register(
+        'purge_finished_jobs', purge_finished_jobs,
+        interval=3600, description='حذف سجلات المهام الخلفية القديمة',
+    )
+    scheduler.register(
+        'regenerate_qr_codes', regenerate_qr_codes,
+        description='إعادة إنشاء QR Code لجميع القاعات (عند الطلب)',
+    )
+    scheduler.register(
+        'delete_qr_code_files', delete_qr_code_files,
+        description='حذف ملفات QR القديمة (عند الطلب)',
+    )
+    app.extensions['scheduler'] = scheduler
+    if start and app.config.get('SCHEDULER_ENABLED', True):
+        scheduler.start()
+        atexit.register(scheduler.shutdown)
+    return scheduler
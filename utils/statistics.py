@@ -0,0 +1,153 @@
+import threading
+from datetime import datetime, timezone
+from flask import current_app
+from utils.cache import get_app_cache, get_scope_versions
+
+# أي كتابة على هذه النطاقات في هذه العملية تُبطل اللقطة فوراً (راجع WRITE_SCOPES_BY_BLUEPRINT)
+STATS_SCOPES = ('users', 'departments', 'rooms', 'schedules', 'students')
+
+_refresh_lock = threading.Lock()
+
+
+def _count(query) -> int:
+    # Callers select with count="exact", head=True: only the Content-Range total comes back
+    return query.execute().count or 0
+
+
+# Per-department counts in one round-trip when this function is installed in Supabase:
+#
+#   create or replace function department_statistics()
+#   returns table(department_id bigint, total_students bigint, active_schedules bigint)
+#   language sql stable as $$
+#       select d.id,
+#              (select count(*) from students s where s.department_id = d.id),
+#              (select count(*) from schedules sc join rooms r on r.id = sc.room_id
+#                where sc.is_active and r.department_id = d.id)
+#       from departments d;
+#   $$;
+
+def _department_counts_rpc(supabase):
+    """{department_id: (total_students, active_schedules)} من الدالة المجمعة، أو None إذا لم تكن مثبتة"""
+    try:
+        rows = supabase.rpc("department_statistics").execute().data or []
+    except Exception as e:
+        if "PGRST202" not in str(e) and "Could not find the function" not in str(e):
+            raise
+        return None
+    return {row["department_id"]: (row["total_students"] or 0, row["active_schedules"] or 0) for row in rows}
+
+
+def _count_schedules_in_rooms(supabase, room_ids) -> int:
+    from models import _chunked
+
+    return sum(
+        _count(
+            supabase.table("schedules").select("id", count="exact", head=True)
+            .eq("is_active", True).in_("room_id", chunk)
+        )
+        for chunk in _chunked(list(room_ids))
+    )
+
+
+def build_statistics_snapshot(supabase) -> dict:
+    """بناء لقطة الإحصائيات: المجاميع العامة وتفصيل لكل قسم
+
+    المجاميع تُحسب باستعلامات count="exact" (head=True) دون تنزيل الصفوف، والتفصيل حسب القسم
+    يُقرأ من المستخدمين والقاعات بأعمدة محدودة وعلى صفحات. أعداد الطلاب والجداول لكل قسم تأتي
+    من الدالة department_statistics في طلب واحد، وبدونها تُحسب بطلبي count لكل قسم (2N طلب).
+    """
+    from models import select_all_pages
+
+    departments = select_all_pages(supabase.table("departments").select("id, name").order("id"))
+    users = select_all_pages(supabase.table("users").select("role, department_id, is_active").order("id"))
+    rooms = select_all_pages(supabase.table("rooms").select("id, department_id, is_active").order("id"))
+
+    by_department = {
+        dept["id"]: {
+            "id": dept["id"],
+            "name": dept["name"],
+            "users_by_role": {},
+            "active_users_by_role": {},
+            "total_rooms": 0,
+            "active_rooms": 0,
+            "room_ids": [],
+        }
+        for dept in departments
+    }
+
+    users_by_role = {}
+    for user in users:
+        role = user.get("role")
+        users_by_role[role] = users_by_role.get(role, 0) + 1
+        dept = by_department.get(user.get("department_id"))
+        if dept is not None:
+            dept["users_by_role"][role] = dept["users_by_role"].get(role, 0) + 1
+            if user.get("is_active"):
+                dept["active_users_by_role"][role] = dept["active_users_by_role"].get(role, 0) + 1
+
+    for room in rooms:
+        dept = by_department.get(room.get("department_id"))
+        if dept is not None:
+            dept["total_rooms"] += 1
+            dept["room_ids"].append(room["id"])
+            if room.get("is_active"):
+                dept["active_rooms"] += 1
+
+    grouped = _department_counts_rpc(supabase)
+    for dept in by_department.values():
+        room_ids = dept.pop("room_ids")
+        if grouped is not None:
+            dept["total_students"], dept["active_schedules"] = grouped.get(dept["id"], (0, 0))
+            continue
+        dept["active_schedules"] = _count_schedules_in_rooms(supabase, room_ids) if room_ids else 0
+        dept["total_students"] = _count(
+            supabase.table("students").select("student_id", count="exact", head=True).eq("department_id", dept["id"])
+        )
+
+    totals = {
+        "total_users": _count(supabase.table("users").select("id", count="exact", head=True)),
+        "users_by_role": users_by_role,
+        "total_departments": len(departments),
+        "total_rooms": _count(supabase.table("rooms").select("id", count="exact", head=True)),
+        "active_rooms": sum(1 for room in rooms if room.get("is_active")),
+        "active_schedules": _count(
+            supabase.table("schedules").select("id", count="exact", head=True).eq("is_active", True)
+        ),
+        "total_students": _count(supabase.table("students").select("student_id", count="exact", head=True)),
+    }
+
+    return {
+        "totals": totals,
+        "departments": by_department,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def get_statistics_snapshot(force: bool = False) -> dict:
+    """لقطة الإحصائيات المشتركة بين لوحات المالك والعميد والقسم
+
+    تُحفظ لمدة STATS_SNAPSHOT_TTL_SECONDS، وتُعاد بناؤها فوراً بعد أي كتابة على STATS_SCOPES
+    في هذه العملية. طلب واحد فقط يعيد البناء في نفس الوقت والباقي ينتظر النتيجة.
+    """
+    app = current_app._get_current_object()
+    cache = get_app_cache(
+        app, "statistics_snapshot", maxsize=1,
+        ttl=app.config.get("STATS_SNAPSHOT_TTL_SECONDS", 120),
+    )
+    versions = get_scope_versions(app, STATS_SCOPES)
+    entry = cache.get("snapshot")
+    if not force and entry and entry["versions"] == versions:
+        return entry["snapshot"]
+
+    with _refresh_lock:
+        entry = cache.get("snapshot")
+        if not force and entry and entry["versions"] == versions:
+            return entry["snapshot"]
+        snapshot = build_statistics_snapshot(app.supabase)
+        cache.set("snapshot", {"versions": versions, "snapshot": snapshot})
+        return snapshot
+
+
+def department_breakdown(snapshot: dict) -> list:
+    """تفصيل الأقسام كقائمة مرتبة حسب الاسم (للاستجابات)"""
+    return sorted(snapshot["departments"].values(), key=lambda dept: str(dept["name"]))
@@ -0,0 +1,141 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from flask import current_app
+
+
+class UsageLogger:
+    """مسجل استخدامات مخزَّن مؤقتاً: الطلب يضيف الحدث إلى طابور محدود ويعود فوراً،
+    وخيط خلفي يكتب الأحداث إلى Supabase كدفعات (كل batch_size حدث أو كل flush_interval_ms).
+
+    عند امتلاء الطابور يتم إسقاط الحدث وزيادة عداد dropped بدلاً من إبطاء الطلب.
+    """
+
+    def __init__(self, app, batch_size: int = 100, flush_interval_ms: int = 1000, max_queue: int = 10000):
+        self.app = app
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(1, int(flush_interval_ms)) / 1000.0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = {'enqueued': 0, 'dropped': 0, 'flushed': 0, 'failed': 0, 'batches': 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _ensure_worker(self):
+        # Started lazily and per process, so forked server workers each get their own thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='usage-logger', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, row: dict) -> bool:
+        """إضافة حدث إلى الطابور دون انتظار؛ ترجع False إذا تم إسقاطه"""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _drain(self, first=None, limit: int = None) -> list:
+        batch = [first] if first is not None else []
+        limit = self.batch_size if limit is None else limit
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        from models import insert_general_page_usages
+
+        try:
+            with self.app.app_context():
+                insert_general_page_usages(batch)
+            self._count('flushed', len(batch))
+            self._count('batches')
+        except Exception:
+            self._count('failed', len(batch))
+            self.app.logger.exception('Failed to insert %d general_student_usage records', len(batch))
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            batch = []
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.extend(self._drain(self._queue.get(timeout=remaining), self.batch_size - len(batch)))
+                except queue.Empty:
+                    break
+            with self._flush_lock:
+                self._write(batch)
+
+    def flush(self):
+        """كتابة كل ما في الطابور الآن (يستخدم عند إيقاف الخادم)"""
+        with self._flush_lock:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    return
+                self._write(batch)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data['queued'] = self._queue.qsize()
+        data['capacity'] = self._queue.maxsize
+        return data
+
+
+def init_usage_logger(app) -> UsageLogger:
+    """إنشاء المسجل وربطه بالتطبيق مع تفريغ الطابور عند إيقاف العملية"""
+    logger = UsageLogger(
+        app,
+        batch_size=app.config.get('USAGE_LOG_BATCH_SIZE', 100),
+        flush_interval_ms=app.config.get('USAGE_LOG_FLUSH_INTERVAL_MS', 1000),
+        max_queue=app.config.get('USAGE_LOG_MAX_QUEUE', 10000),
+    )
+    app.extensions['usage_logger'] = logger
+    atexit.register(logger.shutdown)
+    return logger
+
+
+def get_usage_logger() -> UsageLogger:
+    return current_app.extensions['usage_logger']
+
+
+def log_usage_async(student_id, student_name=None, page: str = 'general', meta: dict = None) -> bool:
+    """تسجيل استخدام صفحة بشكل غير متزامن (يُختم used_at بوقت الطلب وليس وقت الكتابة)"""
+    from models import build_general_page_usage
+
+    row = build_general_page_usage(student_id, student_name, page, meta)
+    row['used_at'] = datetime.now(timezone.utc).isoformat()
+    return get_usage_logger().enqueue(row)